@@ -0,0 +1,196 @@
+# =============================================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================================
+
+from __future__ import division
+
+import os
+import json
+
+import numpy as np
+
+from sat_image.grid import grid_hash, grid_to_dict, grid_from_dict
+from sat_image.pipeline import cloud_mask, get_product
+
+# running sums kept per pixel, see PixelAccumulator
+SUMS = ['mean', 'm2', 'sum_t', 'sum_tt', 'sum_y', 'sum_ty']
+EXTREMES = ['min', 'max']
+PEAK = ['peak_value', 'peak_date']
+
+
+class PixelAccumulator(object):
+    ''' Per-pixel statistics of a product, updated one scene at a time.
+
+    Keeps, for every pixel of a grid, the count of valid observations, running mean and
+    sum of squared deviations (Welford's method), minimum, maximum and the sums of a least
+    squares line through the observations against time in years; with phenology, also the
+    value and date of the peak observation. Updates are independent of scene order and a
+    scene already folded in is skipped, so the state saved by save() can be refreshed with
+    only new scenes.
+    '''
+
+    def __init__(self, target, product='ndvi', phenology=False):
+        '''
+        :param target: LandsatImage or profile dict of the grid
+        :param product: pipeline.get_product name
+        :param phenology: also track the peak value and its date
+        '''
+        self.profile = getattr(target, 'rasterio_geometry', target)
+        self.product = product
+        self.phenology = phenology
+        self.scenes = []
+        self.origin = None
+
+        shape = (self.profile['height'], self.profile['width'])
+        self.count = np.zeros(shape, dtype=np.int32)
+        for name in SUMS:
+            setattr(self, '_{}'.format(name), np.zeros(shape, dtype=np.float64))
+        self._min = np.full(shape, np.inf, dtype=np.float32)
+        self._max = np.full(shape, -np.inf, dtype=np.float32)
+        if phenology:
+            self._peak_value = np.full(shape, -np.inf, dtype=np.float32)
+            self._peak_date = np.zeros(shape, dtype=np.int32)
+
+    @classmethod
+    def load(cls, path):
+        """ Accumulator saved with save().
+        :param path: .npz file
+        :return: PixelAccumulator
+        """
+        with np.load(path) as state:
+            meta = json.loads(str(state['meta']))
+            acc = cls(grid_from_dict(meta['grid']), meta['product'], meta['phenology'])
+            acc.scenes, acc.origin = meta['scenes'], meta['origin']
+            acc.count = state['count']
+            for name in SUMS + EXTREMES + (PEAK if acc.phenology else []):
+                setattr(acc, '_{}'.format(name), state[name])
+        return acc
+
+    def save(self, path):
+        """ Write the state to path, an .npz file, replacing it only once complete. """
+        meta = {'grid': grid_to_dict(self.profile), 'product': self.product,
+                'phenology': self.phenology, 'scenes': self.scenes, 'origin': self.origin}
+        arrays = dict((name, getattr(self, '_{}'.format(name)))
+                      for name in SUMS + EXTREMES + (PEAK if self.phenology else []))
+        temp = '{}.tmp'.format(path)
+        with open(temp, 'wb') as f:
+            np.savez(f, meta=np.array(json.dumps(meta)), count=self.count, **arrays)
+        os.replace(temp, path)
+
+    def update(self, image, source=None, layers='cloud_and_shadow', **kwargs):
+        """ Fold in one scene, aligning it to the accumulator's grid if needed.
+        :param image: LandsatImage object
+        :param source: if given, exclude cloudy pixels with this mask source, see pipeline.cloud_mask
+        :param layers: mask layers, see pipeline.cloud_mask
+        :param kwargs: passed to pipeline.cloud_mask
+        :return: True, or False if the scene was already folded in
+        """
+        if image.landsat_scene_id in self.scenes:
+            return False
+        if grid_hash(image.rasterio_geometry) != grid_hash(self.profile):
+            image = image.align(self.profile)
+
+        with image.caching():
+            values = get_product(image, self.product)
+            valid = image.mask().astype(bool)
+            if source:
+                valid &= ~cloud_mask(image, source=source, layers=layers, **kwargs)
+
+        return self.update_array(values, image.date_acquired, image.landsat_scene_id, valid)
+
+    def update_array(self, values, date, scene_id, valid=None):
+        """ Fold in one observation of every pixel; nan values are skipped.
+        :param values: array of shape (rows, cols) on the accumulator's grid
+        :param date: datetime.date of the observation
+        :param scene_id: identifier of the observation, e.g. landsat_scene_id
+        :param valid: boolean array, False to skip a pixel
+        :return: True, or False if scene_id was already folded in
+        """
+        if scene_id in self.scenes:
+            return False
+        if self.origin is None:
+            self.origin = date.toordinal()
+
+        values = np.asarray(values, dtype=np.float64)
+        ok = ~np.isnan(values)
+        if valid is not None:
+            ok &= valid
+        x = np.where(ok, values, 0.)
+        t = (date.toordinal() - self.origin) / 365.25
+
+        self.count += ok
+        delta = np.where(ok, x - self._mean, 0.)
+        self._mean += delta / np.maximum(self.count, 1)
+        self._m2 += delta * np.where(ok, x - self._mean, 0.)
+
+        self._sum_t += t * ok
+        self._sum_tt += t * t * ok
+        self._sum_y += x
+        self._sum_ty += t * x
+
+        np.copyto(self._min, np.minimum(self._min, x), where=ok)
+        np.copyto(self._max, np.maximum(self._max, x), where=ok)
+
+        if self.phenology:
+            peak = ok & (x > self._peak_value)
+            np.copyto(self._peak_value, x, where=peak, casting='same_kind')
+            self._peak_date[peak] = date.toordinal()
+
+        self.scenes.append(scene_id)
+        return True
+
+    def mean(self):
+        return np.where(self.count > 0, self._mean, np.nan)
+
+    def variance(self):
+        """ Sample variance, nan with fewer than two observations. """
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.count > 1, self._m2 / (self.count - 1), np.nan)
+
+    def std(self):
+        return np.sqrt(self.variance())
+
+    def min(self):
+        return np.where(self.count > 0, self._min, np.nan)
+
+    def max(self):
+        return np.where(self.count > 0, self._max, np.nan)
+
+    def trend(self):
+        """ Least squares line through each pixel's observations.
+        :return: slope per year, intercept at the date of the first scene folded in;
+        nan where there are fewer than two observation dates
+        """
+        n = self.count
+        denom = n * self._sum_tt - self._sum_t ** 2
+        with np.errstate(invalid='ignore', divide='ignore'):
+            slope = (n * self._sum_ty - self._sum_t * self._sum_y) / denom
+            intercept = (self._sum_y - slope * self._sum_t) / n
+        defined = (n > 1) & (np.abs(denom) > 1e-9)
+        return np.where(defined, slope, np.nan), np.where(defined, intercept, np.nan)
+
+    def peak_doy(self):
+        """ Day of year of each pixel's peak value, nan where there is none. """
+        if not self.phenology:
+            raise ValueError('Peak dates are only kept with phenology=True')
+        days = np.datetime64('0001-01-01') + (self._peak_date.astype('int64') - 1).astype('timedelta64[D]')
+        doy = (days - days.astype('datetime64[Y]')).astype(int) + 1
+        return np.where(self._peak_date > 0, doy, np.nan)
+
+
+if __name__ == '__main__':
+    home = os.path.expanduser('~')
+
+# ========================= EOF ================================================================
@@ -28,6 +28,17 @@ class BandMap:
                         'LT5': ['1', '2', '3', '4', '5', '6', '7']}
         return band_mapping
 
+    @property
+    def roles(self):
+        """ Band number of each spectral role, by satellite. """
+        band_roles = {'LC8': {'blue': 2, 'green': 3, 'red': 4, 'nir': 5, 'swir1': 6, 'swir2': 7,
+                              'thermal': 10},
+                      'LE7': {'blue': 1, 'green': 2, 'red': 3, 'nir': 4, 'swir1': 5, 'swir2': 7,
+                              'thermal': 6},
+                      'LT5': {'blue': 1, 'green': 2, 'red': 3, 'nir': 4, 'swir1': 5, 'swir2': 7,
+                              'thermal': 6}}
+        return band_roles
+
     @property
     def file_suffixes(self):
         b = {'LANDSAT_1': ['B1.TIF', 'B2.TIF', 'B3.TIF', 'B4.TIF', 'B5.TIF', 'B6.TIF', 'B7.TIF', 'MTL.txt'],
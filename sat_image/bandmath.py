@@ -0,0 +1,236 @@
+# =============================================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================================
+
+import os
+import ast
+import re
+
+import numpy as np
+from rasterio.windows import Window
+
+from sat_image.band_map import BandMap
+from sat_image.buffers import BufferPool
+
+# ast operator: instruction
+OPERATORS = {ast.Add: 'add', ast.Sub: 'subtract', ast.Mult: 'multiply', ast.Div: 'divide',
+             ast.Pow: 'power', ast.USub: 'negative', ast.UAdd: 'positive'}
+
+# expression function: instruction
+FUNCTIONS = {'sqrt': 'sqrt', 'log': 'log', 'exp': 'exp', 'abs': 'absolute',
+             'min': 'minimum', 'max': 'maximum'}
+
+# operands of these can be swapped, so b5 + b4 and b4 + b5 are one subexpression
+COMMUTATIVE = ['add', 'multiply', 'minimum', 'maximum']
+
+# thermal bands, read as brightness temperature rather than reflectance
+THERMAL = {'LT5': [6], 'LE7': [6], 'LC8': [10, 11]}
+
+BAND_NAME = re.compile(r'^b(\d+)$')
+
+
+class BandMath(object):
+    ''' Band-math expressions compiled into one program with shared subexpressions.
+
+    Expressions are arithmetic (+ - * / **) on numbers, bands and the functions
+    sqrt, log, exp, abs, min and max. A band is b<number> or a spectral role of BandMap.roles,
+    e.g. 'red'; reflective bands are read as TOA reflectance and thermal bands as brightness
+    temperature in K. Identical subexpressions of all the expressions, and identical band
+    reads, are computed once; with a sensor, roles are resolved to its bands first, so
+    'nir' and 'b5' of Landsat 8 are one read. Division matches LandsatImage._divide_zero: positive infinity
+    from a division by zero is replaced, by nan by default.
+
+    The program runs block by block; each intermediate lives in a block-sized buffer that is
+    reused as soon as its last user has run.
+
+    e.g.
+    math = BandMath({'ndvi': '(nir - red) / (nir + red)', 'savi': '1.5 * (nir - red) / (nir + red + 0.5)'})
+    arrays = math.evaluate(image)
+    '''
+
+    def __init__(self, expressions, replace=np.nan, sensor=None):
+        '''
+        :param expressions: expression string, list of strings, or dict of name: string
+        :param replace: value of a positive division by zero
+        :param sensor: 'LT5', 'LE7' or 'LC8', to compile for the bands of one sensor
+        '''
+        if sensor is not None and sensor not in BandMap().roles:
+            raise ValueError('{} is not a valid sensor, choose from {}'.format(
+                sensor, sorted(BandMap().roles)))
+        if isinstance(expressions, str):
+            expressions = [expressions]
+        if not isinstance(expressions, dict):
+            expressions = dict((e, e) for e in expressions)
+        self.expressions = expressions
+        self.replace = replace
+        self.sensor = sensor
+
+        # instructions (op, operands), operands are indices of earlier instructions
+        self.program = []
+        self._nodes = {}
+        self.outputs = {}
+        for name, expression in expressions.items():
+            try:
+                tree = ast.parse(expression.strip(), mode='eval')
+            except SyntaxError as e:
+                raise ValueError('Invalid expression {}: {}'.format(expression, e))
+            self.outputs[name] = self._compile(tree.body, expression)
+
+        # last instruction reading each instruction, to release its buffer after
+        self._last_use = {}
+        for i, (op, args) in enumerate(self.program):
+            if op not in ['load', 'const']:
+                for arg in args:
+                    self._last_use[arg] = i
+
+    @property
+    def bands(self):
+        """ Band names and roles the expressions read. """
+        return sorted(set(args[0] for op, args in self.program if op == 'load'))
+
+    def evaluate(self, image, block_size=512, pool=None):
+        """ Evaluate every expression over an image, block by block.
+        :param image: LandsatImage object
+        :param block_size: block width and height in pixels, None for the whole image at once
+        :param pool: buffers.BufferPool of the temporaries, default a new one
+        :return: dict of name: float32 array
+        """
+        if self.sensor is not None and image.satellite != self.sensor:
+            raise ValueError('Expressions compiled for {}, not {}'.format(self.sensor, image.satellite))
+
+        height, width = image.rasterio_geometry['height'], image.rasterio_geometry['width']
+        results = dict((name, np.empty((height, width), dtype=np.float32)) for name in self.outputs)
+        pool = pool if pool is not None else BufferPool()
+
+        # a decimated image is read whole, it cannot be windowed
+        size = block_size if block_size and image._out_shape is None else max(height, width)
+        for row in range(0, height, size):
+            for col in range(0, width, size):
+                window = Window(col, row, min(size, width - col), min(size, height - row))
+                view = image if size >= max(height, width) else image.windowed(window)
+                rows, cols = window.toslices()
+                with view.caching(), view.pooled(pool):
+                    self._run(view, dict((name, arr[rows, cols]) for name, arr in results.items()))
+
+        return results
+
+    def _compile(self, node, expression):
+        if isinstance(node, ast.BinOp) and type(node.op) in OPERATORS:
+            return self._emit(OPERATORS[type(node.op)], [self._compile(node.left, expression),
+                                                        self._compile(node.right, expression)])
+        if isinstance(node, ast.UnaryOp) and type(node.op) in OPERATORS:
+            return self._emit(OPERATORS[type(node.op)], [self._compile(node.operand, expression)])
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in FUNCTIONS \
+                and not node.keywords:
+            op = FUNCTIONS[node.func.id]
+            if len(node.args) != (2 if op in ['minimum', 'maximum'] else 1):
+                raise ValueError('Wrong number of arguments to {} in {}'.format(node.func.id, expression))
+            return self._emit(op, [self._compile(arg, expression) for arg in node.args])
+        if isinstance(node, ast.Name):
+            roles = BandMap().roles[self.sensor or 'LC8']
+            if not (BAND_NAME.match(node.id) or node.id in roles):
+                raise ValueError('{} is not a band or spectral role, in {}'.format(node.id, expression))
+            band = node.id
+            if self.sensor is not None and band in roles:
+                band = 'b{}'.format(roles[band])
+            return self._node('load', (band,))
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) \
+                and not isinstance(node.value, bool):
+            return self._node('const', (float(node.value),))
+        raise ValueError('Unsupported syntax {} in {}'.format(ast.dump(node), expression))
+
+    def _emit(self, op, args):
+        """ Instruction of an operation, folding constants and reusing an identical one. """
+        if all(self.program[a][0] == 'const' for a in args):
+            value = self._apply(op, [self.program[a][1][0] for a in args])
+            return self._node('const', (float(value),))
+        if op in COMMUTATIVE:
+            args = sorted(args)
+        return self._node(op, tuple(args))
+
+    def _node(self, op, args):
+        key = (op, args)
+        if key not in self._nodes:
+            self._nodes[key] = len(self.program)
+            self.program.append(key)
+        return self._nodes[key]
+
+    def _apply(self, op, operands, out=None):
+        if op == 'divide':
+            with np.errstate(divide='ignore', invalid='ignore'):
+                result = np.true_divide(operands[0], operands[1], out=out)
+            if out is None:
+                return self.replace if result == np.inf else result
+            return result
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            return getattr(np, op)(*operands, out=out)
+
+    def _run(self, view, outputs):
+        """ Run the program over one block, into the arrays of outputs. """
+        shape = view.shape[1:]
+        # instruction: output array it is computed into
+        targets = {}
+        for name, node in self.outputs.items():
+            targets.setdefault(node, outputs[name])
+
+        values, owned = {}, set()
+        for i, (op, args) in enumerate(self.program):
+            if op == 'load':
+                values[i] = _load(view, args[0])
+                continue
+            if op == 'const':
+                values[i] = args[0]
+                continue
+
+            out = targets.get(i)
+            if out is None:
+                # compute in place into an operand no later instruction reads
+                dying = [a for a in args if a in owned and self._last_use[a] == i]
+                if dying:
+                    out = values[dying[0]]
+                    owned.discard(dying[0])
+                else:
+                    out = view._take(shape)
+                owned.add(i)
+            values[i] = self._apply(op, [values[a] for a in args], out=out)
+
+            if op == 'divide':
+                infinite = np.equal(out, np.inf, out=view._take(shape, bool))
+                np.copyto(out, self.replace, where=infinite)
+                view._give(infinite)
+            for arg in set(args):
+                if arg in owned and self._last_use[arg] == i:
+                    owned.discard(arg)
+                    view._give(values[arg])
+        view._give(*[values[i] for i in owned])
+
+        for name, node in self.outputs.items():
+            if outputs[name] is not values[node]:
+                outputs[name][...] = values[node]
+
+
+def _load(view, band):
+    """ Reflectance, or brightness temperature of a thermal band, by band name or role. """
+    match = BAND_NAME.match(band)
+    number = int(match.group(1)) if match else view.role_band(band)
+    if number in THERMAL.get(view.satellite, []):
+        return view.brightness_temp(number)
+    return view.reflectance(number)
+
+
+if __name__ == '__main__':
+    home = os.path.expanduser('~')
+
+# ========================= EOF ================================================================
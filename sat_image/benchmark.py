@@ -0,0 +1,187 @@
+# =============================================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================================
+
+import os
+import shutil
+import tracemalloc
+from collections import OrderedDict
+from contextlib import contextmanager
+from tempfile import mkdtemp
+from time import perf_counter
+
+from sat_image import mtl
+from sat_image.fmask import Fmask
+from sat_image.image import open_image
+from sat_image.synthetic import synthetic_scenes
+from sat_image.warped_vrt import warp_vrt
+
+
+@contextmanager
+def _parsemeta(scenes):
+    yield lambda: mtl.parsemeta(scenes[0])
+
+
+@contextmanager
+def _init(scenes):
+    yield lambda: open_image(scenes[0])
+
+
+@contextmanager
+def _get_band(scenes):
+    image = open_image(scenes[0])
+    yield lambda: image._get_band('b1')
+
+
+@contextmanager
+def _reflectance(scenes):
+    image = open_image(scenes[0])
+    yield lambda: image.reflectance(image.role_band('red'))
+
+
+@contextmanager
+def _ndvi(scenes):
+    image = open_image(scenes[0])
+    yield image.ndvi
+
+
+@contextmanager
+def _albedo(scenes):
+    image = open_image(scenes[0])
+    yield image.albedo
+
+
+@contextmanager
+def _lst(scenes):
+    image = open_image(scenes[0])
+    yield image.land_surface_temp
+
+
+@contextmanager
+def _cloud_mask(scenes):
+    # Fmask reads and converts every band as it is built; the case is the mask alone
+    fmask = Fmask(open_image(scenes[0]))
+    yield fmask.cloud_mask
+
+
+@contextmanager
+def _warp_vrt(scenes):
+    # warp_vrt warps in place, so each run is on a fresh copy of the scenes
+    workdir = mkdtemp()
+    try:
+        for scene in scenes:
+            shutil.copytree(scene, os.path.join(workdir, os.path.basename(scene)))
+        yield lambda: warp_vrt(workdir)
+    finally:
+        shutil.rmtree(workdir)
+
+
+# case: context manager of a satellite's scene directories, yielding the call that is measured;
+# what it does before yielding is set-up, and not measured
+CASES = OrderedDict([('parsemeta', _parsemeta),
+                     ('init', _init),
+                     ('get_band', _get_band),
+                     ('reflectance', _reflectance),
+                     ('ndvi', _ndvi),
+                     ('albedo', _albedo),
+                     ('lst', _lst),
+                     ('cloud_mask', _cloud_mask),
+                     ('warp_vrt', _warp_vrt)])
+
+
+def run_case(case, scenes, repeat=1):
+    """ Time and peak memory of one case.
+
+    The time is the best of repeat runs. The peak is from one more run under tracemalloc, the
+    most Python and numpy memory held at once, above what the set-up holds; memory allocated
+    inside GDAL, e.g. its block cache, is not traced.
+    :param case: CASES key
+    :param scenes: list of scene directories of one satellite, warp_vrt needs two
+    :param repeat: timed runs
+    :return: seconds, peak bytes
+    """
+    if case not in CASES:
+        raise ValueError('{} is not a valid case, choose from {}'.format(case, list(CASES)))
+    times = []
+    for _ in range(repeat):
+        with CASES[case](scenes) as func:
+            start = perf_counter()
+            func()
+            times.append(perf_counter() - start)
+
+    with CASES[case](scenes) as func:
+        tracemalloc.start()
+        try:
+            func()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    return min(times), peak
+
+
+def run_benchmarks(root, satellites=('LT5', 'LE7', 'LC8'), cases=None, shape=None, repeat=1,
+                   callback=None, **kwargs):
+    """ Benchmark every case on synthetic scenes of each satellite.
+
+    Scenes are generated in root by synthetic.synthetic_scenes, full size unless shape is
+    given, and reused by later runs.
+    :param root: directory of the synthetic scenes
+    :param satellites: iterable of 'LT5', 'LE7', 'LC8'
+    :param cases: iterable of CASES keys, default all
+    :param shape: (lines, samples) of the scenes, default full size
+    :param repeat: timed runs of each case, see run_case
+    :param callback: called with each result as it is measured
+    :param kwargs: passed to synthetic.synthetic_scene
+    :return: list of OrderedDict of satellite, case, lines, samples, seconds and peak_mb
+    """
+    cases = list(cases or CASES)
+    count = 2 if 'warp_vrt' in cases else 1
+    scenes = synthetic_scenes(root, satellites, shape, count=count, **kwargs)
+
+    results = []
+    for satellite in satellites:
+        image = open_image(scenes[satellite][0])
+        lines, samples = image.shape[1:]
+        for case in cases:
+            seconds, peak = run_case(case, scenes[satellite], repeat)
+            result = OrderedDict([('satellite', satellite), ('case', case), ('lines', lines),
+                                  ('samples', samples), ('seconds', seconds), ('peak_mb', peak / 1e6)])
+            results.append(result)
+            if callback:
+                callback(result)
+
+    return results
+
+
+def report(results):
+    """ Table of benchmark results.
+    :param results: list of results of run_benchmarks
+    :return: str
+    """
+    lines = ['{:<10}{:<14}{:>14}{:>12}{:>12}'.format('satellite', 'case', 'size', 'seconds', 'peak MB')]
+    for r in results:
+        lines.append('{:<10}{:<14}{:>14}{:>12.3f}{:>12.1f}'.format(
+            r['satellite'], r['case'], '{}x{}'.format(r['lines'], r['samples']), r['seconds'], r['peak_mb']))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    home = os.path.expanduser('~')
+    synthetic = os.path.join(home, 'landsat', 'synthetic')
+    print(report(run_benchmarks(synthetic, callback=lambda r: print(r['satellite'], r['case'],
+                                                                   round(r['seconds'], 3)))))
+
+# ========================= EOF ================================================================
@@ -0,0 +1,88 @@
+# =============================================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================================
+
+import os
+import threading
+
+import numpy as np
+
+
+class BufferPool(object):
+    ''' Reusable arrays, kept by shape and dtype.
+
+    take() returns a free array of the shape and dtype, or allocates one; give() hands it
+    back for the next take(). Arrays are not cleared between uses. A pool can be shared by
+    the threads of a worker, or kept for all the same-sized scenes a worker processes, see
+    LandsatImage.pooled().
+
+    e.g.
+    pool = BufferPool()
+    buf = pool.take((7001, 7801), 'float32')
+    ...
+    pool.give(buf)
+    '''
+
+    def __init__(self):
+        self._free = {}
+        self._lock = threading.Lock()
+        # arrays allocated by take(), as opposed to reused
+        self.allocations = 0
+
+    def take(self, shape, dtype=np.float32):
+        """ A writeable array, of undefined values.
+        :param shape: tuple of ints
+        :param dtype: numpy dtype
+        :return: numpy array
+        """
+        key = _key(shape, dtype)
+        with self._lock:
+            free = self._free.get(key)
+            if free:
+                return free.pop()
+            self.allocations += 1
+        return np.empty(shape, dtype=dtype)
+
+    def give(self, *arrays):
+        """ Return arrays to the pool; read-only arrays, e.g. cached results, are left out. """
+        with self._lock:
+            for arr in arrays:
+                if arr.flags.writeable:
+                    self._free.setdefault(_key(arr.shape, arr.dtype), []).append(arr)
+
+    def clear(self):
+        """ Drop every free array. """
+        with self._lock:
+            self._free.clear()
+
+    @property
+    def nbytes(self):
+        """ Bytes held by free arrays. """
+        with self._lock:
+            return sum(arr.nbytes for free in self._free.values() for arr in free)
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(free) for free in self._free.values())
+
+
+def _key(shape, dtype):
+    return tuple(int(s) for s in shape), np.dtype(dtype).str
+
+
+if __name__ == '__main__':
+    home = os.path.expanduser('~')
+
+# ========================= EOF ================================================================
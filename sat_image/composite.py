@@ -0,0 +1,218 @@
+# =============================================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================================
+
+from __future__ import division
+
+import os
+import shutil
+import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from tempfile import mkdtemp
+
+import numpy as np
+from rasterio import open as rasopen
+
+from sat_image.pipeline import cloud_mask, compute_products
+from sat_image.stack import SceneStack
+from sat_image.warped_vrt import BLOCK_SIZE
+
+METHODS = ['median', 'percentile', 'max_ndvi', 'best_pixel']
+
+# images and clear-mask files of the composite being computed, set in each worker
+_COMPOSITE = {}
+
+
+def composite(scenes, outfile, products=('ndvi',), method='median', q=50, target=None,
+              registry=None, source='fmask', layers='cloud_and_shadow', target_date=None,
+              tile_size=512, workers=1, **kwargs):
+    """ Cloud-free composite of many scenes, computed tile by tile.
+
+    Each scene's cloud mask is computed once, one scene at a time, and written to a
+    temporary file on the composite grid; products are then read and composited one
+    tile of every scene at a time, so memory is bounded by tile_size and the number of
+    scenes rather than by the size of the scenes.
+    :param scenes: directory of scene directories, or iterable of LandsatImage objects
+    :param outfile: output GeoTIFF, one float32 band per product and a last band
+    counting the clear observations of each pixel
+    :param products: iterable of pipeline.PRODUCTS keys
+    :param method: 'median', 'percentile' (of q), 'max_ndvi' (every product from the
+    clear scene of highest NDVI) or 'best_pixel' (every product from the clear scene
+    acquired closest to target_date in the year)
+    :param q: percentile, 0 to 100, for method 'percentile'
+    :param target: grid of the composite, see SceneStack
+    :param registry: GridRegistry, see SceneStack
+    :param source: cloud mask source, see pipeline.cloud_mask
+    :param layers: cloud mask layers, see pipeline.cloud_mask
+    :param target_date: datetime.date for 'best_pixel', default the middle of the scenes' dates
+    :param tile_size: tile width and height in pixels
+    :param workers: tiles composited concurrently, and Fmask worker processes
+    :param kwargs: passed to pipeline.cloud_mask
+    :return: outfile
+    """
+    if method not in METHODS:
+        raise ValueError('{} is not a valid method, choose from {}'.format(method, METHODS))
+
+    if isinstance(scenes, str):
+        stack = SceneStack.from_directory(scenes, target, registry)
+    else:
+        stack = SceneStack(scenes, target, registry)
+
+    if method == 'best_pixel':
+        if target_date is None:
+            target_date = stack.dates[0] + (stack.dates[-1] - stack.dates[0]) // 2
+        target_doy = target_date.timetuple().tm_yday
+    else:
+        target_doy = None
+    options = {'products': list(products), 'method': method, 'q': q, 'target_doy': target_doy}
+
+    meta = {'driver': 'GTiff', 'dtype': 'float32', 'nodata': np.nan,
+            'count': len(products) + 1, 'crs': stack.profile['crs'],
+            'transform': stack.profile['transform'],
+            'height': stack.height, 'width': stack.width,
+            'tiled': True, 'blockxsize': BLOCK_SIZE, 'blockysize': BLOCK_SIZE,
+            'compress': 'deflate', 'predictor': 3}
+
+    temp = mkdtemp(prefix='composite_')
+    try:
+        masks = [write_clear_mask(image, temp, source, layers, workers, **kwargs)
+                 for image in stack.images]
+
+        with rasopen(outfile, 'w', **meta) as dst:
+            for i, product in enumerate(products, start=1):
+                dst.set_band_description(i, product)
+            dst.set_band_description(len(products) + 1, 'clear_count')
+
+            windows = list(stack.windows(tile_size))
+            if workers and workers > 1:
+                with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                         initargs=(stack.images, masks, stack.dates)) as pool:
+                    futures = dict((pool.submit(_composite_window, window, options), window)
+                                   for window in windows)
+                    for future in as_completed(futures):
+                        dst.write(future.result(), window=futures.pop(future))
+            else:
+                _init_worker(stack.images, masks, stack.dates)
+                for window in windows:
+                    dst.write(_composite_window(window, options), window=window)
+    finally:
+        _COMPOSITE.clear()
+        shutil.rmtree(temp)
+
+    return outfile
+
+
+def composite_window(data, clear, method='median', q=50, ndvi=None, doys=None, target_doy=None):
+    """ Composite stacked observations of one tile.
+    :param data: array of shape (products, scenes, rows, cols)
+    :param clear: boolean array of shape (scenes, rows, cols), True for clear observations
+    :param method: see composite
+    :param q: see composite
+    :param ndvi: array of shape (scenes, rows, cols), for 'max_ndvi'
+    :param doys: day of year of each scene, for 'best_pixel'
+    :param target_doy: day of year to composite towards, for 'best_pixel'
+    :return: float32 array of shape (products + 1, rows, cols), the last band the clear count
+    """
+    count = clear.sum(axis=0)
+
+    if method in ['median', 'percentile']:
+        masked = np.where(clear[np.newaxis], data, np.nan)
+        with warnings.catch_warnings():
+            # pixels with no clear observation are nan
+            warnings.simplefilter('ignore', RuntimeWarning)
+            if method == 'median':
+                out = np.nanmedian(masked, axis=1)
+            else:
+                out = np.nanpercentile(masked, q, axis=1)
+
+    else:
+        if method == 'max_ndvi':
+            # clear pixels of undefined NDVI rank last, but above cloudy pixels
+            score = np.where(np.isnan(ndvi), -np.finfo(float).max, ndvi)
+        else:
+            distance = np.abs(np.asarray(doys) - target_doy)
+            distance = np.minimum(distance, 365 - distance).astype(float)
+            score = np.broadcast_to(-distance[:, np.newaxis, np.newaxis], clear.shape)
+        out, _ = select(data, clear, score)
+
+    return np.concatenate([out, count[np.newaxis]]).astype(np.float32)
+
+
+def select(data, clear, score):
+    """ Per pixel, the clear observation of highest score.
+    :param data: array of shape (products, scenes, rows, cols)
+    :param clear: boolean array of shape (scenes, rows, cols), True for clear observations
+    :param score: array broadcastable to clear; ties go to the first scene
+    :return: array of shape (products, rows, cols), nan where no observation is clear, and
+    the index of the selected scene, -1 where none is
+    """
+    score = np.where(clear, score, -np.inf)
+    best = np.argmax(score, axis=0)
+    out = np.take_along_axis(data, np.broadcast_to(best, (data.shape[0], 1) + best.shape),
+                             axis=1)[:, 0]
+    any_clear = clear.any(axis=0)
+    return np.where(any_clear, out, np.nan), np.where(any_clear, best, -1)
+
+
+def write_clear_mask(image, directory, source, layers, workers, **kwargs):
+    """ Write a uint8 GeoTIFF of the image's clear pixels, 1 is clear, as
+    <directory>/<scene id>_clear.tif; pixels outside the image are not clear.
+    :param image: LandsatImage object
+    :param directory: output directory
+    :param source: mask source, see pipeline.cloud_mask
+    :param layers: mask layers, see pipeline.cloud_mask
+    :param workers: Fmask worker processes
+    :return: path of the mask
+    """
+    with image.caching():
+        clear = ~cloud_mask(image, source=source, layers=layers, workers=workers, **kwargs)
+        clear &= image.mask().astype(bool)
+
+    meta = {'driver': 'GTiff', 'dtype': 'uint8', 'count': 1,
+            'crs': image.rasterio_geometry['crs'], 'transform': image.transform,
+            'height': clear.shape[0], 'width': clear.shape[1],
+            'tiled': True, 'blockxsize': BLOCK_SIZE, 'blockysize': BLOCK_SIZE, 'compress': 'deflate'}
+    path = os.path.join(directory, '{}_clear.tif'.format(image.landsat_scene_id))
+    with rasopen(path, 'w', **meta) as dst:
+        dst.write(clear.astype(np.uint8), 1)
+    return path
+
+
+def _init_worker(images, masks, dates):
+    _COMPOSITE.update(images=images, masks=masks,
+                      doys=[d.timetuple().tm_yday for d in dates])
+
+
+def _composite_window(window, options):
+    products, method = options['products'], options['method']
+    needed = list(products) + (['ndvi'] if method == 'max_ndvi' and 'ndvi' not in products else [])
+
+    clear, results = [], []
+    for image, mask in zip(_COMPOSITE['images'], _COMPOSITE['masks']):
+        with rasopen(mask, 'r') as src:
+            clear.append(src.read(1, window=window).astype(bool))
+        results.append(compute_products(image.windowed(window), needed))
+
+    clear = np.stack(clear)
+    data = np.stack([np.stack([r[p] for r in results]) for p in products])
+    ndvi = np.stack([r['ndvi'] for r in results]) if method == 'max_ndvi' else None
+    return composite_window(data, clear, method, options['q'], ndvi=ndvi,
+                            doys=_COMPOSITE['doys'], target_doy=options['target_doy'])
+
+
+if __name__ == '__main__':
+    home = os.path.expanduser('~')
+
+# ========================= EOF ================================================================
@@ -0,0 +1,250 @@
+# =============================================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================================
+
+from __future__ import division
+
+import os
+import json
+from collections import OrderedDict
+from datetime import datetime
+
+import numpy as np
+
+from sat_image.grid import grid_hash, grid_to_dict, grid_from_dict
+from sat_image.pipeline import CLASS_PRODUCTS, compute_products
+from sat_image.stack import SceneStack
+
+CUBE_META = 'cube.json'
+
+# chunk shape (time, rows, cols); stored with time innermost, so a pixel's series is
+# contiguous within a chunk
+CHUNKS = (32, 64, 64)
+
+
+class TimeSeriesCube(object):
+    ''' Products of many scenes on one grid, in an on-disk (time, y, x) array per product.
+
+    Each product is a raw binary file <path>/<product>.dat of chunks of shape CHUNKS,
+    memory-mapped as (time blocks, row chunks, col chunks, row, col, time), so reading the
+    time series of a pixel touches one small contiguous run per time block, while appending
+    a scene writes every chunk of the last time block at a stride. Files grow by
+    one time block when a scene is appended past the last one. Scenes are stored in the
+    order they are appended; dates and every read are in order of date_acquired.
+    Grid, chunks, products and scenes are kept in <path>/cube.json.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, CUBE_META), 'r') as f:
+            meta = json.load(f)
+        self.profile = grid_from_dict(meta['grid'])
+        self.height, self.width = self.profile['height'], self.profile['width']
+        self.chunks = tuple(meta['chunks'])
+        self.products = OrderedDict(meta['products'])
+        self.scenes = meta['scenes']
+        self.tiles = (-(-self.height // self.chunks[1]), -(-self.width // self.chunks[2]))
+
+    @classmethod
+    def create(cls, path, target, products=('ndvi',), chunks=CHUNKS):
+        """ Create an empty cube.
+        :param path: cube directory
+        :param target: LandsatImage or profile dict of the cube's grid
+        :param products: iterable of pipeline.get_product names, e.g. ('ndvi', 'lst', 'fmask')
+        :param chunks: chunk shape (time, rows, cols)
+        :return: TimeSeriesCube
+        """
+        if os.path.isfile(os.path.join(path, CUBE_META)):
+            raise ValueError('A cube already exists at {}'.format(path))
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        profile = getattr(target, 'rasterio_geometry', target)
+        products = [[p, 'uint8' if p in CLASS_PRODUCTS else 'float32'] for p in products]
+        for product, _ in products:
+            open(os.path.join(path, '{}.dat'.format(product)), 'wb').close()
+
+        _write_meta(path, {'grid': grid_to_dict(profile), 'chunks': list(chunks),
+                           'products': products, 'scenes': []})
+        return cls(path)
+
+    @property
+    def dates(self):
+        return [self._date(self.scenes[t]) for t in self.order()]
+
+    def order(self):
+        """ Storage index of each scene, in date order. """
+        return sorted(range(len(self.scenes)), key=lambda t: self.scenes[t]['date'])
+
+    def __len__(self):
+        return len(self.scenes)
+
+    def __contains__(self, scene_id):
+        return scene_id in [x['scene'] for x in self.scenes]
+
+    def append(self, image):
+        """ Add a scene's products, aligning the scene to the cube's grid if needed.
+        :param image: LandsatImage object
+        :return: storage index of the scene, or None if it is already in the cube
+        """
+        if image.landsat_scene_id in self:
+            return None
+        if grid_hash(image.rasterio_geometry) != grid_hash(self.profile):
+            image = image.align(self.profile)
+        arrays = compute_products(image, self.products)
+        return self.append_arrays(arrays, image.date_acquired, image.landsat_scene_id)
+
+    def append_arrays(self, arrays, date, scene_id):
+        """ Add one time step from arrays already on the cube's grid.
+        :param arrays: dict of {product: array of shape (rows, cols)} for every cube product
+        :param date: datetime.date of the scene
+        :param scene_id: scene identifier, e.g. landsat_scene_id
+        :return: storage index of the scene
+        """
+        t = len(self.scenes)
+        block, index = divmod(t, self.chunks[0])
+        for product, dtype in self.products.items():
+            arr = np.asarray(arrays[product])
+            if arr.shape != (self.height, self.width):
+                raise ValueError('{} has shape {}, cube grid is {}'.format(
+                    product, arr.shape, (self.height, self.width)))
+            if index == 0:
+                self._grow(product, block + 1)
+            mm = self._memmap(product, 'r+')
+            mm[block, ..., index] = self._to_tiles(arr.astype(dtype))
+            mm.flush()
+            del mm
+
+        self.scenes.append({'scene': scene_id, 'date': date.isoformat()})
+        self._save()
+        return t
+
+    def read(self, product, window=None):
+        """ Product of every scene, in date order.
+        :param product: cube product name
+        :param window: rasterio Window, default the whole grid
+        :return: array of shape (scenes, rows, cols)
+        """
+        rows, cols = self._bounds(window)
+        cy, cx = self.chunks[1:]
+        ty, tx = slice(rows[0] // cy, -(-rows[1] // cy)), slice(cols[0] // cx, -(-cols[1] // cx))
+        r0, c0 = ty.start * cy, tx.start * cx
+
+        mm = self._memmap(product)
+        out = np.empty((len(self.scenes), rows[1] - rows[0], cols[1] - cols[0]), dtype=mm.dtype)
+        for i, t in enumerate(self.order()):
+            block, index = divmod(t, self.chunks[0])
+            tiles = mm[block, ty, tx, ..., index]
+            full = tiles.transpose(0, 2, 1, 3).reshape(tiles.shape[0] * cy, tiles.shape[1] * cx)
+            out[i] = full[rows[0] - r0:rows[1] - r0, cols[0] - c0:cols[1] - c0]
+        return out
+
+    def series(self, product, row, col):
+        """ Time series of one pixel.
+        :param product: cube product name
+        :param row: row on the cube's grid
+        :param col: column on the cube's grid
+        :return: list of dates, array of values in date order
+        """
+        cy, cx = self.chunks[1:]
+        mm = self._memmap(product)
+        values = mm[:, row // cy, col // cx, row % cy, col % cx].reshape(-1)[:len(self.scenes)]
+        return self.dates, np.array(values[self.order()])
+
+    def _to_tiles(self, arr):
+        cy, cx = self.chunks[1:]
+        padded = np.zeros((self.tiles[0] * cy, self.tiles[1] * cx), dtype=arr.dtype)
+        padded[:self.height, :self.width] = arr
+        return padded.reshape(self.tiles[0], cy, self.tiles[1], cx).transpose(0, 2, 1, 3)
+
+    def _file(self, product):
+        if product not in self.products:
+            raise ValueError('{} is not in the cube, choose from {}'.format(product, list(self.products)))
+        return os.path.join(self.path, '{}.dat'.format(product))
+
+    def _block_shape(self):
+        return self.tiles + self.chunks[1:] + self.chunks[:1]
+
+    def _grow(self, product, blocks):
+        size = blocks * int(np.prod(self._block_shape())) * np.dtype(self.products[product]).itemsize
+        with open(self._file(product), 'r+b') as f:
+            f.truncate(size)
+
+    def _memmap(self, product, mode='r'):
+        dtype = np.dtype(self.products[product])
+        path = self._file(product)
+        blocks = os.path.getsize(path) // (int(np.prod(self._block_shape())) * dtype.itemsize)
+        shape = (blocks,) + self._block_shape()
+        if not blocks:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode=mode, shape=shape)
+
+    def _bounds(self, window):
+        if window is None:
+            return (0, self.height), (0, self.width)
+        row, col = int(window.row_off), int(window.col_off)
+        return (row, row + int(window.height)), (col, col + int(window.width))
+
+    def _save(self):
+        _write_meta(self.path, {'grid': grid_to_dict(self.profile), 'chunks': list(self.chunks),
+                                'products': list(self.products.items()), 'scenes': self.scenes})
+
+    @staticmethod
+    def _date(scene):
+        return datetime.strptime(scene['date'], '%Y-%m-%d').date()
+
+
+def build_cube(path, scenes, products=('ndvi',), target=None, registry=None, chunks=CHUNKS):
+    """ Create the cube at path, or extend an existing one, with every scene not yet in it.
+    :param path: cube directory
+    :param scenes: directory of scene directories, or iterable of LandsatImage objects
+    :param products: products of a new cube, see TimeSeriesCube.create
+    :param target: grid of a new cube, see SceneStack; an existing cube keeps its grid
+    :param registry: GridRegistry, see SceneStack
+    :param chunks: chunk shape of a new cube
+    :return: TimeSeriesCube
+    """
+    cube = None
+    if os.path.isfile(os.path.join(path, CUBE_META)):
+        cube = TimeSeriesCube(path)
+        if list(products) != list(cube.products):
+            raise ValueError('Cube at {} has products {}, not {}'.format(path, list(cube.products),
+                                                                          list(products)))
+        target = cube.profile
+
+    if isinstance(scenes, str):
+        stack = SceneStack.from_directory(scenes, target, registry)
+    else:
+        stack = SceneStack(scenes, target, registry)
+
+    if cube is None:
+        cube = TimeSeriesCube.create(path, stack.profile, products, chunks)
+    for image in stack.images:
+        cube.append(image)
+    return cube
+
+
+def _write_meta(path, meta):
+    meta_path = os.path.join(path, CUBE_META)
+    temp = '{}.tmp'.format(meta_path)
+    with open(temp, 'w') as f:
+        json.dump(meta, f, indent=1)
+    os.replace(temp, meta_path)
+
+
+if __name__ == '__main__':
+    home = os.path.expanduser('~')
+
+# ========================= EOF ================================================================
@@ -30,21 +30,37 @@ Remote Sensing of Environment 159 (2015) 269-277.
 '''
 from __future__ import print_function, division
 
-import rasterio
+import ctypes
+import multiprocessing
+
 import numpy as np
 
+from sat_image.writer import write_geotiff
+
 np.warnings.filterwarnings('ignore')
 
+# band and index attributes of Fmask that the per-pixel tests read
+STRIPE_INPUTS = ('blue', 'green', 'red', 'nir', 'swir1', 'swir2', 'cirrus', 'tirs1',
+                 'ndvi', 'ndsi', 'blue_saturated', 'green_saturated', 'red_saturated')
+
+WATER_THRESHOLD = 0.5
+
+# worker-side views on the shared input and output arrays, see _init_worker
+_SHARED = {}
+
 
 class Fmask(object):
     ''' Implement fmask algorithm.
     :param image: Landsat sat_image stack LandsatImage object
+    :param workers: number of processes used for the per-pixel tests, with workers > 1
+    the input bands are placed in shared memory and evaluated in row stripes
     :return: fmask object
     '''
 
-    def __init__(self, image):
+    def __init__(self, image, workers=1):
 
         self.image = image
+        self.workers = workers
         self.shape = image.shape
         self.mask = image.mask()
         self.sat = image.satellite
@@ -253,7 +269,7 @@ class Fmask(object):
         else:
             return eq1 & eq2 & eq3 & eq4
 
-    def temp_water(self):
+    def temp_water(self, water=None):
         """Use water to mask tirs and find 82.5 pctile
         Equation 7 and 8 (Zhu and Woodcock, 2012)
         Parameters
@@ -267,19 +283,26 @@ class Fmask(object):
         float:
             82.5th percentile temperature over water
         """
+        if water is None:
+            water = self.water_test()
+        return self._water_temp(self._clear_water_temp(water))
+
+    def _clear_water_temp(self, water):
         # eq7
         th_swir2 = 0.03
-        water = self.water_test()
         clear_sky_water = water & (self.swir2 < th_swir2)
 
         # eq8
         clear_water_temp = self.tirs1.copy()
         clear_water_temp[~clear_sky_water] = np.nan
+        return clear_water_temp
+
+    def _water_temp(self, clear_water_temp):
         clear_water_temp[~self.mask] = np.nan
         pctl_clwt = np.nanpercentile(clear_water_temp, 82.5)
         return pctl_clwt
 
-    def water_temp_prob(self):
+    def water_temp_prob(self, water_temp=None):
         """Temperature probability for water
         Equation 9 (Zhu and Woodcock, 2012)
         Parameters
@@ -294,7 +317,8 @@ class Fmask(object):
             probability of cloud over water based on temperature
         """
         temp_const = 4.0  # degrees C
-        water_temp = self.temp_water()
+        if water_temp is None:
+            water_temp = self.temp_water()
         return (water_temp - self.tirs1) / temp_const
 
     def brightness_prob(self, clip=True):
@@ -332,12 +356,18 @@ class Fmask(object):
         tuple:
             17.5 and 82.5 percentile temperature over clearsky land
         """
+        return self._land_temp(self._clear_land_temp(pcps, water))
+
+    def _clear_land_temp(self, pcps, water):
         # eq 12
         clearsky_land = ~(pcps | water)
 
         # use clearsky_land to mask tirs1
         clear_land_temp = self.tirs1.copy()
         clear_land_temp[~clearsky_land] = np.nan
+        return clear_land_temp
+
+    def _land_temp(self, clear_land_temp):
         clear_land_temp[~self.mask] = np.nan
 
         # take 17.5 and 82.5 percentile, eq 13
@@ -410,12 +440,19 @@ class Fmask(object):
         float:
             land cloud threshold
         """
+        return self._land_threshold(self._clear_land_prob(land_cloud_prob, pcps, water))
+
+    @staticmethod
+    def _clear_land_prob(land_cloud_prob, pcps, water):
         # eq 12
         clearsky_land = ~(pcps | water)
 
         # 82.5th percentile of lCloud_Prob(masked by clearsky_land) + LE07_clip_L1TP_039027_20150529_20160902_01_T1_B1.TIF.2
         cloud_prob = land_cloud_prob.copy()
         cloud_prob[~clearsky_land] = np.nan
+        return cloud_prob
+
+    def _land_threshold(self, cloud_prob):
         cloud_prob[~self.mask] = np.nan
 
         # eq 17
@@ -497,7 +534,8 @@ class Fmask(object):
         """
         return (self.ndsi > 0.15) & (self.tirs1 < 9.85) & (self.nir > 0.11) & (self.green > 0.1)
 
-    def cloud_mask(self, min_filter=(3, 3), max_filter=(10, 10), combined=False, cloud_and_shadow=False):
+    def cloud_mask(self, min_filter=(3, 3), max_filter=(10, 10), combined=False, cloud_and_shadow=False,
+                   pixel_radius=100.0):
         """Calculate the potential cloud layer from source data
         *This is the high level function which ties together all
         the equations for generating potential clouds*
@@ -516,6 +554,8 @@ class Fmask(object):
         max_filter: 2-element tuple, default=(21, 21)
             Defines the window for the maximum_filter, for "buffering" the edges
         combined: make a boolean array masking all (cloud, shadow, water)
+        pixel_radius: float, default=100.
+            Distance in pixels from cloud within which shadows are kept
         Output
         ------
         ndarray, boolean:
@@ -524,44 +564,10 @@ class Fmask(object):
             potential cloud shadow layer; True = cloud shadow
             :param cloud_and_shadow:
         """
-        # logger.info("Running initial testsr")
-        whiteness = self.whiteness_index()
-        water = self.water_test()
-
-        # First pass, potential clouds
-        pcps = self.potential_cloud_pixels()
-
-        if self.sat == 'LC8':
-            cirrus_prob = self.cirrus / 0.04
+        if self.workers and self.workers > 1:
+            pcloud, pshadow, water = self._parallel_layers()
         else:
-            cirrus_prob = 0.0
-
-        # Clouds over water
-        wtp = self.water_temp_prob()
-        bp = self.brightness_prob()
-        water_cloud_prob = (wtp * bp) + cirrus_prob
-        wthreshold = 0.5
-
-        # Clouds over land
-        tlow, thigh = self.temp_land(pcps, water)
-        ltp = self.land_temp_prob(tlow, thigh)
-        vp = self.variability_prob(whiteness)
-        land_cloud_prob = (ltp * vp) + cirrus_prob
-        lthreshold = self.land_threshold(land_cloud_prob, pcps, water)
-
-        # logger.info("Calculate potential clouds")
-        pcloud = self.potential_cloud_layer(
-            pcps, water, tlow,
-            land_cloud_prob, lthreshold,
-            water_cloud_prob, wthreshold)
-
-        # Ignoring snow for now as it exhibits many false positives and negatives
-        # when used as a binary mask
-        # psnow = potential_snow_layer(ndsi, green, nir, tirs1)
-        # pcloud = pcloud & ~psnow
-
-        # logger.info("Calculate potential cloud shadows")
-        pshadow = self.potential_cloud_shadow_layer(water)
+            pcloud, pshadow, water = self._potential_layers()
 
         # The remainder of the algorithm differs significantly from Fmask
         # In an attempt to make a more visually appealling cloud mask
@@ -579,7 +585,6 @@ class Fmask(object):
 
             # crude, just look x pixels away for potential cloud pixels
             dist = distance_transform_edt(~pcloud)
-            pixel_radius = 100.0
             pshadow = (dist < pixel_radius) & pshadow
 
             # remove cloud shadow outliers
@@ -611,23 +616,186 @@ class Fmask(object):
 
         return pcloud, pshadow, water
 
-    def save_array(self, array, outfile):
+    def classify(self, **kwargs):
+        """Single class layer of the cloud mask
+        Cloud takes precedence over shadow, shadow over water
+        Parameters
+        ----------
+        kwargs: passed to cloud_mask
+        Output
+        ------
+        ndarray, uint8:
+            code_null outside the image footprint, else code_clear,
+            code_cloud, code_shadow or code_water
+        """
+        kwargs.update(combined=False, cloud_and_shadow=False)
+        pcloud, pshadow, water = self.cloud_mask(**kwargs)
+        classes = np.full(self.mask.shape, self.code_clear, dtype=np.uint8)
+        classes[water] = self.code_water
+        classes[pshadow] = self.code_shadow
+        classes[pcloud] = self.code_cloud
+        classes[self.mask == 0] = self.code_null
+        return classes
+
+    def cloud_probs(self, whiteness, water_temp, tlow, thigh):
+        """Probability of cloud over water and over land
+        Equations 9-11 and 14-16 (Zhu and Woodcock, 2012)
+        Parameters
+        ----------
+        whiteness: ndarray
+        water_temp: float
+            82.5th percentile temperature over water
+        tlow: float
+            low percentile of land temperature
+        thigh: float
+            high percentile of land temperature
+        Output
+        ------
+        tuple:
+            water cloud probability, land cloud probability
+        """
+        if self.sat == 'LC8':
+            cirrus_prob = self.cirrus / 0.04
+        else:
+            cirrus_prob = 0.0
 
-        print('Writing {}'.format(outfile))
-        georeference = self.image.rasterio_geometry
+        # Clouds over water
+        wtp = self.water_temp_prob(water_temp)
+        bp = self.brightness_prob()
+        water_cloud_prob = (wtp * bp) + cirrus_prob
 
-        if array.dtype == bool:
-            georeference['dtype'] = rasterio.uint8
-            array = array.reshape(1, array.shape[0], array.shape[1])
-            with rasterio.open(outfile, 'w', **georeference) as dst:
-                dst.write(array.astype(rasterio.uint8))
+        # Clouds over land
+        ltp = self.land_temp_prob(tlow, thigh)
+        vp = self.variability_prob(whiteness)
+        land_cloud_prob = (ltp * vp) + cirrus_prob
 
-        else:
-            georeference['dtype'] = array.dtype
-            array = array.reshape(1, array.shape[0], array.shape[1])
-            with rasterio.open(outfile, 'w', **georeference) as dst:
-                dst.write(array.astype(georeference['dtype']))
+        return water_cloud_prob, land_cloud_prob
+
+    def _potential_layers(self):
+        # logger.info("Running initial testsr")
+        whiteness = self.whiteness_index()
+        water = self.water_test()
 
+        # First pass, potential clouds
+        pcps = self.potential_cloud_pixels()
+
+        water_temp = self.temp_water(water)
+        tlow, thigh = self.temp_land(pcps, water)
+        water_cloud_prob, land_cloud_prob = self.cloud_probs(whiteness, water_temp, tlow, thigh)
+        lthreshold = self.land_threshold(land_cloud_prob, pcps, water)
+
+        # logger.info("Calculate potential clouds")
+        pcloud = self.potential_cloud_layer(
+            pcps, water, tlow,
+            land_cloud_prob, lthreshold,
+            water_cloud_prob, WATER_THRESHOLD)
+
+        # Ignoring snow for now as it exhibits many false positives and negatives
+        # when used as a binary mask
+        # psnow = potential_snow_layer(ndsi, green, nir, tirs1)
+        # pcloud = pcloud & ~psnow
+
+        # logger.info("Calculate potential cloud shadows")
+        pshadow = self.potential_cloud_shadow_layer(water)
+
+        return pcloud, pshadow, water
+
+    def _parallel_layers(self):
+        """ Same result as _potential_layers, with the per-pixel stages run over row
+        stripes in a process pool; only the percentile reductions run here, on the
+        full shared arrays.
+        """
+        inputs = dict((name, getattr(self, name)) for name in STRIPE_INPUTS if hasattr(self, name))
+        rows = self.tirs1.shape[0]
+        shape = self.tirs1.shape
+
+        shared, views = {}, {}
+        for name, arr in inputs.items():
+            shared[name], views[name] = _shared_array(arr.dtype, arr.shape)
+            views[name][...] = arr
+        for name, dtype in self._stripe_dtypes(inputs).items():
+            shared[name], views[name] = _shared_array(dtype, shape)
+
+        bounds = np.linspace(0, rows, min(rows, self.workers * 4) + 1).astype(int)
+        stripes = [(a, b) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+
+        pool = multiprocessing.Pool(self.workers, initializer=_init_worker, initargs=(shared,))
+        try:
+            def run(stage, scalars):
+                pool.map(_run_stripe, [(stage, self.sat, a, b, scalars) for a, b in stripes])
+
+            run('tests', ())
+            water_temp = self._water_temp(views['clear_water_temp'])
+            tlow, thigh = self._land_temp(views['clear_land_temp'])
+
+            run('probs', (water_temp, tlow, thigh))
+            lthreshold = self._land_threshold(views['clear_land_prob'])
+
+            run('layers', (tlow, lthreshold))
+        finally:
+            pool.close()
+            pool.join()
+
+        return views['pcloud'], views['pshadow'], views['water']
+
+    def _stripe_dtypes(self, inputs):
+        # run every stage on the first row to learn the output dtypes
+        pilot = Fmask._stripe(self.sat, dict((k, v[:1]) for k, v in inputs.items()))
+        arrays = {}
+        arrays.update(pilot._stripe_stage('tests', arrays, ()))
+        tlow, thigh = np.nanpercentile(arrays['clear_land_temp'], (17.5, 82.5))
+        water_temp = np.nanpercentile(arrays['clear_water_temp'], 82.5)
+        arrays.update(pilot._stripe_stage('probs', arrays, (water_temp, tlow, thigh)))
+        lthreshold = np.nanpercentile(arrays['clear_land_prob'], 82.5) + 0.2
+        arrays.update(pilot._stripe_stage('layers', arrays, (tlow, lthreshold)))
+        return dict((name, arr.dtype) for name, arr in arrays.items())
+
+    def _stripe_stage(self, stage, arrays, scalars):
+        """ Per-pixel work between the global reductions, on one stripe.
+        :param stage: 'tests', 'probs' or 'layers'
+        :param arrays: dict of stripe arrays produced by the earlier stages
+        :param scalars: percentile statistics the stage depends on
+        :return: dict of stripe output arrays
+        """
+        if stage == 'tests':
+            water = self.water_test()
+            pcps = self.potential_cloud_pixels()
+            return {'whiteness': self.whiteness_index(),
+                    'water': water,
+                    'pcps': pcps,
+                    'clear_water_temp': self._clear_water_temp(water),
+                    'clear_land_temp': self._clear_land_temp(pcps, water)}
+
+        if stage == 'probs':
+            water_temp, tlow, thigh = scalars
+            water_cloud_prob, land_cloud_prob = self.cloud_probs(arrays['whiteness'], water_temp, tlow, thigh)
+            return {'water_cloud_prob': water_cloud_prob,
+                    'land_cloud_prob': land_cloud_prob,
+                    'clear_land_prob': self._clear_land_prob(land_cloud_prob, arrays['pcps'],
+                                                             arrays['water'])}
+
+        if stage == 'layers':
+            tlow, lthreshold = scalars
+            pcloud = self.potential_cloud_layer(arrays['pcps'], arrays['water'], tlow,
+                                                arrays['land_cloud_prob'], lthreshold,
+                                                arrays['water_cloud_prob'], WATER_THRESHOLD)
+            return {'pcloud': pcloud,
+                    'pshadow': self.potential_cloud_shadow_layer(arrays['water'])}
+
+        raise ValueError('{} is not an Fmask stage'.format(stage))
+
+    @classmethod
+    def _stripe(cls, sat, arrays):
+        stripe = cls.__new__(cls)
+        stripe.sat = sat
+        for name, arr in arrays.items():
+            setattr(stripe, name, arr)
+        return stripe
+
+    def save_array(self, array, outfile, **kwargs):
+        """ Write an array on the image grid, boolean masks as uint8, see writer.write_geotiff. """
+        print('Writing {}'.format(outfile))
+        write_geotiff(array, outfile, self.image.rasterio_geometry, **kwargs)
         return None
 
     @staticmethod
@@ -653,4 +821,93 @@ class Fmask(object):
     def _counts(arr):
         return np.count_nonzero(~arr), np.count_nonzero(arr)
 
+
+def triage(image, factor=8, min_filter=(3, 3), max_filter=(10, 10), workers=1):
+    """ Quick look at a scene's cloud cover before a full resolution run.
+
+    Runs the same Fmask logic on bands read at 1 / factor resolution, with the
+    filter windows and shadow search radius scaled to the coarse pixel size.
+    :param image: LandsatImage object
+    :param factor: decimation factor
+    :return: dict of 'cloud', 'shadow', 'water' fractions of valid pixels and the coarse
+    combined boolean 'mask'
+    """
+    f = Fmask(image.decimate(factor), workers=workers)
+    cloud, shadow, water = f.cloud_mask(min_filter=_scale_window(min_filter, factor),
+                                        max_filter=_scale_window(max_filter, factor),
+                                        pixel_radius=100.0 / factor)
+    valid = f.mask > 0
+    result = _fractions(valid, cloud=cloud, shadow=shadow, water=water)
+    result['mask'] = cloud | shadow | water
+    return result
+
+
+def triage_report(image, factor=8, **kwargs):
+    """ Compare triage with a full resolution Fmask of the same scene.
+    :param image: LandsatImage object
+    :param factor: decimation factor
+    :return: dict keyed by layer ('cloud', 'shadow', 'water', 'combined') of dicts with the
+    'full' and 'triage' fractions and the per-pixel 'agreement' of the upsampled coarse layer
+    """
+    f = Fmask(image)
+    full = dict(zip(('cloud', 'shadow', 'water'), f.cloud_mask(**kwargs)))
+    full['combined'] = full['cloud'] | full['shadow'] | full['water']
+
+    coarse = Fmask(image.decimate(factor))
+    kwargs.update({'min_filter': _scale_window(kwargs.get('min_filter', (3, 3)), factor),
+                   'max_filter': _scale_window(kwargs.get('max_filter', (10, 10)), factor),
+                   'pixel_radius': kwargs.get('pixel_radius', 100.0) / factor})
+    quick = dict(zip(('cloud', 'shadow', 'water'), coarse.cloud_mask(**kwargs)))
+    quick['combined'] = quick['cloud'] | quick['shadow'] | quick['water']
+
+    valid = f.mask > 0
+    rows = np.arange(valid.shape[0]) * coarse.mask.shape[0] // valid.shape[0]
+    cols = np.arange(valid.shape[1]) * coarse.mask.shape[1] // valid.shape[1]
+    full_fractions = _fractions(valid, **full)
+    quick_fractions = _fractions(coarse.mask > 0, **quick)
+
+    report = {}
+    for layer in full:
+        upsampled = quick[layer][rows[:, None], cols[None, :]]
+        report[layer] = {'full': full_fractions[layer],
+                         'triage': quick_fractions[layer],
+                         'agreement': np.count_nonzero((upsampled == full[layer]) & valid) /
+                                      float(max(np.count_nonzero(valid), 1))}
+    return report
+
+
+def _scale_window(window, factor):
+    if not window:
+        return window
+    return tuple(max(1, int(round(w / float(factor)))) for w in window)
+
+
+def _fractions(valid, **layers):
+    count = float(max(np.count_nonzero(valid), 1))
+    return dict((name, np.count_nonzero(layer & valid) / count) for name, layer in layers.items())
+
+
+def _shared_array(dtype, shape):
+    dtype = np.dtype(dtype)
+    raw = multiprocessing.RawArray(ctypes.c_char, max(int(np.prod(shape)) * dtype.itemsize, 1))
+    return (raw, dtype.str, shape), _shared_view(raw, dtype, shape)
+
+
+def _shared_view(raw, dtype, shape):
+    return np.frombuffer(raw, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+
+
+def _init_worker(shared):
+    _SHARED.clear()
+    for name, (raw, dtype, shape) in shared.items():
+        _SHARED[name] = _shared_view(raw, dtype, shape)
+
+
+def _run_stripe(args):
+    stage, sat, start, stop, scalars = args
+    arrays = dict((name, arr[start:stop]) for name, arr in _SHARED.items())
+    stripe = Fmask._stripe(sat, dict((k, v) for k, v in arrays.items() if k in STRIPE_INPUTS))
+    for name, arr in stripe._stripe_stage(stage, arrays, scalars).items():
+        _SHARED[name][start:stop] = arr
+
 # ========================= EOF ====================================================================
@@ -0,0 +1,155 @@
+# =============================================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================================
+
+import os
+import json
+import hashlib
+
+from rasterio import open as rasopen
+from rasterio.crs import CRS
+from rasterio.transform import Affine
+
+from sat_image import mtl
+
+# registry location, override with the SAT_IMAGE_GRIDS environment variable
+DEFAULT_REGISTRY = os.path.join(os.path.expanduser('~'), '.sat_image', 'grids.json')
+
+
+def scene_attributes(obj):
+    """ MTL attributes of a scene with lower-case names, as set on LandsatImage, without
+    opening any band.
+    :param obj: scene directory
+    :return: dict
+    """
+    meta = mtl.parsemeta(obj)
+    attrs = {}
+    for group in meta[list(meta)[0]].values():
+        for key, val in group.items():
+            attrs[key.lower()] = val
+    return attrs
+
+
+def grid_hash(profile):
+    """ Hash identifying a pixel grid.
+    :param profile: dict with crs, transform, height and width
+    :return: hex digest string
+    """
+    grid = [CRS(profile['crs']).to_wkt(), [round(x, 6) for x in list(profile['transform'])[:6]],
+            int(profile['width']), int(profile['height'])]
+    return hashlib.sha1(json.dumps(grid).encode('utf-8')).hexdigest()
+
+
+def grid_to_dict(profile):
+    """ JSON-serializable grid of a profile, see grid_from_dict. """
+    return {'crs': CRS(profile['crs']).to_wkt(),
+            'transform': list(profile['transform'])[:6],
+            'width': int(profile['width']),
+            'height': int(profile['height']),
+            'hash': grid_hash(profile)}
+
+
+def grid_from_dict(grid):
+    """ Profile dict with crs, transform, height and width from grid_to_dict output. """
+    return {'crs': CRS.from_wkt(grid['crs']),
+            'transform': Affine(*grid['transform']),
+            'width': grid['width'],
+            'height': grid['height']}
+
+
+def scene_profile(obj):
+    """ Profile of a scene's first band, the grid LandsatImage reports, without building the image.
+    :param obj: scene directory
+    :return: rasterio meta dict
+    """
+    tifs = sorted([x for x in os.listdir(obj) if x.endswith('.TIF')])
+    if not tifs:
+        raise ValueError('No .TIF bands in {}'.format(obj))
+    with rasopen(os.path.join(obj, tifs[0])) as src:
+        return src.meta.copy()
+
+
+class GridRegistry(object):
+    ''' Persistent target grids keyed by WRS path/row.
+
+    The first scene seen for a path/row fixes its grid; every later warp, virtual stack
+    and product for that path/row is put on the same pixel grid, across runs.
+    Stored as JSON {'PPP_RRR': grid}, see grid_to_dict.
+    '''
+
+    def __init__(self, path=None):
+        self.path = path or os.environ.get('SAT_IMAGE_GRIDS', DEFAULT_REGISTRY)
+        self.grids = self._load()
+
+    @staticmethod
+    def key(path, row):
+        return '{:03d}_{:03d}'.format(int(path), int(row))
+
+    def get(self, path, row):
+        """ Registered grid of a path/row.
+        :return: profile dict with crs, transform, height and width, or None
+        """
+        grid = self.grids.get(self.key(path, row))
+        return None if grid is None else grid_from_dict(grid)
+
+    def register(self, path, row, profile, overwrite=False):
+        """ Store the grid of a path/row; an existing grid is kept unless overwrite.
+        :return: the registered profile dict
+        """
+        # reload, another process may have registered grids since
+        self.grids = self._load()
+        key = self.key(path, row)
+        if overwrite or key not in self.grids:
+            self.grids[key] = grid_to_dict(profile)
+            self._save()
+        return grid_from_dict(self.grids[key])
+
+    def grid_for(self, obj):
+        """ Grid of the scene's path/row, registering the scene's own grid if there is none yet.
+        :param obj: scene directory or LandsatImage
+        :return: profile dict with crs, transform, height and width
+        """
+        if isinstance(obj, str):
+            attrs = scene_attributes(obj)
+            path, row = attrs['wrs_path'], attrs['wrs_row']
+        else:
+            path, row = obj.wrs_path, obj.wrs_row
+
+        grid = self.get(path, row)
+        if grid is None:
+            profile = scene_profile(obj) if isinstance(obj, str) else obj.rasterio_geometry
+            grid = self.register(path, row, profile)
+        return grid
+
+    def _load(self):
+        if not os.path.isfile(self.path):
+            return {}
+        with open(self.path, 'r') as f:
+            return json.load(f)
+
+    def _save(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        temp = '{}.{}.tmp'.format(self.path, os.getpid())
+        with open(temp, 'w') as f:
+            json.dump(self.grids, f, indent=1, sort_keys=True)
+        os.replace(temp, self.path)
+
+
+if __name__ == '__main__':
+    home = os.path.expanduser('~')
+
+# ========================= EOF ================================================================
@@ -15,10 +15,21 @@
 # =============================================================================================
 
 import os
+import copy
 import shutil
+from contextlib import contextmanager
+from functools import wraps
 from rasterio import open as rasopen
-from numpy import where, pi, cos, nan, inf, true_divide, errstate, log
-from numpy import float32, sin, deg2rad, array, isnan
+from rasterio.enums import Resampling
+from rasterio.transform import Affine
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import transform as transform_coords
+from rasterio.windows import Window, transform as window_transform
+from numpy import where, pi, cos, nan, inf, true_divide, errstate
+from numpy import float32, sin, deg2rad, array, isnan, arange, zeros, uint8
+from numpy import asarray, floor, argsort, unique, split
+from numpy import empty, copyto, less, equal, subtract, add, multiply, result_type
+from numpy import greater, less_equal, minimum, power, square
 from shapely.geometry import Polygon, mapping
 from fiona import open as fiopen
 from fiona.crs import from_epsg
@@ -26,7 +37,75 @@ from tempfile import mkdtemp
 from datetime import datetime
 
 from bounds import RasterBounds
-from sat_image import mtl
+from sat_image import mtl, tasumi, thermal
+from sat_image.band_map import BandMap
+from sat_image.bandmath import BandMath
+from sat_image.buffers import BufferPool
+from sat_image.grid import GridRegistry, scene_attributes
+from sat_image.indices import spectral_indices
+from sat_image.pipeline import CLASS_PRODUCTS, export_products, get_product
+from sat_image.prefetch import PrefetchReader
+from sat_image.writer import write_geotiff
+from sat_image.zonal import zonal_stats
+
+
+# Landsat 8 Collection 1 BQA bit fields, name: (first bit, number of bits)
+QA_BITS = {'fill': (0, 1),
+           'terrain': (1, 1),
+           'saturation': (2, 2),
+           'cloud': (4, 1),
+           'cloud_confidence': (5, 2),
+           'shadow_confidence': (7, 2),
+           'snow_confidence': (9, 2),
+           'cirrus_confidence': (11, 2)}
+
+QA_CONFIDENCE = {'low': 1, 'medium': 2, 'high': 3}
+
+_QA_LUTS = {}
+
+
+def qa_lut(field):
+    """ Look-up table from every 16-bit BQA value to the value of one bit field.
+    :param field: key of QA_BITS
+    :return: uint8 array of length 2 ** 16
+    """
+    if field not in _QA_LUTS:
+        bit, length = QA_BITS[field]
+        _QA_LUTS[field] = ((arange(2 ** 16) >> bit) & (2 ** length - 1)).astype(uint8)
+    return _QA_LUTS[field]
+
+
+def cached(func):
+    """ Memoize a band read or product method while its image is in caching() mode.
+
+    Cached arrays are made read-only, as every later caller gets the same array. An out
+    array is not part of the key: while caching, the cached result is copied into it.
+    Calls with array arguments, e.g. a per-pixel elevation, are not cached.
+    """
+
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        if self._cache is None:
+            return func(self, *args, **kwargs)
+        out = kwargs.pop('out', None)
+        key = (func.__name__, args, tuple(sorted(kwargs.items())))
+        try:
+            hash(key)
+        except TypeError:
+            if out is not None:
+                kwargs['out'] = out
+            return func(self, *args, **kwargs)
+        if key not in self._cache:
+            arr = func(self, *args, **kwargs)
+            if hasattr(arr, 'flags'):
+                arr.flags.writeable = False
+            self._cache[key] = arr
+        if out is not None:
+            copyto(out, self._cache[key])
+            return out
+        return self._cache[key]
+
+    return wrapper
 
 
 class UnmatchedStackGeoError(ValueError):
@@ -56,6 +135,17 @@ class LandsatImage(object):
 
         self.date_acquired = None
 
+        # read parameters, changed only on the copies returned by decimate(), windowed() and align()
+        self._window = None
+        self._out_shape = None
+        self._vrt_options = None
+
+        # band reads and products, kept while in caching()
+        self._cache = None
+
+        # temporary arrays of product methods, reused while in pooled()
+        self._pool = None
+
         self.file_list = os.listdir(obj)
         self.tif_list = [x for x in os.listdir(obj) if x.endswith('.TIF')]
         self.tif_list.sort()
@@ -92,17 +182,7 @@ class LandsatImage(object):
                     transform = src.transform
                     profile = src.profile
                 meta = src.meta.copy()
-                self.rasterio_geometry = meta
-                self.profile = profile
-                self.transform = transform
-                self.shape = (1, profile['height'], profile['width'])
-
-                bounds = RasterBounds(affine_transform=transform,
-                                      profile=profile,
-                                      latlon=False)
-                self.bounds = bounds
-                self.north, self.west, self.south, self.east = bounds.get_nwse_tuple()
-                self.coords = bounds.as_tuple('nsew')
+                self._set_geometry(meta, profile, transform)
 
         self.solar_zenith = 90. - self.sun_elevation
         self.solar_zenith_rad = self.solar_zenith * pi / 180
@@ -115,14 +195,288 @@ class LandsatImage(object):
         self.scene_coords_deg = self._scene_centroid()
         self.scene_coords_rad = deg2rad(self.scene_coords_deg[0]), deg2rad(self.scene_coords_deg[1])
 
-    def _get_band(self, band_str):
+    def _set_geometry(self, meta, profile, transform):
+        if self._window is None:
+            # transform of the full grid that windows are taken from
+            self._base_transform = transform
+        self.rasterio_geometry = meta
+        self.profile = profile
+        self.transform = transform
+        self.shape = (1, profile['height'], profile['width'])
+
+        bounds = RasterBounds(affine_transform=transform,
+                              profile=profile,
+                              latlon=False)
+        self.bounds = bounds
+        self.north, self.west, self.south, self.east = bounds.get_nwse_tuple()
+        self.coords = bounds.as_tuple('nsew')
+
+    @cached
+    def _read(self, band_str, out=None):
         path = self.tif_dict[band_str]
+        # GDAL converts to the dtype of out, and reads at the resolution of its shape
+        shape = {'out_shape': self._out_shape} if out is None else {'out': out}
         with rasopen(path) as src:
-            arr = src.read(1)
-        arr = array(arr, dtype=float32)
-        arr[arr < 1.] = nan
+            if self._vrt_options:
+                with WarpedVRT(src, **self._vrt_options) as vrt:
+                    arr = vrt.read(1, window=self._window, **shape)
+            else:
+                arr = src.read(1, window=self._window, **shape)
         return arr
 
+    def _get_band(self, band_str, out=None):
+        """ Band as float32, nan where the DN is below 1.
+        :param out: float32 array of the image shape to read into
+        """
+        if out is None:
+            out = empty(self.shape[1:], dtype=float32)
+        self._read(band_str, out=out)
+        fill = less(out, 1., out=self._take(out.shape, bool))
+        copyto(out, nan, where=fill)
+        self._give(fill)
+        return out
+
+    def decimate(self, factor):
+        """ Copy of the image that reads every band at reduced resolution.
+
+        Bands are read with nearest-neighbour decimation (using overviews where the
+        TIF has them), so all product methods return arrays on the coarse grid.
+        :param factor: decimation factor, e.g. 8 reads 30 m bands onto a 240 m grid
+        :return: image of the same class, with shape, transform and geometry of the coarse grid
+        """
+        if factor < 1:
+            raise ValueError('Decimation factor must be >= 1, not {}'.format(factor))
+
+        height, width = self.rasterio_geometry['height'], self.rasterio_geometry['width']
+        coarse_h, coarse_w = max(1, int(round(height / float(factor)))), max(1, int(round(width / float(factor))))
+        transform = self.transform * Affine.scale(width / float(coarse_w), height / float(coarse_h))
+
+        meta, profile = self.rasterio_geometry.copy(), self.profile.copy()
+        for geo in (meta, profile):
+            geo.update({'height': coarse_h, 'width': coarse_w, 'transform': transform})
+
+        view = self._view()
+        view._out_shape = (coarse_h, coarse_w)
+        view._set_geometry(meta, profile, transform)
+        return view
+
+    def windowed(self, window):
+        """ Copy of the image that reads only a window of each band.
+
+        Product methods of the copy compute only over the window, e.g.
+        image.windowed(Window(0, 0, 512, 512)).ndvi()
+        :param window: rasterio Window, in pixels of this image's grid
+        :return: image of the same class, with shape, transform and geometry of the window
+        """
+        if self._out_shape is not None:
+            raise ValueError('Take the window before decimating the image')
+
+        if self._window is not None:
+            window = Window(self._window.col_off + window.col_off, self._window.row_off + window.row_off,
+                            window.width, window.height)
+        transform = window_transform(window, self._base_transform)
+
+        height, width = int(window.height), int(window.width)
+        meta, profile = self.rasterio_geometry.copy(), self.profile.copy()
+        for geo in (meta, profile):
+            geo.update({'height': height, 'width': width, 'transform': transform})
+
+        view = self._view()
+        view._window = window
+        view._set_geometry(meta, profile, transform)
+        return view
+
+    def align(self, target=None, resampling=Resampling.nearest, registry=None):
+        """ Copy of the image that reads every band warped onto another grid.
+
+        Bands are read through a rasterio WarpedVRT, so nothing is written to disk and only
+        the windows actually read are warped; windowed() and decimate() apply on the new grid.
+        :param target: LandsatImage, or profile dict with crs, transform, height and width;
+        default the grid registered for this scene's path/row
+        :param resampling: rasterio Resampling method
+        :param registry: GridRegistry used when no target is given, default GridRegistry()
+        :return: image of the same class, with shape, transform and geometry of the target grid
+        """
+        if self._window is not None or self._out_shape is not None:
+            raise ValueError('Align the full image, before windowing or decimating')
+
+        if target is None:
+            target = (registry or GridRegistry()).grid_for(self)
+        elif isinstance(target, LandsatImage):
+            target = target.rasterio_geometry
+        grid = dict((k, target[k]) for k in ['crs', 'transform', 'height', 'width'])
+
+        meta, profile = self.rasterio_geometry.copy(), self.profile.copy()
+        for geo in (meta, profile):
+            geo.update(grid)
+
+        view = self._view()
+        view._vrt_options = dict(grid, resampling=resampling)
+        view._set_geometry(meta, profile, grid['transform'])
+        return view
+
+    def prefetch(self, block_size=512, bands=None, products=None, depth=2, workers=None):
+        """ Iterate over (window, windowed view) pairs, reading upcoming windows in the background.
+
+        e.g.
+        for window, view in image.prefetch(products=('ndvi',)):
+            ndvi = view.ndvi()
+        :return: prefetch.PrefetchReader, see its parameters
+        """
+        return PrefetchReader(self, block_size, bands, products, depth, workers)
+
+    def _view(self):
+        view = copy.copy(self)
+        view._cache = None if self._cache is None else {}
+        return view
+
+    @contextmanager
+    def pooled(self, pool=None):
+        """ Within this block, product methods take their temporary arrays from a BufferPool
+        and give them back when done, so repeated calls reuse memory instead of allocating it.
+
+        Pass the same pool to every scene a worker processes, and out arrays to the product
+        methods, to compute same-sized scenes without new allocations, e.g.
+        pool, ndvi = BufferPool(), None
+        for image in images:
+            with image.pooled(pool):
+                ndvi = image.ndvi(out=ndvi)
+        :param pool: buffers.BufferPool, default the current pool or a new one
+        """
+        previous = self._pool
+        self._pool = pool if pool is not None else previous or BufferPool()
+        try:
+            yield self._pool
+        finally:
+            self._pool = previous
+
+    def _take(self, shape, dtype=float32):
+        if self._pool is None:
+            return empty(shape, dtype=dtype)
+        return self._pool.take(shape, dtype)
+
+    def _give(self, *arrays):
+        if self._pool is not None:
+            self._pool.give(*arrays)
+
+    def _temporary(self, method, *args):
+        """ method(*args) for use within a product method, into a pooled buffer unless
+        it comes from the cache; hand it to _give() when done.
+        """
+        if self._cache is not None:
+            return method(*args)
+        return method(*args, out=self._take(self.shape[1:]))
+
+    @staticmethod
+    def _writable(method, args, out=None):
+        """ method(*args) into out, as an array the caller may modify in place;
+        read-only cached results are copied.
+        """
+        arr = method(*args, out=out)
+        return arr if arr.flags.writeable else arr.copy()
+
+    def _normalized_difference(self, method, a, b, out=None):
+        """ (a - b) / (a + b) of two bands of a product method, nan where a + b is zero.
+        :param out: float32 array of the image shape
+        """
+        first, second = self._temporary(method, a), self._temporary(method, b)
+        out = subtract(first, second, out=out)
+        total = add(first, second, out=self._take(first.shape))
+        self._divide(out, total)
+        self._give(first, second, total)
+        return out
+
+    def _divide(self, out, total):
+        """ out / total in place, nan where that is positive infinity, as _divide_zero. """
+        with errstate(divide='ignore', invalid='ignore'):
+            true_divide(out, total, out=out)
+        infinite = equal(out, inf, out=self._take(out.shape, bool))
+        copyto(out, nan, where=infinite)
+        self._give(infinite)
+        return out
+
+    @contextmanager
+    def caching(self):
+        """ Within this block each band is read, and each product computed, only once.
+
+        e.g.
+        with image.caching():
+            f = Fmask(image)
+            ndvi = image.ndvi()  # reuses the reflectance and ndvi computed for Fmask
+        """
+        previous = self._cache
+        if previous is None:
+            self._cache = {}
+        try:
+            yield self
+        finally:
+            self._cache = previous
+
+    def sample_points(self, points, products=('ndvi',), ids=None, crs=None, block_size=512):
+        """ Values of products at points, reading only small windows around the points.
+
+        Points are mapped to rows and columns with the image transform and grouped by
+        block_size square blocks; for each block, bands are read and products computed
+        only on the smallest window holding its points.
+        :param points: sequence of (x, y) coordinates
+        :param products: iterable of pipeline.PRODUCTS keys
+        :param ids: identifier of each point, default its index in points
+        :param crs: CRS of the points, default the image CRS
+        :param block_size: block width and height in pixels
+        :return: list of dicts with point, scene, product, value, row and col, one for each
+        product of each point inside the image
+        """
+        for product in products:
+            if product in CLASS_PRODUCTS:
+                raise ValueError('{} needs the whole scene and cannot be sampled'.format(product))
+
+        points = asarray(points, dtype=float).reshape(-1, 2)
+        ids = list(range(len(points))) if ids is None else list(ids)
+        xs, ys = points[:, 0], points[:, 1]
+        if crs is not None and crs != self.rasterio_geometry['crs']:
+            xs, ys = (asarray(c) for c in transform_coords(crs, self.rasterio_geometry['crs'], xs, ys))
+
+        cols, rows = ~self.transform * (xs, ys)
+        rows, cols = floor(rows).astype(int), floor(cols).astype(int)
+        height, width = self.rasterio_geometry['height'], self.rasterio_geometry['width']
+        inside = ((rows >= 0) & (rows < height) & (cols >= 0) & (cols < width)).nonzero()[0]
+        if not inside.size:
+            return []
+
+        blocks = (rows[inside] // block_size) * (width // block_size + 1) + cols[inside] // block_size
+        order = inside[argsort(blocks, kind='stable')]
+        _, starts = unique(blocks[argsort(blocks, kind='stable')], return_index=True)
+
+        records = []
+        for group in split(order, starts[1:]):
+            r0, c0 = int(rows[group].min()), int(cols[group].min())
+            window = Window(c0, r0, int(cols[group].max()) - c0 + 1, int(rows[group].max()) - r0 + 1)
+            view = self.windowed(window)
+            with view.caching():
+                for product in products:
+                    values = get_product(view, product)[rows[group] - r0, cols[group] - c0]
+                    for i, value in zip(group, values):
+                        records.append({'point': ids[i], 'scene': self.landsat_scene_id,
+                                        'product': product, 'value': float(value),
+                                        'row': int(rows[i]), 'col': int(cols[i])})
+        return records
+
+    def export_products(self, outfile, products=('ndvi', 'lai', 'albedo', 'emissivity', 'lst'), **kwargs):
+        """ Write several products as the bands of one GeoTIFF, see pipeline.export_products.
+        :param outfile: output GeoTIFF
+        :param products: iterable of pipeline.PRODUCTS keys
+        """
+        return export_products(self, outfile, products, **kwargs)
+
+    def zonal_stats(self, zones, product='ndvi', stats=('count', 'mean', 'std'), percentiles=(),
+                    source=None, block_size=None, **kwargs):
+        """ Statistics of a product within each zone of a zonal.ZoneIndex.
+        :param zones: ZoneIndex, build it once per grid and reuse it for every scene
+        :return: dict of 'zone' ids and an array per statistic, see zonal.zonal_stats
+        """
+        return zonal_stats(self, zones, product, stats, percentiles, source,
+                           block_size=block_size, **kwargs)
+
     def _scene_centroid(self):
         """ Compute image center coordinates
         :return: Tuple of image center in lat, lon
@@ -207,21 +561,32 @@ class LandsatImage(object):
 
                 return features
 
-    def save_array(self, arr, output_filename):
-        geometry = self.rasterio_geometry
-        arr = arr.reshape(1, arr.shape[0], arr.shape[1])
-        geometry['dtype'] = arr.dtype
-        with rasopen(output_filename, 'w', **geometry) as dst:
-            dst.write(arr)
+    def save_array(self, arr, output_filename, writer=None, **kwargs):
+        """ Write an array on this image's grid to a tiled, compressed GeoTIFF.
+        :param arr: array of shape (rows, cols) or (bands, rows, cols)
+        :param writer: writer.AsyncWriter, write in the background and return its Future
+        :param kwargs: passed to writer.write_geotiff, e.g. dtype='int16', scale=0.0001, cog=True
+        """
+        if writer is not None:
+            return writer.write(arr, output_filename, self.rasterio_geometry.copy(), **kwargs)
+        write_geotiff(arr, output_filename, self.rasterio_geometry, **kwargs)
         return None
 
-    def mask_by_image(self, arr):
-        image = self._get_band('b1')
-        image = array(image, dtype=float32)
-        image[image < 1.] = nan
-        arr = where(isnan(image), nan, arr)
-        return arr
-
+    def mask_by_image(self, arr, out=None):
+        """ arr with nan outside the image, where band 1 is nan.
+        :param out: array to write into, may be arr itself
+        """
+        if out is None:
+            out = empty(arr.shape, dtype=result_type(arr, nan))
+        if out is not arr:
+            copyto(out, arr)
+        image = self._temporary(self._get_band, 'b1')
+        fill = isnan(image, out=self._take(image.shape, bool))
+        copyto(out, nan, where=fill)
+        self._give(image, fill)
+        return out
+
+    @cached
     def mask(self):
         image = self._get_band('b1')
         image = array(image, dtype=float32)
@@ -229,6 +594,274 @@ class LandsatImage(object):
         arr = where(isnan(image), 0, 1)
         return arr
 
+    def role_band(self, role):
+        """ Band number of a spectral role on this sensor, see BandMap.roles.
+        :param role: 'blue', 'green', 'red', 'nir', 'swir1', 'swir2' or 'thermal'
+        :return: int, e.g. 'red' is band 3 of Landsat 5 and 7, band 4 of Landsat 8
+        """
+        try:
+            return BandMap().roles[self.satellite][role]
+        except KeyError:
+            raise ValueError('{} is not a spectral role of {}'.format(role, self.satellite))
+
+    def _role_reflectance(self, *roles):
+        return [self.reflectance(self.role_band(role)) for role in roles]
+
+    @cached
+    def ndvi(self, out=None):
+        """ Normalized difference vegetation index, (nir - red) / (nir + red).
+        :param out: float32 array of the image shape
+        :return: NDVI
+        """
+        return self._normalized_difference(self.reflectance, self.role_band('nir'),
+                                           self.role_band('red'), out)
+
+    @cached
+    def ndsi(self, out=None):
+        """ Normalized difference snow index, (green - swir1) / (green + swir1).
+        :param out: float32 array of the image shape
+        :return: NDSI
+        """
+        return self._normalized_difference(self.reflectance, self.role_band('green'),
+                                           self.role_band('swir1'), out)
+
+    @cached
+    def ndwi(self, out=None):
+        """ Normalized difference water index, (green - nir) / (green + nir).
+        McFeeters, 1996
+        :param out: float32 array of the image shape
+        :return: NDWI
+        """
+        return self._normalized_difference(self.reflectance, self.role_band('green'),
+                                           self.role_band('nir'), out)
+
+    @cached
+    def nbr(self, out=None):
+        """ Normalized burn ratio, (nir - swir2) / (nir + swir2).
+        Key and Benson, 2006
+        :param out: float32 array of the image shape
+        :return: NBR
+        """
+        return self._normalized_difference(self.reflectance, self.role_band('nir'),
+                                           self.role_band('swir2'), out)
+
+    @cached
+    def savi(self, soil=0.5, out=None):
+        """ Soil-adjusted vegetation index, (1 + L) * (nir - red) / (nir + red + L).
+        Huete, 1988
+        :param soil: soil brightness correction L
+        :param out: float32 array of the image shape
+        :return: SAVI
+        """
+        red = self._temporary(self.reflectance, self.role_band('red'))
+        nir = self._temporary(self.reflectance, self.role_band('nir'))
+        out = subtract(nir, red, out=out)
+        out *= 1 + soil
+        total = add(nir, red, out=self._take(out.shape))
+        total += soil
+        self._divide(out, total)
+        self._give(red, nir, total)
+
+        return out
+
+    @cached
+    def evi(self, out=None):
+        """ Enhanced vegetation index, 2.5 * (nir - red) / (nir + 6 * red - 7.5 * blue + 1).
+        Huete et al., 2002
+        :param out: float32 array of the image shape
+        :return: EVI
+        """
+        red = self._temporary(self.reflectance, self.role_band('red'))
+        nir = self._temporary(self.reflectance, self.role_band('nir'))
+        out = subtract(nir, red, out=out)
+        out *= 2.5
+        total = multiply(red, 6., out=self._take(out.shape))
+        total += nir
+        self._give(red)
+        blue = self._temporary(self.reflectance, self.role_band('blue'))
+        term = multiply(blue, 7.5, out=self._take(out.shape))
+        total -= term
+        total += 1.
+        self._divide(out, total)
+        self._give(nir, blue, term, total)
+
+        return out
+
+    @cached
+    def lai(self, out=None):
+        """
+        Leaf area index (LAI), or the surface area of leaves to surface area ground.
+        Trezza and Allen, 2014
+        :param out: float32 array of the image shape
+        :return: LAI [-]
+        """
+        # 7 * ndvi ** 3, at most 6, in place
+        lai = self._writable(self.ndvi, (), out)
+        power(lai, 3, out=lai)
+        lai *= 7.0
+        minimum(lai, 6., out=lai)
+        return lai
+
+    @cached
+    def albedo(self, model='smith', elevation=0., vapor_pressure=1., out=None):
+        """Finds broad-band surface reflectance (albedo)
+
+        Smith (2010),  “The heat budget of the earth’s surface deduced from space”
+        toa reflectance of the blue, red, nir, swir1 and swir2 bands
+        # normalized i.e. 0.356 + 0.130 + 0.373 + 0.085 + 0.07 = 1.014
+
+        Should have option for Liang, 2000;
+
+        Tasumi (2008), "At-Surface Reflectance and Albedo from Satellite for
+                        Operational Calculation of Land Surface Energy Balance"
+        at-surface reflectance of the blue, green, red, nir, swir1 and swir2 bands, weighted;
+        the per-band corrections fold into one weight per band and an offset, see
+        tasumi.albedo_coefficients
+
+        :param model: 'smith' or 'tasumi'
+        :param elevation: tasumi, m above sea level, scalar or array of the image shape;
+        see tasumi.tasumi_albedo to compute with a per-pixel elevation block by block
+        :param vapor_pressure: tasumi, near-surface vapor pressure, kPa
+        :param out: float32 array of the image shape
+        :return albedo array of floats
+        """
+        if model == 'smith':
+            # (0.356 * blue + 0.130 * red + 0.373 * nir + 0.085 * swir1 + 0.072 * swir2 - 0.0018) / 1.014,
+            # accumulated in place
+            alb = None
+            for role, weight in [('blue', 0.356), ('red', 0.130), ('nir', 0.373), ('swir1', 0.085),
+                                 ('swir2', 0.072)]:
+                toa = self._temporary(self.reflectance, self.role_band(role))
+                if alb is None:
+                    alb = multiply(toa, weight, out=out)
+                    term = self._take(alb.shape)
+                else:
+                    alb += multiply(toa, weight, out=term)
+                self._give(toa)
+            self._give(term)
+            alb -= 0.0018
+            alb /= 1.014
+            return alb
+
+        if model != 'tasumi':
+            raise ValueError('{} is not a valid albedo model, use smith or tasumi'.format(model))
+
+        weights, offset = tasumi.albedo_coefficients(cos(self.solar_zenith_rad), elevation, vapor_pressure)
+        alb = empty(self.shape[1:], dtype=float32) if out is None else out
+        copyto(alb, offset)
+        term = self._take(alb.shape)
+        for role in tasumi.TASUMI_ROLES:
+            toa = self._temporary(self.reflectance, self.role_band(role))
+            alb += multiply(toa, weights[role], out=term)
+            self._give(toa)
+        self._give(term)
+
+        return alb
+
+    @cached
+    def surface_reflectance(self, band, elevation=0., vapor_pressure=1.):
+        """ At-surface reflectance of a reflective band, Tasumi et al. (2008).
+        :param band: band number of a spectral role in tasumi.TASUMI_ROLES
+        :param elevation: m above sea level, scalar or array of the image shape
+        :param vapor_pressure: near-surface vapor pressure, kPa
+        :return: at-surface reflectance [-]
+        """
+        roles = dict((number, role) for role, number in BandMap().roles[self.satellite].items())
+        if roles.get(band) not in tasumi.TASUMI_ROLES:
+            raise ValueError('Band {} of {} has no at-surface correction'.format(band, self.satellite))
+
+        scale, offset = tasumi.surface_coefficients(roles[band], cos(self.solar_zenith_rad), elevation,
+                                                    vapor_pressure)
+        rho = self._writable(self.reflectance, (band,))
+        rho *= scale
+        rho += offset
+
+        return rho
+
+    def thermal_constants(self, band):
+        """ Thermal conversion constants K1, K2 of a thermal band. """
+        return self.k1, self.k2
+
+    @cached
+    def emissivity(self, approach='tasumi', out=None):
+        """ Narrow-band surface emissivity.
+        :param approach: 'tasumi', Tasumi et al. (2003), from LAI; or 'sobrino', Sobrino et al. (2004),
+        from NDVI and red reflectance
+        :param out: float32 array of the image shape
+        :return: emissivity [-]
+        """
+        if approach not in ['tasumi', 'sobrino']:
+            raise ValueError('{} is not a valid emissivity approach, use tasumi or sobrino'.format(approach))
+        ndvi = self._temporary(self.ndvi)
+        mask = self._take(ndvi.shape, bool)
+
+        if approach == 'tasumi':
+            # 0.97 + 0.0033 * lai, 0.98 where lai > 3, 0.99 where ndvi <= 0, in place
+            lai = self._temporary(self.lai)
+            out = multiply(lai, 0.0033, out=out)
+            out += 0.97
+            copyto(out, 0.98, where=greater(lai, 3., out=mask))
+            copyto(out, 0.99, where=less_equal(ndvi, 0., out=mask))
+            self._give(lai)
+
+        else:
+            # 0.004 * pv + 0.986 for 0.2 <= ndvi <= 0.5, pv = ((ndvi - 0.2) / (0.5 - 0.2)) ** 2;
+            # ndvi above, red reflectance below, and 0.99 where ndvi is nan, in place
+            out = subtract(ndvi, 0.2, out=out)
+            out /= 0.5 - 0.2
+            square(out, out=out)
+            out *= 0.004
+            out += 0.986
+            copyto(out, ndvi, where=greater(ndvi, 0.5, out=mask))
+            red = self._temporary(self.reflectance, self.role_band('red'))
+            copyto(out, red, where=less(ndvi, 0.2, out=mask))
+            copyto(out, 0.99, where=isnan(ndvi, out=mask))
+            self._give(red)
+
+        self._give(ndvi, mask)
+        return out
+
+    @cached
+    def land_surface_temp(self, out=None):
+        """ Single-channel land surface temperature of the thermal band (Landsat 8 band 10),
+        with the mean atmospheric values of Allen (2007), see thermal.single_channel_lst.
+        :param out: float32 array of the image shape
+        :return: LST, K
+        """
+        band = self.role_band('thermal')
+        k1, k2 = self.thermal_constants(band)
+        rad, epsilon = self._temporary(self.radiance, band), self._temporary(self.emissivity)
+        work = self._take(rad.shape)
+        out = thermal.single_channel_lst(rad, epsilon, k1, k2, out=out, work=work)
+        self._give(rad, epsilon, work)
+        return out
+
+    def thermal_products(self, products=('bt', 'lst'), block_size=512, water_vapor=2.0, prefetch=0):
+        """ Brightness temperature, emissivity and LST in one pass, see thermal.thermal_products.
+        :return: dict of float32 arrays
+        """
+        return thermal.thermal_products(self, products, block_size, water_vapor, prefetch)
+
+    def spectral_indices(self, indices=('ndvi',), block_size=512, prefetch=0):
+        """ Several spectral indices in one pass, each band read once, see indices.spectral_indices.
+        :return: dict of float32 arrays
+        """
+        return spectral_indices(self, indices, block_size, prefetch)
+
+    def band_math(self, expressions, block_size=512, replace=nan):
+        """ Evaluate band-math expressions, e.g. '(b5 - b4) / (b5 + b4)', see bandmath.BandMath.
+
+        Shared subexpressions and band reads of all the expressions are computed once.
+        :param expressions: expression string, list of strings, or dict of name: string
+        :param block_size: block width and height in pixels, None for the whole image at once
+        :param replace: value of a positive division by zero
+        :return: float32 array for a string, else dict of expression or name: float32 array
+        """
+        results = BandMath(expressions, replace, self.satellite).evaluate(self, block_size)
+        if isinstance(expressions, str):
+            return results[expressions]
+        return results
+
 
 class Landsat5(LandsatImage):
     def __init__(self, obj):
@@ -246,23 +879,28 @@ class Landsat5(LandsatImage):
 
         self.k1, self.k2 = 607.76, 1260.56
 
-    def radiance(self, band):
+    @cached
+    def radiance(self, band, out=None):
         qcal_min = getattr(self, 'quantize_cal_min_band_{}'.format(band))
         qcal_max = getattr(self, 'quantize_cal_max_band_{}'.format(band))
         l_min = getattr(self, 'radiance_minimum_band_{}'.format(band))
         l_max = getattr(self, 'radiance_maximum_band_{}'.format(band))
-        qcal = self._get_band('b{}'.format(band))
-        rad = ((l_max - l_min) / (qcal_max - qcal_min)) * (qcal - qcal_min) + l_min
+        rad = self._get_band('b{}'.format(band), out=out)
+        # ((l_max - l_min) / (qcal_max - qcal_min)) * (qcal - qcal_min) + l_min, in place
+        rad -= qcal_min
+        rad *= (l_max - l_min) / (qcal_max - qcal_min)
+        rad += l_min
 
-        return rad.astype(float32)
+        return rad
 
+    @cached
     def brightness_temp(self, band, temp_scale='K'):
 
         if band in [1, 2, 3, 4, 5, 7]:
             raise ValueError('LT5 brightness must be band 6')
 
         rad = self.radiance(band)
-        brightness = self.k2 / (log((self.k1 / rad) + 1))
+        brightness = thermal.brightness_temp(rad, self.k1, self.k2)
 
         if temp_scale == 'K':
             return brightness
@@ -276,44 +914,26 @@ class Landsat5(LandsatImage):
         else:
             raise ValueError('{} is not a valid temperature scale'.format(temp_scale))
 
-    def reflectance(self, band):
+    @cached
+    def reflectance(self, band, out=None):
         """ 
         :param band: An optical band, i.e. 1-5, 7
+        :param out: float32 array of the image shape
         :return: At satellite reflectance, [-]
         """
         if band == 6:
             raise ValueError('LT5 reflectance must be other than  band 6')
 
-        rad = self.radiance(band)
+        toa_reflect = self._writable(self.radiance, (band,), out)
         esun = self.ex_atm_irrad[band - 1]
-        toa_reflect = (pi * rad * self.earth_sun_dist ** 2) / (esun * cos(self.solar_zenith_rad))
+        # (pi * rad * self.earth_sun_dist ** 2) / (esun * cos(self.solar_zenith_rad)), in place
+        toa_reflect *= pi
+        toa_reflect *= self.earth_sun_dist ** 2
+        toa_reflect /= esun * cos(self.solar_zenith_rad)
 
         return toa_reflect
 
-    def albedo(self, model='smith'):
-        """Finds broad-band surface reflectance (albedo)
-        
-        Smith (2010),  “The heat budget of the earth’s surface deduced from space”
-        LT5 toa reflectance bands 1, 3, 4, 5, 7
-        # normalized i.e. 0.356 + 0.130 + 0.373 + 0.085 + 0.07 = 1.014
-        
-        Should have option for Liang, 2000; 
-        
-        Tasumi (2008), "At-Surface Reflectance and Albedo from Satellite for
-                        Operational Calculation of Land Surface Energy Balance"
-                        
-        
-        :return albedo array of floats
-        """
-        if model == 'smith':
-            blue, red, nir, swir1, swir2 = (self.reflectance(1), self.reflectance(3), self.reflectance(4),
-                                            self.reflectance(5), self.reflectance(7))
-            alb = (0.356 * blue + 0.130 * red + 0.373 * nir + 0.085 * swir1 + 0.072 * swir2 - 0.0018) / 1.014
-        elif model == 'tasumi':
-            pass
-        # add tasumi algorithm TODO
-        return alb
-
+    @cached
     def saturation_mask(self, band, value=255):
         """ Mask saturated pixels, 1 (True) is saturated.
         :param band: Image band with dn values, type: array
@@ -326,75 +946,6 @@ class Landsat5(LandsatImage):
 
         return mask
 
-    def ndvi(self):
-        """ Normalized difference vegetation index.
-        :return: NDVI
-        """
-        red, nir = self.reflectance(3), self.reflectance(4)
-        ndvi = self._divide_zero((nir - red), (nir + red), nan)
-
-        return ndvi
-
-    def lai(self):
-        """
-        Leaf area index (LAI), or the surface area of leaves to surface area ground.
-        Trezza and Allen, 2014
-        :param ndvi: normalized difference vegetation index [-]
-        :return: LAI [-]
-        """
-        ndvi = self.ndvi()
-        lai = 7.0 * (ndvi ** 3)
-        lai = where(lai > 6., 6., lai)
-        return lai
-
-    def emissivity(self, approach='tasumi'):
-
-        ndvi = self.ndvi()
-
-        if approach == 'tasumi':
-            lai = self.lai()
-            # Tasumi et al., 2003
-            # narrow-band emissivity
-            nb_epsilon = where((ndvi > 0) & (lai <= 3), 0.97 + 0.0033 * lai, nan)
-            nb_epsilon = where((ndvi > 0) & (lai > 3), 0.98, nb_epsilon)
-            nb_epsilon = where(ndvi <= 0, 0.99, nb_epsilon)
-            return nb_epsilon
-
-        if approach == 'sobrino':
-            # Sobrino et el., 2004
-            red = self.reflectance(3)
-            bound_ndvi = where(ndvi > 0.5, ndvi, 0.99)
-            bound_ndvi = where(ndvi < 0.2, red, bound_ndvi)
-
-            pv = ((ndvi - 0.2) / (0.5 - 0.2)) ** 2
-            pv_emiss = 0.004 * pv + 0.986
-            emissivity = where((ndvi >= 0.2) & (ndvi <= 0.5), pv_emiss, bound_ndvi)
-
-            return emissivity
-
-    def land_surface_temp(self):
-        """
-        Mean values from Allen (2007)
-        :return: 
-        """
-        rp = 0.91
-        tau = 0.866
-        rsky = 1.32
-        epsilon = self.emissivity(approach='tasumi')
-        radiance = self.radiance(6)
-        rc = ((radiance - rp) / tau) - ((1 - epsilon) * rsky)
-        lst = self.k2 / (log((epsilon * self.k1 / rc) + 1))
-        return lst
-
-    def ndsi(self):
-        """ Normalized difference snow index.
-        :return: NDSI
-        """
-        green, swir1 = self.reflectance(2), self.reflectance(5)
-        ndsi = self._divide_zero((green - swir1), (green + swir1), nan)
-
-        return ndsi
-
 
 class Landsat7(LandsatImage):
     def __init__(self, obj):
@@ -408,17 +959,22 @@ class Landsat7(LandsatImage):
 
         self.k1, self.k2 = 666.09, 1282.71
 
-    def radiance(self, band):
+    @cached
+    def radiance(self, band, out=None):
         if band == 6:
             band = '6_vcid_1'
         qcal_min = getattr(self, 'quantize_cal_min_band_{}'.format(band))
         qcal_max = getattr(self, 'quantize_cal_max_band_{}'.format(band))
         l_min = getattr(self, 'radiance_minimum_band_{}'.format(band))
         l_max = getattr(self, 'radiance_maximum_band_{}'.format(band))
-        qcal = self._get_band('b{}'.format(band))
-        rad = ((l_max - l_min) / (qcal_max - qcal_min)) * (qcal - qcal_min) + l_min
+        rad = self._get_band('b{}'.format(band), out=out)
+        # ((l_max - l_min) / (qcal_max - qcal_min)) * (qcal - qcal_min) + l_min, in place
+        rad -= qcal_min
+        rad *= (l_max - l_min) / (qcal_max - qcal_min)
+        rad += l_min
         return rad
 
+    @cached
     def brightness_temp(self, band=6, gain='low', temp_scale='K'):
 
         if band in [1, 2, 3, 4, 5, 7, 8]:
@@ -431,7 +987,7 @@ class Landsat7(LandsatImage):
             band_gain = '6_vcid_2'
 
         rad = self.radiance(band_gain)
-        brightness = self.k2 / (log((self.k1 / rad) + 1))
+        brightness = thermal.brightness_temp(rad, self.k1, self.k2)
 
         if temp_scale == 'K':
             return brightness
@@ -445,36 +1001,25 @@ class Landsat7(LandsatImage):
         else:
             raise ValueError('{} is not a valid temperature scale'.format(temp_scale))
 
-    def reflectance(self, band):
+    @cached
+    def reflectance(self, band, out=None):
         """ 
         :param band: An optical band, i.e. 1-5, 7
+        :param out: float32 array of the image shape
         :return: At satellite reflectance, [-]
         """
         if band in ['b6_vcid_1', 'b6_vcid_2']:
             raise ValueError('LE7 reflectance must not be b6_vcid_1 or b6_vcid_2')
 
-        rad = self.radiance(band)
+        toa_reflect = self._writable(self.radiance, (band,), out)
         esun = self.ex_atm_irrad[band - 1]
-        toa_reflect = (pi * rad * self.earth_sun_dist ** 2) / (esun * cos(self.solar_zenith_rad))
+        # (pi * rad * self.earth_sun_dist ** 2) / (esun * cos(self.solar_zenith_rad)), in place
+        toa_reflect *= pi
+        toa_reflect *= self.earth_sun_dist ** 2
+        toa_reflect /= esun * cos(self.solar_zenith_rad)
         return toa_reflect
 
-    def albedo(self):
-        """Finds broad-band surface reflectance (albedo)
-        
-        Smith (2010),  “The heat budget of the earth’s surface deduced from space”
-        Should have option for Liang, 2000; 
-        
-        LE7 toa reflectance bands 1, 3, 4, 5, 7
-        
-        # normalized i.e. 0.356 + 0.130 + 0.373 + 0.085 + 0.07 = 1.014
-        :return albedo array of floats
-        """
-        blue, red, nir, swir1, swir2 = (self.reflectance(1), self.reflectance(3), self.reflectance(4),
-                                        self.reflectance(5), self.reflectance(7))
-        alb = (0.356 * blue + 0.130 * red + 0.373 * nir + 0.085 * swir1 + 0.072 * swir2 - 0.0018) / 1.014
-
-        return alb
-
+    @cached
     def saturation_mask(self, band, value=255):
         """ Mask saturated pixels, 1 (True) is saturated.
         :param band: Image band with dn values, type: array
@@ -486,70 +1031,6 @@ class Landsat7(LandsatImage):
 
         return mask
 
-    def ndvi(self):
-        """ Normalized difference vegetation index.
-        :return: NDVI
-        """
-        red, nir = self.reflectance(3), self.reflectance(4)
-        ndvi = self._divide_zero((nir - red), (nir + red), nan)
-
-        return ndvi
-
-    def lai(self):
-        """
-        Leaf area index (LAI), or the surface area of leaves to surface area ground.
-        Trezza and Allen, 2014
-        :param ndvi: normalized difference vegetation index [-]
-        :return: LAI [-]
-        """
-        ndvi = self.ndvi()
-        lai = 7.0 * (ndvi ** 3)
-        lai = where(lai > 6., 6., lai)
-        return lai
-
-    def emissivity(self, approach='tasumi'):
-
-        ndvi = self.ndvi()
-
-        if approach == 'tasumi':
-            lai = self.lai()
-            # Tasumi et al., 2003
-            # narrow-band emissivity
-            nb_epsilon = where((ndvi > 0) & (lai <= 3), 0.97 + 0.0033 * lai, nan)
-            nb_epsilon = where((ndvi > 0) & (lai > 3), 0.98, nb_epsilon)
-            nb_epsilon = where(ndvi <= 0, 0.99, nb_epsilon)
-            return nb_epsilon
-
-        if approach == 'sobrino':
-            # Sobrino et el., 2004
-            red = self.reflectance(3)
-            bound_ndvi = where(ndvi > 0.5, ndvi, 0.99)
-            bound_ndvi = where(ndvi < 0.2, red, bound_ndvi)
-
-            pv = ((ndvi - 0.2) / (0.5 - 0.2)) ** 2
-            pv_emiss = 0.004 * pv + 0.986
-            emissivity = where((ndvi >= 0.2) & (ndvi <= 0.5), pv_emiss, bound_ndvi)
-
-            return emissivity
-
-    def land_surface_temp(self):
-        rp = 0.91
-        tau = 0.866
-        rsky = 1.32
-        epsilon = self.emissivity()
-        rc = ((self.radiance(6) - rp) / tau) - ((1 - epsilon) * rsky)
-        lst = self.k2 / (log((epsilon * self.k1 / rc) + 1))
-        return lst
-
-    def ndsi(self):
-        """ Normalized difference snow index.
-        :return NDSI
-        """
-        green, swir1 = self.reflectance(2), self.reflectance(5)
-        ndsi = self._divide_zero((green - swir1), (green + swir1), nan)
-
-        return ndsi
-
 
 class Landsat8(LandsatImage):
     def __init__(self, obj):
@@ -557,6 +1038,7 @@ class Landsat8(LandsatImage):
 
         self.oli_bands = [1, 2, 3, 4, 5, 6, 7, 8, 9]
 
+    @cached
     def brightness_temp(self, band, temp_scale='K'):
         """Calculate brightness temperature of Landsat 8
     as outlined here: http://landsat.usgs.gov/Landsat8_Using_Product.php
@@ -590,10 +1072,9 @@ class Landsat8(LandsatImage):
         if band in self.oli_bands:
             raise ValueError('Landsat 8 brightness should be TIRS band (i.e. 10 or 11)')
 
-        k1 = getattr(self, 'k1_constant_band_{}'.format(band))
-        k2 = getattr(self, 'k2_constant_band_{}'.format(band))
+        k1, k2 = self.thermal_constants(band)
         rad = self.radiance(band)
-        brightness = k2 / log((k1 / rad) + 1)
+        brightness = thermal.brightness_temp(rad, k1, k2)
 
         if temp_scale == 'K':
             return brightness
@@ -607,7 +1088,8 @@ class Landsat8(LandsatImage):
         else:
             raise ValueError('{} is not a valid temperature scale'.format(temp_scale))
 
-    def reflectance(self, band):
+    @cached
+    def reflectance(self, band, out=None):
         """Calculate top of atmosphere reflectance of Landsat 8
         as outlined here: http://landsat.usgs.gov/Landsat8_Using_Product.php
     
@@ -642,7 +1124,6 @@ class Landsat8(LandsatImage):
             raise ValueError('Landsat 8 reflectance should OLI band (i.e. bands 1-8)')
 
         elev = getattr(self, 'sun_elevation')
-        dn = self._get_band('b{}'.format(band))
         mr = getattr(self, 'reflectance_mult_band_{}'.format(band))
         ar = getattr(self, 'reflectance_add_band_{}'.format(band))
 
@@ -650,11 +1131,16 @@ class Landsat8(LandsatImage):
             raise ValueError("Sun elevation must be non-negative "
                              "(sun must be above horizon for entire scene)")
 
-        rf = ((mr * dn.astype(float32)) + ar) / sin(deg2rad(elev))
+        # ((mr * dn) + ar) / sin(deg2rad(elev)), in place
+        rf = self._get_band('b{}'.format(band), out=out)
+        rf *= mr
+        rf += ar
+        rf /= sin(deg2rad(elev))
 
         return rf
 
-    def radiance(self, band):
+    @cached
+    def radiance(self, band, out=None):
         """Calculate top of atmosphere radiance of Landsat 8
         as outlined here: http://landsat.usgs.gov/Landsat8_Using_Product.php
     
@@ -676,95 +1162,107 @@ class Landsat8(LandsatImage):
     """
         ml = getattr(self, 'radiance_mult_band_{}'.format(band))
         al = getattr(self, 'radiance_add_band_{}'.format(band))
-        dn = self._get_band('b{}'.format(band))
-        rad = ml * dn.astype(float32) + al
+        # ml * dn + al, in place
+        rad = self._get_band('b{}'.format(band), out=out)
+        rad *= ml
+        rad += al
 
         return rad
 
-    def albedo(self):
-        """Smith (2010), finds broad-band surface reflectance (albedo)
-        Should have option for Liang, 2000; Tasumi, 2008;
-        
-        LC8 toa reflectance bands 2, 4, 5, 6, 7
-        
-        # normalized i.e. 0.356 + 0.130 + 0.373 + 0.085 + 0.07 = 1.014
-        :return albedo array of floats
+    def thermal_constants(self, band):
+        """ Thermal conversion constants K1, K2 of TIRS band 10 or 11, from the metadata. """
+        return (getattr(self, 'k1_constant_band_{}'.format(band)),
+                getattr(self, 'k2_constant_band_{}'.format(band)))
+
+    @cached
+    def split_window_lst(self, water_vapor=2.0):
+        """ Split-window land surface temperature from TIRS bands 10 and 11.
+        Jimenez-Munoz et al. (2014), see thermal.split_window_lst
+        :param water_vapor: total column water vapor, g / cm2
+        :return: LST, K
         """
+        return thermal.split_window_lst(self.brightness_temp(10), self.brightness_temp(11), self.ndvi(),
+                                        water_vapor)
 
-        blue, red, nir, swir1, swir2 = (self.reflectance(2), self.reflectance(4), self.reflectance(5),
-                                        self.reflectance(6), self.reflectance(7))
-        alb = (0.356 * blue + 0.130 * red + 0.373 * nir + 0.085 * swir1 + 0.072 * swir2 - 0.0018) / 1.014
-
-        return alb
-
-    def ndvi(self):
-        """ Normalized difference vegetation index.
-        :return: NDVI
+    def quality(self):
+        """ Raw 16-bit quality assessment band (BQA).
+        :return: uint16 array
         """
-        red, nir = self.reflectance(4), self.reflectance(5)
-        ndvi = self._divide_zero((nir - red), (nir + red), nan)
-
-        return ndvi
-
-    def lai(self):
+        try:
+            return self._read('bqa')
+        except KeyError:
+            raise ValueError('No BQA.TIF found in {}'.format(self.obj))
+
+    def qa_flags(self, fields=None):
+        """ Decode the BQA band into its bit fields.
+
+        Each field is decoded with a single gather through a 65536-entry look-up
+        table, see QA_BITS for the fields and their bits.
+        :param fields: iterable of QA_BITS keys, default all
+        :return: dict of uint8 arrays; one-bit fields are 0/1, confidence fields 0-3
         """
-        Leaf area index (LAI), or the surface area of leaves to surface area ground.
-        Trezza and Allen, 2014
-        :param ndvi: normalized difference vegetation index [-]
-        :return: LAI [-]
+        qa = self.quality()
+        if fields is None:
+            fields = sorted(QA_BITS)
+        return dict((field, qa_lut(field)[qa]) for field in fields)
+
+    def qa_cloud_mask(self, confidence='high', combined=False, cloud_and_shadow=False):
+        """ Cloud and cloud shadow from the USGS quality band; a cheap alternative to Fmask.
+
+        Return values follow Fmask.cloud_mask. Cloud is the cloud bit, or cloud or cirrus at or
+        above the confidence level, shadow is cloud shadow at or above the confidence level.
+        Low cloud confidence is set on nearly every clear pixel, so cloud confidence counts
+        from medium. The Collection 1 BQA has no water flag, so the water layer is all False.
+        :param confidence: 'low', 'medium' or 'high'
+        :param combined: return one boolean array of cloud | shadow | water
+        :param cloud_and_shadow: return one boolean array of cloud | shadow
+        :return: cloud, shadow, water boolean arrays
         """
-        ndvi = self.ndvi()
-        lai = 7.0 * (ndvi ** 3)
-        lai = where(lai > 6., 6., lai)
-        return lai
+        level = QA_CONFIDENCE[confidence]
+        codes = arange(2 ** 16)
+        valid = (qa_lut('fill') == 0) & (codes > 0)
+        cloud_lut = valid & ((qa_lut('cloud') == 1) |
+                             (qa_lut('cloud_confidence') >= max(level, QA_CONFIDENCE['medium'])) |
+                             (qa_lut('cirrus_confidence') >= level))
+        shadow_lut = valid & (qa_lut('shadow_confidence') >= level)
 
-    def emissivity(self, approach='tasumi'):
+        qa = self.quality()
+        cloud, shadow = cloud_lut[qa], shadow_lut[qa]
+        water = zeros(qa.shape, dtype=bool)
 
-        ndvi = self.ndvi()
+        if combined:
+            return cloud | shadow | water
+
+        if cloud_and_shadow:
+            return cloud | shadow
+
+        return cloud, shadow, water
 
-        if approach == 'tasumi':
-            lai = self.lai()
-            # Tasumi et al., 2003
-            # narrow-band emissivity
-            nb_epsilon = where((ndvi > 0) & (lai <= 3), 0.97 + 0.0033 * lai, nan)
-            nb_epsilon = where((ndvi > 0) & (lai > 3), 0.98, nb_epsilon)
-            nb_epsilon = where(ndvi <= 0, 0.99, nb_epsilon)
-            return nb_epsilon
-
-        if approach == 'sobrino':
-            # Sobrino et el., 2004
-            red = self.reflectance(3)
-            bound_ndvi = where(ndvi > 0.5, ndvi, 0.99)
-            bound_ndvi = where(ndvi < 0.2, red, bound_ndvi)
-
-            pv = ((ndvi - 0.2) / (0.5 - 0.2)) ** 2
-            pv_emiss = 0.004 * pv + 0.986
-            emissivity = where((ndvi >= 0.2) & (ndvi <= 0.5), pv_emiss, bound_ndvi)
-
-            return emissivity
-
-    def land_surface_temp(self):
-
-        band = 10
-
-        k1 = getattr(self, 'k1_constant_band_{}'.format(band))
-        k2 = getattr(self, 'k2_constant_band_{}'.format(band))
-
-        rp = 0.91
-        tau = 0.866
-        rsky = 1.32
-        epsilon = self.emissivity()
-        rc = ((self.radiance(band) - rp) / tau) - ((1 - epsilon) * rsky)
-        lst = k2 / (log((epsilon * k1 / rc) + 1))
-        return lst
-
-    def ndsi(self):
-        """ Normalized difference snow index.
-        :return: NDSI
-        """
-        green, swir1 = self.reflectance(3), self.reflectance(6)
-        ndsi = self._divide_zero((green - swir1), (green + swir1), nan)
 
-        return ndsi
+def sample_scenes(images, points, products=('ndvi',), ids=None, crs=None, block_size=512):
+    """ Values of products at points in many scenes, see LandsatImage.sample_points.
+    :param images: iterable of LandsatImage objects, or of scene directories
+    :param crs: CRS of the points, default the CRS of each scene
+    :return: list of dicts with point, scene, product, value, row and col
+    """
+    records = []
+    for image in images:
+        if isinstance(image, str):
+            image = open_image(image)
+        records.extend(image.sample_points(points, products, ids, crs, block_size))
+    return records
+
+
+def open_image(obj):
+    """ Open a scene directory as the LandsatImage subclass of its sensor.
+    :param obj: Directory containing an unzipped Landsat 5, 7, or 8 image
+    :return: Landsat5, Landsat7 or Landsat8 object
+    """
+    scene_id = scene_attributes(obj)['landsat_scene_id']
+    mapping = {'LT5': Landsat5, 'LE7': Landsat7, 'LC8': Landsat8}
+    try:
+        return mapping[scene_id[:3]](obj)
+    except KeyError:
+        raise ValueError('Must provide satellite sat_image from LT5, LE7, LC8, not {}'.format(scene_id))
 
 # =============================================================================================
@@ -0,0 +1,87 @@
+# =============================================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================================
+
+import os
+
+import numpy as np
+from rasterio.windows import Window
+
+# index, a LandsatImage method: spectral roles it reads, see BandMap.roles
+INDICES = {'ndvi': ['red', 'nir'],
+           'ndsi': ['green', 'swir1'],
+           'ndwi': ['green', 'nir'],
+           'nbr': ['nir', 'swir2'],
+           'savi': ['red', 'nir'],
+           'evi': ['blue', 'red', 'nir'],
+           'albedo': ['blue', 'red', 'nir', 'swir1', 'swir2'],
+           'lai': ['red', 'nir']}
+
+
+def index_bands(image, indices):
+    """ Bands read by a set of indices on the sensor of an image.
+    :param image: LandsatImage object
+    :param indices: iterable of INDICES keys
+    :return: sorted list of band names, e.g. ['b3', 'b4']
+    """
+    roles = set(role for index in indices for role in INDICES[index])
+    return sorted('b{}'.format(image.role_band(role)) for role in roles)
+
+
+def spectral_indices(image, indices=('ndvi',), block_size=512, prefetch=0):
+    """ Several spectral indices of an image in one pass.
+
+    The image is processed block by block; within a block each band is read and converted
+    to reflectance once, and every index computed from it while the block is in memory,
+    so the temporaries are block-sized and intermediates such as NDVI for LAI are shared.
+    Band numbers come from the sensor's spectral roles, so any Landsat image works.
+    :param image: LandsatImage object
+    :param indices: iterable of INDICES keys
+    :param block_size: block width and height in pixels, None for the whole image at once
+    :param prefetch: read this many blocks ahead on background threads, see prefetch.PrefetchReader
+    :return: dict of float32 arrays
+    """
+    indices = list(indices)
+    for index in indices:
+        if index not in INDICES:
+            raise ValueError('{} is not a valid index, choose from {}'.format(index, sorted(INDICES)))
+
+    height, width = image.rasterio_geometry['height'], image.rasterio_geometry['width']
+    results = dict((index, np.empty((height, width), dtype=np.float32)) for index in indices)
+
+    # a decimated image is read whole, it cannot be windowed
+    if not block_size or image._out_shape is not None:
+        blocks = [(Window(0, 0, width, height), image)]
+    elif prefetch:
+        from sat_image.prefetch import PrefetchReader
+        blocks = PrefetchReader(image, block_size, bands=index_bands(image, indices), depth=prefetch)
+    else:
+        blocks = ((window, image.windowed(window)) for window in
+                  (Window(col, row, min(block_size, width - col), min(block_size, height - row))
+                   for row in range(0, height, block_size) for col in range(0, width, block_size)))
+
+    for window, view in blocks:
+        rows, cols = window.toslices()
+        with view.caching():
+            for index in indices:
+                results[index][rows, cols] = getattr(view, index)()
+
+    return results
+
+
+if __name__ == '__main__':
+    home = os.path.expanduser('~')
+
+# ========================= EOF ================================================================
@@ -0,0 +1,156 @@
+# =============================================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================================
+
+from __future__ import division
+
+import os
+import json
+import shutil
+from tempfile import mkdtemp
+
+import numpy as np
+from rasterio import open as rasopen
+from rasterio.enums import Resampling
+from rasterio.transform import array_bounds
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import transform_bounds
+from rasterio.windows import Window, from_bounds
+
+from sat_image.composite import select, write_clear_mask
+from sat_image.fmask import triage
+from sat_image.pipeline import get_product
+from sat_image.warped_vrt import BLOCK_SIZE
+
+RULES = ['recent', 'least_cloudy', 'max_ndvi']
+
+
+def mosaic(images, outfile, target, product='ndvi', rule='recent', source=None,
+           layers='cloud_and_shadow', tile_size=512, triage_factor=8, **kwargs):
+    """ Mosaic a product of scenes from any number of path/rows onto one grid.
+
+    Every scene is read through LandsatImage.align, window by window of the target grid,
+    and only scenes whose footprint overlaps a window are read for it, so no scene is
+    ever held in memory whole. Where scenes overlap, the pixel comes from the valid scene
+    ranked first by rule.
+    :param images: iterable of LandsatImage objects
+    :param outfile: output GeoTIFF, band 1 the product and band 2 the 1-based index of the
+    scene each pixel comes from, 0 for none; scene ids are in the 'scenes' tag
+    :param target: LandsatImage or profile dict with crs, transform, height and width
+    :param product: pipeline.get_product name
+    :param rule: 'recent' (latest date_acquired), 'least_cloudy' (lowest cloud and shadow
+    fraction from fmask.triage) or 'max_ndvi' (highest NDVI of the pixel)
+    :param source: if given, also exclude cloudy pixels, see pipeline.cloud_mask; masks are
+    computed one scene at a time on the scene's own grid
+    :param layers: mask layers, see pipeline.cloud_mask
+    :param tile_size: window width and height in pixels
+    :param triage_factor: decimation factor of the 'least_cloudy' triage
+    :param kwargs: passed to pipeline.cloud_mask
+    :return: outfile
+    """
+    if rule not in RULES:
+        raise ValueError('{} is not a valid rule, choose from {}'.format(rule, RULES))
+
+    images = list(images)
+    profile = getattr(target, 'rasterio_geometry', target)
+    grid = dict((k, profile[k]) for k in ['crs', 'transform', 'height', 'width'])
+    height, width = grid['height'], grid['width']
+
+    aligned = [image.align(grid) for image in images]
+    footprints = [_footprint(image, grid) for image in images]
+    if rule == 'recent':
+        priority = np.array([image.date_acquired.toordinal() for image in images], dtype=float)
+    elif rule == 'least_cloudy':
+        fractions = [triage(image, triage_factor) for image in images]
+        priority = -np.array([f['cloud'] + f['shadow'] for f in fractions])
+
+    meta = {'driver': 'GTiff', 'dtype': 'float32', 'nodata': np.nan, 'count': 2,
+            'crs': grid['crs'], 'transform': grid['transform'], 'height': height, 'width': width,
+            'tiled': True, 'blockxsize': BLOCK_SIZE, 'blockysize': BLOCK_SIZE,
+            'compress': 'deflate', 'predictor': 3}
+
+    temp = mkdtemp(prefix='mosaic_')
+    try:
+        masks = None
+        if source:
+            masks = [write_clear_mask(image, temp, source, layers, 1, **kwargs) for image in images]
+
+        with rasopen(outfile, 'w', **meta) as dst:
+            dst.set_band_description(1, product)
+            dst.set_band_description(2, 'scene')
+            dst.update_tags(scenes=json.dumps([image.landsat_scene_id for image in images]))
+
+            for row in range(0, height, tile_size):
+                for col in range(0, width, tile_size):
+                    window = Window(col, row, min(tile_size, width - col), min(tile_size, height - row))
+                    hits = [i for i, fp in enumerate(footprints) if _overlaps(fp, window)]
+                    out = np.full((2, int(window.height), int(window.width)), np.nan, dtype=np.float32)
+                    out[1] = 0
+
+                    if hits:
+                        data, clear, ndvi = [], [], []
+                        for i in hits:
+                            view = aligned[i].windowed(window)
+                            with view.caching():
+                                data.append(get_product(view, product))
+                                valid = view.mask() > 0
+                                if rule == 'max_ndvi':
+                                    ndvi.append(view.ndvi())
+                            if masks:
+                                valid &= _read_mask(masks[i], grid, window)
+                            clear.append(valid)
+
+                        if rule == 'max_ndvi':
+                            ndvi = np.stack(ndvi)
+                            score = np.where(np.isnan(ndvi), -np.finfo(float).max, ndvi)
+                        else:
+                            score = priority[hits][:, np.newaxis, np.newaxis]
+                        values, best = select(np.stack(data)[np.newaxis], np.stack(clear), score)
+                        out[0] = values[0]
+                        out[1] = np.where(best >= 0, np.array(hits)[best] + 1, 0)
+
+                    dst.write(out, window=window)
+    finally:
+        shutil.rmtree(temp)
+
+    return outfile
+
+
+def _footprint(image, grid):
+    """ Window of the target grid covering the bounds of the image. """
+    geo = image.rasterio_geometry
+    bounds = array_bounds(geo['height'], geo['width'], geo['transform'])
+    bounds = transform_bounds(geo['crs'], grid['crs'], *bounds)
+    return from_bounds(*bounds, transform=grid['transform'])
+
+
+def _overlaps(footprint, window):
+    return (footprint.col_off < window.col_off + window.width and
+            window.col_off < footprint.col_off + footprint.width and
+            footprint.row_off < window.row_off + window.height and
+            window.row_off < footprint.row_off + footprint.height)
+
+
+def _read_mask(path, grid, window):
+    """ Window of a clear mask on the scene's own grid, read onto the target grid. """
+    with rasopen(path, 'r') as src:
+        with WarpedVRT(src, resampling=Resampling.nearest, **grid) as vrt:
+            return vrt.read(1, window=window).astype(bool)
+
+
+if __name__ == '__main__':
+    home = os.path.expanduser('~')
+
+# ========================= EOF ================================================================
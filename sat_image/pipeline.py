@@ -0,0 +1,210 @@
+# =============================================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================================
+
+from __future__ import print_function
+
+import os
+
+from numpy import where, nan
+from rasterio import open as rasopen
+from rasterio.windows import Window
+
+from sat_image.fmask import Fmask
+from sat_image.writer import (SCALING, AsyncWriter, cog_overviews, downcast, downcast_nodata,
+                              finish, geotiff_meta, staged)
+
+# product name: LandsatImage method
+PRODUCTS = {'ndvi': 'ndvi',
+            'ndsi': 'ndsi',
+            'ndwi': 'ndwi',
+            'nbr': 'nbr',
+            'savi': 'savi',
+            'evi': 'evi',
+            'lai': 'lai',
+            'albedo': 'albedo',
+            'emissivity': 'emissivity',
+            'lst': 'land_surface_temp'}
+
+# products computed outside LandsatImage, as uint8 class codes
+CLASS_PRODUCTS = ['fmask']
+
+
+def compute_products(image, products):
+    """ Compute several products of one image, reading and converting each band once.
+    :param image: LandsatImage object
+    :param products: iterable of PRODUCTS keys
+    :return: dict of product arrays
+    """
+    with image.caching():
+        return dict((product, get_product(image, product)) for product in products)
+
+
+def cloud_mask(image, source='fmask', layers='cloud_and_shadow', workers=1, **kwargs):
+    """ Boolean mask of pixels to exclude, True is masked.
+    :param image: LandsatImage object
+    :param source: 'fmask', or 'qa' to decode the Landsat 8 quality band
+    :param layers: 'cloud_and_shadow' or 'combined' (cloud, shadow and water)
+    :param workers: Fmask worker processes
+    :param kwargs: passed to Fmask.cloud_mask or Landsat8.qa_cloud_mask
+    :return: boolean array
+    """
+    if layers not in ['cloud_and_shadow', 'combined']:
+        raise ValueError('{} is not a valid mask, use cloud_and_shadow or combined'.format(layers))
+    kwargs[layers] = True
+
+    if source == 'fmask':
+        return Fmask(image, workers=workers).cloud_mask(**kwargs)
+    elif source == 'qa':
+        if not hasattr(image, 'qa_cloud_mask'):
+            raise ValueError('{} has no quality band, use the fmask mask source'.format(image.satellite))
+        return image.qa_cloud_mask(**kwargs)
+    else:
+        raise ValueError('{} is not a valid mask source, use fmask or qa'.format(source))
+
+
+def masked_products(image, products=('ndvi',), outdir=None, source='fmask',
+                    layers='cloud_and_shadow', workers=1, writer=None, **kwargs):
+    """ Cloud-masked products sharing band reads between Fmask and the products.
+
+    Every band is read and converted once; the reflectance, brightness temperature
+    and indices Fmask computes are reused by the products.
+    :param image: LandsatImage object
+    :param products: iterable of PRODUCTS keys
+    :param outdir: if given, write each product to <outdir>/<scene id>_<product>.tif
+    :param source: mask source, see cloud_mask
+    :param layers: mask layers, see cloud_mask
+    :param workers: Fmask worker processes
+    :param writer: writer.AsyncWriter, write the products in the background
+    :return: dict of masked product arrays, nan where masked
+    """
+    with image.caching():
+        mask = cloud_mask(image, source=source, layers=layers, workers=workers, **kwargs)
+        results = {}
+        for product in products:
+            arr = where(mask, nan, get_product(image, product))
+            if outdir:
+                image.save_array(arr, os.path.join(outdir, '{}_{}.tif'.format(image.landsat_scene_id,
+                                                                             product)), writer=writer)
+            results[product] = arr
+
+    return results
+
+
+def export_products(image, outfile, products=('ndvi', 'lai', 'albedo', 'emissivity', 'lst'),
+                    scaled=False, block_size=512, overviews=None, cog=False, background=False,
+                    prefetch=0, **kwargs):
+    """ Write several products as the bands of one GeoTIFF, computed block by block.
+
+    Each block of the image is read once and every product computed from the same cached
+    bands and intermediates, then written to its band; only one block of every product is
+    held in memory.
+    :param image: LandsatImage object
+    :param outfile: output GeoTIFF, band i is products[i - 1], named in the band descriptions
+    :param products: iterable of PRODUCTS keys
+    :param scaled: store products as int16 with the scale and offset of writer.SCALING,
+    else float32; scale and offset are written to the file either way
+    :param block_size: block width and height in pixels, a multiple of the tile size
+    :param overviews: iterable of overview decimation factors
+    :param cog: Cloud-Optimized GeoTIFF layout
+    :param background: encode and write each block in a background thread while the next
+    block is computed
+    :param prefetch: read this many blocks ahead on background threads, see prefetch.PrefetchReader
+    :param kwargs: passed to writer.geotiff_meta, e.g. compress
+    :return: outfile
+    """
+    products = list(products)
+    for product in products:
+        if product not in PRODUCTS:
+            raise ValueError('{} cannot be computed block by block, choose from {}'.format(
+                product, sorted(PRODUCTS)))
+
+    geometry = image.rasterio_geometry
+    height, width = geometry['height'], geometry['width']
+    if scaled:
+        dtype = 'int16'
+        nodata = downcast_nodata(dtype)
+        scales, offsets = [SCALING[p][1] for p in products], [SCALING[p][2] for p in products]
+    else:
+        dtype, nodata = 'float32', nan
+        scales, offsets = [1.] * len(products), [0.] * len(products)
+    meta = geotiff_meta(geometry, len(products), dtype, nodata, tiled=True, **kwargs)
+
+    def convert(arr, band):
+        if scaled:
+            arr = downcast(arr, dtype, scales[band - 1], offsets[band - 1], nodata)
+        return arr.astype(dtype, copy=False)
+
+    with staged(outfile, meta, cog) as path:
+        with rasopen(path, 'w', **meta) as dst:
+            if background:
+                # closing the writer waits for every block, before the overviews are built
+                with AsyncWriter(max_pending=2 * len(products)) as writer:
+                    _write_blocks(image, dst, products, block_size, convert, writer.submit, prefetch)
+            else:
+                _write_blocks(image, dst, products, block_size, convert, prefetch=prefetch)
+            finish(dst, scales, offsets, products,
+                   overviews or (cog_overviews((len(products), height, width), meta['blockxsize'])
+                                 if cog else None))
+
+    return outfile
+
+
+def _write_blocks(image, dst, products, block_size, convert, submit=None, prefetch=0):
+    """ Compute products window by window and write each to its band of dst.
+    :param convert: called as convert(arr, band), returns the array to write
+    :param submit: called as submit(dst.write, arr, band, window=window) to hand the write
+    to a writer, default write at once
+    :param prefetch: windows read ahead, 0 to read each window when it is computed
+    """
+    if prefetch:
+        from sat_image.prefetch import PrefetchReader
+        blocks = PrefetchReader(image, block_size, products=products, depth=prefetch)
+    else:
+        height, width = image.rasterio_geometry['height'], image.rasterio_geometry['width']
+        blocks = ((window, image.windowed(window)) for window in
+                  (Window(col, row, min(block_size, width - col), min(block_size, height - row))
+                   for row in range(0, height, block_size) for col in range(0, width, block_size)))
+
+    for window, view in blocks:
+        arrays = compute_products(view, products)
+        for band, product in enumerate(products, start=1):
+            arr = convert(arrays[product], band)
+            if submit:
+                submit(dst.write, arr, band, window=window)
+            else:
+                dst.write(arr, band, window=window)
+
+
+def get_product(image, product):
+    """ One product of an image.
+    :param image: LandsatImage object
+    :param product: PRODUCTS key, or 'fmask' for the Fmask class layer, see Fmask.classify
+    :return: array
+    """
+    if product == 'fmask':
+        return Fmask(image).classify()
+    try:
+        method = PRODUCTS[product]
+    except KeyError:
+        raise ValueError('{} is not a valid product, choose from {}'.format(
+            product, sorted(PRODUCTS) + CLASS_PRODUCTS))
+    return getattr(image, method)()
+
+
+if __name__ == '__main__':
+    home = os.path.expanduser('~')
+
+# ========================= EOF ================================================================
@@ -0,0 +1,168 @@
+# =============================================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================================
+
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+
+import numpy as np
+from rasterio import open as rasopen
+from rasterio.vrt import WarpedVRT
+from rasterio.windows import Window
+
+from sat_image.pipeline import compute_products
+
+
+class PrefetchReader(object):
+    ''' Block by block iteration over an image, reading ahead on background threads.
+
+    A producer thread reads the bands of upcoming windows into a ring of depth + 1 reusable
+    buffers, one read thread per band, while the consumer computes on the current window,
+    so reading and computing overlap. Each window is yielded as a windowed view of the image
+    whose band reads are already cached; its products are computed without touching disk.
+    Band arrays of a view live in the ring and are overwritten once the next window is
+    requested; products computed from them are new arrays and can be kept.
+
+    e.g.
+    for window, view in image.prefetch(products=('ndvi', 'lst')):
+        ndvi, lst = view.ndvi(), view.land_surface_temp()
+    '''
+
+    def __init__(self, image, block_size=512, bands=None, products=None, depth=2, workers=None):
+        '''
+        :param image: LandsatImage object, full resolution, optionally windowed or aligned
+        :param block_size: window width and height in pixels
+        :param bands: band names to read, e.g. ['b3', 'b4']; default the bands products read
+        :param products: pipeline.PRODUCTS keys used to find the bands, default every band
+        :param depth: number of windows read ahead of the current one
+        :param workers: read threads, default one per band
+        '''
+        if image._out_shape is not None:
+            raise ValueError('Prefetch from a full resolution image, not a decimated one')
+        self.image = image
+        self.block_size = block_size
+        if bands is None:
+            bands = band_reads(image, products) if products else image.band_list
+        self.bands = list(bands)
+        self.depth = depth
+        self.workers = workers or len(self.bands)
+        with ExitStack() as stack:
+            self.dtypes = dict((band, src.dtypes[0]) for band, src in self._open(stack).items())
+
+        height, width = image.rasterio_geometry['height'], image.rasterio_geometry['width']
+        self.windows = [Window(col, row, min(block_size, width - col), min(block_size, height - row))
+                        for row in range(0, height, block_size) for col in range(0, width, block_size)]
+
+    def __len__(self):
+        return len(self.windows)
+
+    def __iter__(self):
+        free, ready = queue.Queue(), queue.Queue()
+        for _ in range(self.depth + 1):
+            free.put(self._allocate())
+        stop = threading.Event()
+        producer = threading.Thread(target=self._produce, args=(free, ready, stop))
+        producer.daemon = True
+        producer.start()
+
+        try:
+            for _ in self.windows:
+                item = ready.get()
+                if isinstance(item, BaseException):
+                    raise item
+                window, slot, arrays = item
+                view = self.image.windowed(window)
+                view._cache = dict((('_read', (band,), ()), arr) for band, arr in arrays.items())
+                yield window, view
+                free.put(slot)
+        finally:
+            stop.set()
+            producer.join()
+
+    def _allocate(self):
+        """ One ring slot, a flat buffer of a full block for each band. """
+        size = self.block_size * self.block_size
+        return dict((band, np.empty(size, dtype=self.dtypes[band])) for band in self.bands)
+
+    def _open(self, stack):
+        datasets = {}
+        for band in self.bands:
+            src = stack.enter_context(rasopen(self.image.tif_dict[band]))
+            if self.image._vrt_options:
+                src = stack.enter_context(WarpedVRT(src, **self.image._vrt_options))
+            datasets[band] = src
+        return datasets
+
+    def _produce(self, free, ready, stop):
+        try:
+            with ExitStack() as stack:
+                datasets = self._open(stack)
+                pool = stack.enter_context(ThreadPoolExecutor(max_workers=self.workers))
+                for window in self.windows:
+                    slot = None
+                    while slot is None:
+                        if stop.is_set():
+                            return
+                        try:
+                            slot = free.get(timeout=0.05)
+                        except queue.Empty:
+                            pass
+
+                    # every band is read by one thread at a time, so datasets are not shared
+                    source = self._source_window(window)
+                    futures = dict((band, pool.submit(_read_into, datasets[band], source, slot[band]))
+                                   for band in self.bands)
+                    ready.put((window, slot, dict((band, f.result()) for band, f in futures.items())))
+        except BaseException as e:
+            ready.put(e)
+
+    def _source_window(self, window):
+        base = self.image._window
+        if base is None:
+            return window
+        return Window(base.col_off + window.col_off, base.row_off + window.row_off,
+                      window.width, window.height)
+
+
+def band_reads(image, products):
+    """ Bands read by the products of an image, found by computing them on a small window.
+    :param image: LandsatImage object
+    :param products: iterable of pipeline.PRODUCTS keys
+    :return: list of band names
+    """
+    height, width = image.rasterio_geometry['height'], image.rasterio_geometry['width']
+    view = image.windowed(Window(0, 0, min(16, width), min(16, height)))
+    view._cache = {}
+    compute_products(view, products)
+    return sorted(set(key[1][0] for key in view._cache if key[0] == '_read'))
+
+
+def _read_into(src, window, buf):
+    """ Read a window of band 1 into the head of a flat buffer.
+    :return: read-only array of the window's shape, a view on buf
+    """
+    out = buf[:int(window.height) * int(window.width)].reshape(int(window.height), int(window.width))
+    src.read(1, window=window, out=out)
+    out.flags.writeable = False
+    return out
+
+
+if __name__ == '__main__':
+    home = os.path.expanduser('~')
+
+# ========================= EOF ================================================================
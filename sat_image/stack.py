@@ -0,0 +1,90 @@
+# =============================================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================================
+
+import os
+
+from numpy import stack
+from rasterio.windows import Window
+
+from sat_image.image import open_image
+from sat_image.pipeline import get_product
+
+
+class SceneStack(object):
+    ''' Time-ordered scenes read onto one grid without rewriting any files.
+
+    Every scene is aligned with LandsatImage.align, so bands are warped on the fly
+    and only the windows that are read are warped.
+    '''
+
+    def __init__(self, images, target=None, registry=None):
+        '''
+        :param images: iterable of LandsatImage objects
+        :param target: LandsatImage or profile dict of the grid; default the first scene's grid
+        :param registry: GridRegistry, if given and no target, use the grid registered for the
+        first scene's path/row
+        '''
+        images = sorted(images, key=lambda x: x.date_acquired)
+        if not images:
+            raise ValueError('SceneStack needs at least one image')
+
+        if target is None and registry is not None:
+            target = registry.grid_for(images[0])
+        elif target is None:
+            target = images[0]
+        self.images = [image.align(target) for image in images]
+        self.profile = self.images[0].rasterio_geometry
+        self.height, self.width = self.profile['height'], self.profile['width']
+        self.dates = [image.date_acquired for image in self.images]
+
+    @classmethod
+    def from_directory(cls, directory, target=None, registry=None):
+        """ Stack of every scene sub-directory of directory.
+        :param directory: directory containing unzipped Landsat scene directories
+        :param target: see SceneStack
+        :param registry: see SceneStack
+        :return: SceneStack
+        """
+        scenes = [os.path.join(directory, x) for x in sorted(os.listdir(directory))
+                  if x[:3] in ['LT5', 'LE7', 'LC8'] and os.path.isdir(os.path.join(directory, x))]
+        return cls([open_image(scene) for scene in scenes], target, registry)
+
+    def windows(self, size=512):
+        """ Iterate over the stack's grid in square windows.
+        :param size: window width and height in pixels
+        :return: generator of rasterio Windows
+        """
+        for row in range(0, self.height, size):
+            for col in range(0, self.width, size):
+                yield Window(col, row, min(size, self.width - col), min(size, self.height - row))
+
+    def read(self, product='ndvi', window=None):
+        """ Product of every scene on the stack's grid.
+        :param product: pipeline.PRODUCTS key
+        :param window: rasterio Window, default the whole grid
+        :return: array of shape (scenes, rows, cols)
+        """
+        images = self.images if window is None else [image.windowed(window) for image in self.images]
+        return stack([get_product(image, product) for image in images])
+
+    def __len__(self):
+        return len(self.images)
+
+
+if __name__ == '__main__':
+    home = os.path.expanduser('~')
+
+# ========================= EOF ================================================================
@@ -0,0 +1,390 @@
+# =============================================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================================
+
+from __future__ import division
+
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+from rasterio import open as rasopen
+from rasterio.crs import CRS
+from rasterio.transform import from_origin
+from rasterio.warp import transform as transform_coords
+from rasterio.windows import Window
+
+from sat_image.grid import scene_attributes
+from sat_image.image import LandsatImage
+
+# sensor: scene and band layout of a Level-1 product; calibration is (lmin, lmax) radiance of
+# the quantized range for TM and ETM+, (mult, add) radiance rescaling for OLI and TIRS, and
+# esun and (k1, k2) are the constants of image.Landsat5 and image.Landsat7
+SENSORS = {'LT5': {'spacecraft': 'LANDSAT_5', 'sensor': 'TM', 'station': 'PAC',
+                   'shape': (7171, 7841), 'date': '1997-06-02', 'dtype': 'uint8', 'qcal': (1, 255),
+                   'bands': [('1', 'blue'), ('2', 'green'), ('3', 'red'), ('4', 'nir'),
+                             ('5', 'swir1'), ('6', 'thermal'), ('7', 'swir2')],
+                   'calibration': {'1': (-1.52, 193.), '2': (-2.84, 365.), '3': (-1.17, 264.),
+                                   '4': (-1.51, 221.), '5': (-0.37, 30.2), '6': (1.238, 15.303),
+                                   '7': (-0.15, 16.5)},
+                   'esun': {'1': 1958., '2': 1827., '3': 1551., '4': 1036., '5': 214.9, '7': 80.65},
+                   'thermal': {'6': (607.76, 1260.56)}},
+           'LE7': {'spacecraft': 'LANDSAT_7', 'sensor': 'ETM', 'station': 'EDC',
+                   'shape': (7121, 8001), 'date': '2002-05-15', 'dtype': 'uint8', 'qcal': (1, 255),
+                   'bands': [('1', 'blue'), ('2', 'green'), ('3', 'red'), ('4', 'nir'),
+                             ('5', 'swir1'), ('6_VCID_1', 'thermal'), ('6_VCID_2', 'thermal'),
+                             ('7', 'swir2'), ('8', 'pan')],
+                   'calibration': {'1': (-6.2, 191.6), '2': (-6.4, 196.5), '3': (-5., 152.9),
+                                   '4': (-5.1, 241.1), '5': (-1., 31.06), '6_VCID_1': (0., 17.04),
+                                   '6_VCID_2': (3.2, 12.65), '7': (-0.35, 10.8), '8': (-4.7, 243.1)},
+                   'esun': {'1': 1970., '2': 1842., '3': 1547., '4': 1044., '5': 255.7, '7': 82.06,
+                            '8': 1369.},
+                   'thermal': {'6_VCID_1': (666.09, 1282.71), '6_VCID_2': (666.09, 1282.71)}},
+           'LC8': {'spacecraft': 'LANDSAT_8', 'sensor': 'OLI_TIRS', 'station': 'LGN',
+                   'shape': (7781, 7671), 'date': '2015-06-04', 'dtype': 'uint16', 'qcal': (1, 65535),
+                   'bands': [('1', 'coastal'), ('2', 'blue'), ('3', 'green'), ('4', 'red'),
+                             ('5', 'nir'), ('6', 'swir1'), ('7', 'swir2'), ('8', 'pan'),
+                             ('9', 'cirrus'), ('10', 'thermal'), ('11', 'thermal')],
+                   'calibration': {'1': (1.22e-2, -61.0022), '2': (1.2493e-2, -62.46699),
+                                   '3': (1.1513e-2, -57.5628), '4': (9.708e-3, -48.5402),
+                                   '5': (5.9408e-3, -29.70418), '6': (1.4774e-3, -7.38716),
+                                   '7': (4.9797e-4, -2.48987), '8': (1.0987e-2, -54.93414),
+                                   '9': (2.3218e-3, -11.60907), '10': (3.342e-4, 0.1),
+                                   '11': (3.342e-4, 0.1)},
+                   'thermal': {'10': (774.8853, 1321.0789), '11': (480.8883, 1201.1442)}}}
+
+# land cover: TOA reflectance of each spectral role, and brightness temperature in K
+COVERS = ['water', 'vegetation', 'soil', 'cloud']
+COVER_REFLECTANCE = {'coastal': (0.10, 0.09, 0.13, 0.55),
+                     'blue': (0.08, 0.08, 0.12, 0.55),
+                     'green': (0.06, 0.09, 0.15, 0.55),
+                     'red': (0.04, 0.05, 0.20, 0.55),
+                     'nir': (0.02, 0.40, 0.28, 0.58),
+                     'swir1': (0.01, 0.20, 0.35, 0.45),
+                     'swir2': (0.005, 0.09, 0.28, 0.35),
+                     'pan': (0.05, 0.12, 0.20, 0.55),
+                     'cirrus': (0.002, 0.003, 0.004, 0.05)}
+COVER_TEMPERATURE = (290., 298., 312., 262.)
+
+# Landsat 8 Collection 1 quality band values of fill and of each cover
+QUALITY = {'fill': 1, 'water': 2724, 'vegetation': 2720, 'soil': 2720, 'cloud': 2800}
+
+
+def synthetic_scene(root, satellite='LC8', shape=None, date=None, path=41, row=27,
+                    origin=(600000., 5370000.), zone=11, sun_elevation=60., cloud_cover=0.15,
+                    water=0.1, tilt=12., noise=0.05, seed=0, block_rows=512, overwrite=False):
+    """ Write a synthetic Level-1 scene directory, as unzipped from USGS.
+
+    Every band of the sensor is written, with the DN type of the sensor, the panchromatic band
+    at 15 m, and an MTL file calibrating the DN to the reflectance and temperature of the land
+    cover. The cover is smooth fields of water, vegetation and bare soil under cloud, with
+    pixel noise; the imaged swath is a rectangle tilted within the grid, 0 DN around it as in
+    real scenes. Written block_rows lines at a time, so memory is a few blocks, not a scene.
+    An existing scene of the same shape is kept unless overwrite.
+    :param root: directory the scene directory is made in, named by the scene ID
+    :param satellite: 'LT5', 'LE7' or 'LC8'
+    :param shape: (lines, samples) of the reflective bands, default the full size of SENSORS
+    :param date: acquisition date 'YYYY-MM-DD', default the date of SENSORS
+    :param origin: upper-left x, y of the grid in UTM m
+    :param zone: UTM zone, north
+    :param cloud_cover: fraction of the swath under cloud
+    :param water: fraction of the land cover that is water
+    :param tilt: rotation of the swath in the grid, degrees
+    :param noise: relative standard deviation of reflectance between pixels
+    :param seed: random seed; a scene is a function of its arguments
+    :return: scene directory
+    """
+    if satellite not in SENSORS:
+        raise ValueError('{} is not a valid satellite, choose from {}'.format(satellite, sorted(SENSORS)))
+    sensor = SENSORS[satellite]
+    height, width = shape or sensor['shape']
+    acquired = datetime.strptime(date or sensor['date'], '%Y-%m-%d')
+    scene_id = '{}{:03d}{:03d}{}{}00'.format(satellite, path, row, acquired.strftime('%Y%j'),
+                                             sensor['station'])
+    product_id = 'L{}{:02d}_L1TP_{:03d}{:03d}_{}_{}_01_T1'.format(
+        satellite[1], int(satellite[2]), path, row, acquired.strftime('%Y%m%d'),
+        (acquired + timedelta(days=30)).strftime('%Y%m%d'))
+    prefix = product_id if satellite == 'LC8' else scene_id
+
+    directory = os.path.join(root, scene_id)
+    mtl_file = os.path.join(directory, '{}_MTL.txt'.format(prefix))
+    if os.path.isfile(mtl_file) and not overwrite:
+        attrs = scene_attributes(directory)
+        if (attrs['reflective_lines'], attrs['reflective_samples']) == (height, width):
+            return directory
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    crs = CRS.from_epsg(32600 + zone)
+    profile = {'driver': 'GTiff', 'dtype': sensor['dtype'], 'nodata': None, 'count': 1, 'crs': crs,
+               'height': height, 'width': width, 'transform': from_origin(origin[0], origin[1], 30., 30.)}
+    pan_profile = dict(profile, height=2 * height, width=2 * width,
+                       transform=from_origin(origin[0], origin[1], 15., 15.))
+
+    distance = LandsatImage.earth_sun_d(acquired)
+    cos_zenith = np.cos(np.deg2rad(90. - sun_elevation))
+    scale = dict((band, _dn_scale(satellite, band, distance, cos_zenith)) for band, role in sensor['bands'])
+
+    files = [('B{}'.format(band), role, band) for band, role in sensor['bands']]
+    if satellite == 'LC8':
+        files.append(('BQA', 'quality', None))
+
+    rng = np.random.RandomState(seed)
+    waves = [_waves(rng, height, width) for _ in range(2)]
+    thresholds = _thresholds(waves, height, width, water, cloud_cover)
+    swath = _swath(height, width, tilt)
+
+    dsts = dict((name, rasopen(os.path.join(directory, '{}_{}.TIF'.format(prefix, name)), 'w',
+                               **(pan_profile if role == 'pan' else profile))) for name, role, _ in files)
+    try:
+        for start in range(0, height, block_rows):
+            rows = min(block_rows, height - start)
+            inside, cover = _cover(start, rows, width, waves, thresholds, swath)
+            for name, role, band in files:
+                if role == 'quality':
+                    dn = np.choose(cover, [QUALITY[c] for c in COVERS]).astype(np.uint16)
+                    dn[~inside] = QUALITY['fill']
+                    dsts[name].write(dn, 1, window=Window(0, start, width, rows))
+                    continue
+                factor = 2 if role == 'pan' else 1
+                c = cover.repeat(factor, axis=0).repeat(factor, axis=1)
+                if role == 'thermal':
+                    temperature = np.choose(c, COVER_TEMPERATURE) + rng.standard_normal(c.shape)
+                    k1, k2 = sensor['thermal'][band]
+                    value = k1 / (np.exp(k2 / temperature) - 1.)
+                else:
+                    value = np.choose(c, COVER_REFLECTANCE[role])
+                    value = value * (1. + noise * rng.standard_normal(c.shape))
+                gain, offset = scale[band]
+                dn = np.clip(np.rint(value * gain + offset), *sensor['qcal']).astype(sensor['dtype'])
+                dn[~inside.repeat(factor, axis=0).repeat(factor, axis=1)] = 0
+                dsts[name].write(dn, 1, window=Window(0, start * factor, width * factor, rows * factor))
+    finally:
+        for dst in dsts.values():
+            dst.close()
+
+    with open(mtl_file, 'w') as f:
+        f.write(_mtl_text(satellite, scene_id, product_id, prefix, files, acquired, path, row,
+                          (height, width), origin, crs, zone, sun_elevation, cloud_cover, distance))
+    return directory
+
+
+def synthetic_scenes(root, satellites=('LT5', 'LE7', 'LC8'), shape=None, count=1, **kwargs):
+    """ Scenes of each satellite; every scene after a satellite's first is acquired 16 days later
+    on a grid a few pixels off, as repeat passes over one path/row are.
+    :param count: scenes per satellite
+    :return: dict of satellite: list of scene directories
+    """
+    scenes = {}
+    x, y = kwargs.pop('origin', (600000., 5370000.))
+    for satellite in satellites:
+        start = datetime.strptime(kwargs.get('date') or SENSORS[satellite]['date'], '%Y-%m-%d')
+        scenes[satellite] = []
+        for i in range(count):
+            scene_kwargs = dict(kwargs, date=(start + timedelta(days=16 * i)).strftime('%Y-%m-%d'),
+                                origin=(x + 90. * i, y - 60. * i), seed=kwargs.get('seed', 0) + i)
+            scenes[satellite].append(synthetic_scene(root, satellite, shape, **scene_kwargs))
+    return scenes
+
+
+def _dn_scale(satellite, band, distance, cos_zenith):
+    """ Gain and offset of the DN of a reflectance, or of a radiance for a thermal band. """
+    sensor = SENSORS[satellite]
+    qmin, qmax = sensor['qcal']
+    if satellite == 'LC8':
+        mult, add = sensor['calibration'][band]
+        if band in sensor['thermal']:
+            return 1. / mult, -add / mult
+        # reflectance rescaling of OLI, 2e-5 DN - 0.1
+        return cos_zenith / 2e-5, 0.1 / 2e-5
+    lmin, lmax = sensor['calibration'][band]
+    gain = (qmax - qmin) / (lmax - lmin)
+    if band in sensor['thermal']:
+        return gain, qmin - lmin * gain
+    radiance = sensor['esun'][band] * cos_zenith / (np.pi * distance ** 2)
+    return radiance * gain, qmin - lmin * gain
+
+
+def _waves(rng, height, width, n=4):
+    """ Random plane waves, of wavelengths 5 to 40 % of the scene. """
+    size = max(height, width)
+    wavelength = rng.uniform(0.05, 0.4, n) * size
+    angle = rng.uniform(0., np.pi, n)
+    phase = rng.uniform(0., 2 * np.pi, n)
+    return (2 * np.pi * np.cos(angle) / wavelength, 2 * np.pi * np.sin(angle) / wavelength, phase)
+
+
+def _field(waves, rows, cols):
+    kx, ky, phase = waves
+    field = np.zeros((rows.shape[0], cols.shape[1]))
+    for i in range(len(phase)):
+        field += np.cos(kx[i] * cols + ky[i] * rows + phase[i])
+    return field
+
+
+def _thresholds(waves, height, width, water, cloud_cover):
+    """ Field levels giving the cover fractions, from a coarse sample of the scene. """
+    rows = np.linspace(0, height - 1, min(height, 256))[:, np.newaxis]
+    cols = np.linspace(0, width - 1, min(width, 256))[np.newaxis, :]
+    land, cloud = _field(waves[0], rows, cols), _field(waves[1], rows, cols)
+    # the remaining land is half vegetation, half bare soil
+    return (np.percentile(land, 100. * water), np.percentile(land, 100. * (1. + water) / 2.),
+            np.percentile(cloud, 100. * (1. - cloud_cover)))
+
+
+def _swath(height, width, tilt):
+    """ Center, half-length and half-width of the imaged rectangle, tilted to fill the grid. """
+    theta = np.deg2rad(tilt)
+    cos, sin = np.cos(theta), np.sin(theta)
+    # rectangle w x h rotated by tilt spans 0.98 of the grid
+    w = (0.98 * width * cos - 0.98 * height * sin) / (cos ** 2 - sin ** 2)
+    h = (0.98 * height * cos - 0.98 * width * sin) / (cos ** 2 - sin ** 2)
+    return (height - 1) / 2., (width - 1) / 2., h / 2., w / 2., cos, sin
+
+
+def _cover(start, rows, width, waves, thresholds, swath):
+    """ Swath mask and cover index of COVERS of a block of lines. """
+    r = np.arange(start, start + rows, dtype=float)[:, np.newaxis]
+    c = np.arange(width, dtype=float)[np.newaxis, :]
+    cy, cx, half_h, half_w, cos, sin = swath
+    along = (r - cy) * cos - (c - cx) * sin
+    across = (r - cy) * sin + (c - cx) * cos
+    inside = (np.abs(along) <= half_h) & (np.abs(across) <= half_w)
+
+    land, cloud = _field(waves[0], r, c), _field(waves[1], r, c)
+    water, vegetation, cloudy = thresholds
+    cover = np.where(land < water, 0, np.where(land < vegetation, 2, 1))
+    cover[cloud > cloudy] = 3
+    return inside, cover
+
+
+def _mtl_text(satellite, scene_id, product_id, prefix, files, acquired, path, row, shape, origin,
+              crs, zone, sun_elevation, cloud_cover, distance):
+    sensor = SENSORS[satellite]
+    height, width = shape
+    qmin, qmax = sensor['qcal']
+    bands = [band for band, role in sensor['bands']]
+    reflective = [band for band, role in sensor['bands'] if band not in sensor['thermal']]
+
+    xs = [origin[0], origin[0] + 30. * width, origin[0], origin[0] + 30. * width]
+    ys = [origin[1], origin[1], origin[1] - 30. * height, origin[1] - 30. * height]
+    lons, lats = transform_coords(crs, CRS.from_epsg(4326), xs, ys)
+
+    info = [('ORIGIN', _quote('Image courtesy of the U.S. Geological Survey')),
+            ('LANDSAT_SCENE_ID', _quote(scene_id))]
+    if satellite == 'LC8':
+        info.append(('LANDSAT_PRODUCT_ID', _quote(product_id)))
+    info += [('FILE_DATE', (acquired + timedelta(days=30)).strftime('%Y-%m-%dT%H:%M:%SZ')),
+             ('STATION_ID', _quote(sensor['station'])),
+             ('PROCESSING_SOFTWARE_VERSION', _quote('SYNTHETIC'))]
+
+    product = [('DATA_TYPE', _quote('L1TP')), ('OUTPUT_FORMAT', _quote('GEOTIFF')),
+               ('SPACECRAFT_ID', _quote(sensor['spacecraft'])), ('SENSOR_ID', _quote(sensor['sensor'])),
+               ('WRS_PATH', '{:03d}'.format(path)), ('WRS_ROW', '{:03d}'.format(row)),
+               ('DATE_ACQUIRED', acquired.strftime('%Y-%m-%d')),
+               ('SCENE_CENTER_TIME', _quote('18:00:00.0000000Z'))]
+    for i, corner in enumerate(['UL', 'UR', 'LL', 'LR']):
+        product += [('CORNER_{}_LAT_PRODUCT'.format(corner), '{:.5f}'.format(lats[i])),
+                    ('CORNER_{}_LON_PRODUCT'.format(corner), '{:.5f}'.format(lons[i]))]
+    for i, corner in enumerate(['UL', 'UR', 'LL', 'LR']):
+        product += [('CORNER_{}_PROJECTION_X_PRODUCT'.format(corner), '{:.3f}'.format(xs[i])),
+                    ('CORNER_{}_PROJECTION_Y_PRODUCT'.format(corner), '{:.3f}'.format(ys[i]))]
+    if 'pan' in [role for band, role in sensor['bands']]:
+        product += [('PANCHROMATIC_LINES', 2 * height), ('PANCHROMATIC_SAMPLES', 2 * width)]
+    product += [('REFLECTIVE_LINES', height), ('REFLECTIVE_SAMPLES', width),
+                ('THERMAL_LINES', height), ('THERMAL_SAMPLES', width)]
+    for name, role, band in files:
+        key = 'QUALITY' if name == 'BQA' else 'BAND_{}'.format(name[1:])
+        product.append(('FILE_NAME_{}'.format(key), _quote('{}_{}.TIF'.format(prefix, name))))
+    product.append(('METADATA_FILE_NAME', _quote('{}_MTL.txt'.format(prefix))))
+
+    attributes = [('CLOUD_COVER', '{:.2f}'.format(100. * cloud_cover)), ('IMAGE_QUALITY', 9),
+                  ('SUN_AZIMUTH', '{:.8f}'.format(135.)), ('SUN_ELEVATION', '{:.8f}'.format(sun_elevation)),
+                  ('EARTH_SUN_DISTANCE', '{:.7f}'.format(distance))]
+
+    # radiance of the quantized range, and its reflectance
+    cos_zenith = np.cos(np.deg2rad(90. - sun_elevation))
+    limits, mult_add = {}, {}
+    for band in bands:
+        if satellite == 'LC8':
+            mult, add = sensor['calibration'][band]
+            lmin, lmax = mult * qmin + add, mult * qmax + add
+        else:
+            lmin, lmax = sensor['calibration'][band]
+            mult = (lmax - lmin) / (qmax - qmin)
+            add = lmin - mult * qmin
+        limits[band], mult_add[band] = (lmin, lmax), (mult, add)
+    reflectance = {}
+    for band in reflective:
+        if satellite == 'LC8':
+            reflectance[band] = (2e-5, -0.1)
+        else:
+            factor = np.pi * distance ** 2 / (sensor['esun'][band] * cos_zenith)
+            reflectance[band] = (mult_add[band][0] * factor, mult_add[band][1] * factor)
+
+    radiance = []
+    for band in bands:
+        radiance += [('RADIANCE_MAXIMUM_BAND_{}'.format(band), '{:.5f}'.format(limits[band][1])),
+                     ('RADIANCE_MINIMUM_BAND_{}'.format(band), '{:.5f}'.format(limits[band][0]))]
+    min_max_reflectance = []
+    for band in reflective:
+        mult, add = reflectance[band]
+        min_max_reflectance += [('REFLECTANCE_MAXIMUM_BAND_{}'.format(band), '{:.6f}'.format(mult * qmax + add)),
+                                ('REFLECTANCE_MINIMUM_BAND_{}'.format(band), '{:.6f}'.format(mult * qmin + add))]
+    pixel = []
+    for band in bands:
+        pixel += [('QUANTIZE_CAL_MAX_BAND_{}'.format(band), qmax),
+                  ('QUANTIZE_CAL_MIN_BAND_{}'.format(band), qmin)]
+    rescaling = [('RADIANCE_MULT_BAND_{}'.format(band), '{:.4E}'.format(mult_add[band][0])) for band in bands]
+    rescaling += [('RADIANCE_ADD_BAND_{}'.format(band), '{:.5f}'.format(mult_add[band][1])) for band in bands]
+    rescaling += [('REFLECTANCE_MULT_BAND_{}'.format(band), '{:.4E}'.format(reflectance[band][0]))
+                  for band in reflective]
+    rescaling += [('REFLECTANCE_ADD_BAND_{}'.format(band), '{:.6f}'.format(reflectance[band][1]))
+                  for band in reflective]
+    constants = []
+    for band in sorted(sensor['thermal']):
+        k1, k2 = sensor['thermal'][band]
+        constants += [('K1_CONSTANT_BAND_{}'.format(band), '{:.4f}'.format(k1)),
+                      ('K2_CONSTANT_BAND_{}'.format(band), '{:.4f}'.format(k2))]
+
+    projection = [('MAP_PROJECTION', _quote('UTM')), ('DATUM', _quote('WGS84')),
+                  ('ELLIPSOID', _quote('WGS84')), ('UTM_ZONE', zone),
+                  ('GRID_CELL_SIZE_REFLECTIVE', '30.00'), ('GRID_CELL_SIZE_THERMAL', '30.00'),
+                  ('ORIENTATION', _quote('NORTH_UP')), ('RESAMPLING_OPTION', _quote('CUBIC_CONVOLUTION'))]
+
+    groups = [('METADATA_FILE_INFO', info), ('PRODUCT_METADATA', product),
+              ('IMAGE_ATTRIBUTES', attributes), ('MIN_MAX_RADIANCE', radiance),
+              ('MIN_MAX_REFLECTANCE', min_max_reflectance), ('MIN_MAX_PIXEL_VALUE', pixel),
+              ('RADIOMETRIC_RESCALING', rescaling),
+              ('TIRS_THERMAL_CONSTANTS' if satellite == 'LC8' else 'THERMAL_CONSTANTS', constants),
+              ('PROJECTION_PARAMETERS', projection)]
+
+    lines = ['GROUP = L1_METADATA_FILE']
+    for group, items in groups:
+        lines.append('  GROUP = {}'.format(group))
+        lines += ['    {} = {}'.format(key, value) for key, value in items]
+        lines.append('  END_GROUP = {}'.format(group))
+    lines += ['END_GROUP = L1_METADATA_FILE', 'END']
+    return '\n'.join(lines) + '\n'
+
+
+def _quote(value):
+    return '"{}"'.format(value)
+
+
+if __name__ == '__main__':
+    home = os.path.expanduser('~')
+
+# ========================= EOF ================================================================
@@ -0,0 +1,141 @@
+# =============================================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================================
+
+from __future__ import division
+
+import os
+
+import numpy as np
+from rasterio.windows import Window
+
+# Tasumi et al. (2008) coefficients C1 - C5 of the band transmissivity and Cb of the path
+# reflectance, derived for TM and ETM+ and applied to the matching OLI bands
+TASUMI_COEFFICIENTS = {'blue': (0.987, -0.00071, 0.000036, 0.0880, 0.0789, 0.640),
+                       'green': (2.319, -0.00016, 0.000105, 0.0437, -1.2697, 0.310),
+                       'red': (0.951, -0.00033, 0.00028, 0.0875, 0.1014, 0.286),
+                       'nir': (0.375, -0.00048, 0.005018, 0.1355, 0.6621, 0.189),
+                       'swir1': (0.234, -0.00101, 0.004336, 0.0560, 0.7757, 0.274),
+                       'swir2': (0.365, -0.00097, 0.004296, 0.0155, 0.639, -0.186)}
+
+# band weights of broad-band albedo, Tasumi et al. (2008)
+TASUMI_WEIGHTS = {'blue': 0.254, 'green': 0.149, 'red': 0.147, 'nir': 0.311, 'swir1': 0.103,
+                  'swir2': 0.036}
+
+TASUMI_ROLES = ['blue', 'green', 'red', 'nir', 'swir1', 'swir2']
+
+
+def air_pressure(elevation):
+    """ Mean atmospheric pressure at an elevation, FAO-56.
+    :param elevation: m above sea level, scalar or array
+    :return: kPa
+    """
+    return 101.3 * ((293. - 0.0065 * elevation) / 293.) ** 5.26
+
+
+def precipitable_water(pressure, vapor_pressure):
+    """ Precipitable water in the atmosphere, Garrison and Adler (1990).
+    :param pressure: air pressure, kPa
+    :param vapor_pressure: near-surface vapor pressure, kPa
+    :return: mm
+    """
+    return 0.14 * vapor_pressure * pressure + 2.1
+
+
+def transmissivity(role, pressure, water, cos_angle, kt=1.):
+    """ Band transmissivity of the atmosphere along a path at an angle from the zenith.
+    :param role: spectral role, see TASUMI_ROLES
+    :param pressure: air pressure, kPa
+    :param water: precipitable water, mm
+    :param cos_angle: cosine of the solar zenith angle, or of the view angle
+    :param kt: air turbidity, 1 for clean air, 0.5 for turbid or polluted air
+    :return: transmissivity [-]
+    """
+    c1, c2, c3, c4, c5, _ = TASUMI_COEFFICIENTS[role]
+    return c1 * np.exp(c2 * pressure / (kt * cos_angle) - (c3 * water + c4) / cos_angle) + c5
+
+
+def surface_coefficients(role, cos_zenith, elevation=0., vapor_pressure=1., cos_view=1., kt=1.):
+    """ Scale and offset of at-surface reflectance, scale * TOA reflectance + offset.
+
+    (toa - rho_a) / (tau_in * tau_out), rho_a = Cb * (1 - tau_in) the path reflectance and
+    tau_in, tau_out the band transmissivity of incoming and reflected radiation.
+    Tasumi et al. (2008)
+    :param role: spectral role, see TASUMI_ROLES
+    :param cos_zenith: cosine of the solar zenith angle
+    :param elevation: m above sea level, scalar for the scene or array per pixel
+    :param vapor_pressure: near-surface vapor pressure, kPa
+    :param cos_view: cosine of the satellite view angle, 1 at nadir
+    :param kt: air turbidity, see transmissivity
+    :return: scale, offset; scalars, or arrays of the shape of elevation
+    """
+    pressure = air_pressure(elevation)
+    water = precipitable_water(pressure, vapor_pressure)
+    tau_in = transmissivity(role, pressure, water, cos_zenith, kt)
+    tau_out = transmissivity(role, pressure, water, cos_view, kt)
+    scale = 1. / (tau_in * tau_out)
+    return scale, -TASUMI_COEFFICIENTS[role][5] * (1. - tau_in) * scale
+
+
+def albedo_coefficients(cos_zenith, elevation=0., vapor_pressure=1., cos_view=1., kt=1.):
+    """ Albedo as one affine combination of TOA reflectance, sum(weight * toa) + offset.
+
+    The at-surface reflectance of each band, weighted by TASUMI_WEIGHTS, folded together.
+    :return: dict of spectral role: weight, and offset; scalars, or arrays of the shape
+    of elevation
+    """
+    weights, offset = {}, 0.
+    for role in TASUMI_ROLES:
+        scale, shift = surface_coefficients(role, cos_zenith, elevation, vapor_pressure, cos_view, kt)
+        weights[role] = TASUMI_WEIGHTS[role] * scale
+        offset = offset + TASUMI_WEIGHTS[role] * shift
+    return weights, offset
+
+
+def tasumi_albedo(image, elevation=0., vapor_pressure=1., block_size=512):
+    """ Tasumi (2008) albedo of an image, block by block.
+
+    With a per-pixel elevation the coefficients vary by pixel; computing them one block at
+    a time keeps them, like every other temporary, block-sized.
+    :param image: LandsatImage object
+    :param elevation: m above sea level, scalar, or array of the image shape
+    :param vapor_pressure: near-surface vapor pressure, kPa
+    :param block_size: block width and height in pixels, None for the whole image at once
+    :return: float32 array
+    """
+    height, width = image.rasterio_geometry['height'], image.rasterio_geometry['width']
+    if np.ndim(elevation) and np.shape(elevation) != (height, width):
+        raise ValueError('Elevation of shape {} is not on the image grid {}'.format(
+            np.shape(elevation), (height, width)))
+    albedo = np.empty((height, width), dtype=np.float32)
+
+    # a decimated image is read whole, it cannot be windowed
+    size = block_size if block_size and image._out_shape is None else max(height, width)
+    for row in range(0, height, size):
+        for col in range(0, width, size):
+            window = Window(col, row, min(size, width - col), min(size, height - row))
+            view = image if size >= max(height, width) else image.windowed(window)
+            rows, cols = window.toslices()
+            z = elevation[rows, cols] if np.ndim(elevation) else elevation
+            view.albedo(model='tasumi', elevation=z, vapor_pressure=vapor_pressure,
+                        out=albedo[rows, cols])
+
+    return albedo
+
+
+if __name__ == '__main__':
+    home = os.path.expanduser('~')
+
+# ========================= EOF ================================================================
@@ -0,0 +1,217 @@
+# =============================================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================================
+
+import os
+
+import numpy as np
+from rasterio.windows import Window
+
+# Allen (2007) mean values of path radiance, narrow-band transmissivity and sky radiance
+RP, TAU, RSKY = 0.91, 0.866, 1.32
+
+# Jimenez-Munoz et al. (2014) split-window coefficients c0 - c6 of Landsat 8 TIRS
+SPLIT_WINDOW = (-0.268, 1.378, 0.183, 54.30, -2.238, -129.20, 16.40)
+
+# TIRS band 10 and 11 emissivity of bare soil, full vegetation and water, Yu et al. (2014)
+TIRS_EMISSIVITY = {'soil': (0.971, 0.977),
+                   'vegetation': (0.987, 0.989),
+                   'water': (0.991, 0.986)}
+
+# product: sensors it can be computed for
+THERMAL_PRODUCTS = {'bt': ['LT5', 'LE7', 'LC8'],
+                    'bt11': ['LC8'],
+                    'emissivity': ['LT5', 'LE7', 'LC8'],
+                    'lst': ['LT5', 'LE7', 'LC8'],
+                    'lst_split': ['LC8']}
+
+
+def brightness_temp(radiance, k1, k2):
+    """ At-satellite brightness temperature, K2 / ln(K1 / L + 1).
+    :param radiance: thermal band radiance, W / (m2 sr um)
+    :param k1: thermal conversion constant K1 of the band
+    :param k2: thermal conversion constant K2 of the band
+    :return: brightness temperature, K
+    """
+    return k2 / (np.log((k1 / radiance) + 1))
+
+
+def single_channel_lst(radiance, epsilon, k1, k2, rp=RP, tau=TAU, rsky=RSKY, out=None, work=None):
+    """ Land surface temperature of one thermal band, corrected for path and sky radiance.
+    Allen et al. (2007)
+    :param radiance: thermal band radiance, W / (m2 sr um)
+    :param epsilon: narrow-band surface emissivity
+    :param k1: thermal conversion constant K1 of the band
+    :param k2: thermal conversion constant K2 of the band
+    :param rp: path radiance
+    :param tau: narrow-band transmissivity of air
+    :param rsky: narrow-band downward thermal radiation of a clear sky
+    :param out: array of the shape of radiance for the result
+    :param work: scratch array of the shape of radiance, default a new one
+    :return: LST, K
+    """
+    # rc = ((radiance - rp) / tau) - ((1 - epsilon) * rsky), in out
+    out = np.subtract(radiance, rp, out=out)
+    out /= tau
+    work = np.subtract(1, epsilon, out=work)
+    work *= rsky
+    out -= work
+    # k2 / log((epsilon * k1 / rc) + 1)
+    np.multiply(epsilon, k1, out=work)
+    work /= out
+    work += 1
+    np.log(work, out=work)
+    return np.true_divide(k2, work, out=out)
+
+
+def tirs_emissivity(ndvi):
+    """ Band 10 and 11 emissivity from NDVI, by the NDVI threshold method.
+
+    The vegetation fraction ((ndvi - 0.2) / (0.5 - 0.2)) ** 2, clipped to 0 - 1, mixes the
+    soil and vegetation emissivity of TIRS_EMISSIVITY; negative NDVI is water.
+    Sobrino et al. (2008)
+    :param ndvi: NDVI
+    :return: band 10 emissivity, band 11 emissivity
+    """
+    pv = np.clip((ndvi - 0.2) / (0.5 - 0.2), 0., 1.) ** 2
+    water = ndvi < 0
+    emissivity = []
+    for band in range(2):
+        soil, vegetation = TIRS_EMISSIVITY['soil'][band], TIRS_EMISSIVITY['vegetation'][band]
+        epsilon = soil + (vegetation - soil) * pv
+        epsilon[water] = TIRS_EMISSIVITY['water'][band]
+        emissivity.append(epsilon)
+    return emissivity
+
+
+def split_window_coefficients(water_vapor):
+    """ Per-scene coefficients of split_window_lst.
+    :param water_vapor: total column water vapor, g / cm2
+    :return: c0, c1, c2, c3 + c4 * w, c5 + c6 * w
+    """
+    c0, c1, c2, c3, c4, c5, c6 = SPLIT_WINDOW
+    return c0, c1, c2, c3 + c4 * water_vapor, c5 + c6 * water_vapor
+
+
+def split_window_lst(bt10, bt11, ndvi, water_vapor=2.0, coefficients=None):
+    """ Land surface temperature of Landsat 8 from the difference of bands 10 and 11.
+
+    Ts = T10 + c1 (T10 - T11) + c2 (T10 - T11) ** 2 + c0 + (c3 + c4 w)(1 - e) + (c5 + c6 w) de,
+    e the mean and de the difference of the band 10 and 11 emissivity, see tirs_emissivity.
+    Jimenez-Munoz et al. (2014)
+    :param bt10: band 10 brightness temperature, K
+    :param bt11: band 11 brightness temperature, K
+    :param ndvi: NDVI
+    :param water_vapor: total column water vapor, g / cm2
+    :param coefficients: split_window_coefficients(water_vapor), to compute them once per scene
+    :return: LST, K
+    """
+    c0, c1, c2, cw, dw = coefficients or split_window_coefficients(water_vapor)
+    e10, e11 = tirs_emissivity(ndvi)
+
+    diff = bt10 - bt11
+    lst = bt10 + c0
+    lst += c1 * diff
+    diff *= diff
+    lst += c2 * diff
+    # in place, e11 becomes -de and e10 becomes 1 - e
+    e11 -= e10
+    e10 += e11 / 2.
+    np.subtract(1., e10, out=e10)
+    lst += cw * e10
+    lst -= dw * e11
+    return lst
+
+
+def thermal_products(image, products=('bt', 'lst'), block_size=512, water_vapor=2.0, prefetch=0):
+    """ Thermal products of an image in one pass.
+
+    The image is processed block by block; within a block the thermal bands and the bands
+    of NDVI are read once and shared by brightness temperature, emissivity and both LST.
+    Products:
+    bt, brightness temperature of the thermal band (Landsat 8 band 10), K
+    bt11, Landsat 8 band 11 brightness temperature, K
+    emissivity, narrow-band emissivity of the single-channel LST
+    lst, single-channel LST, see single_channel_lst, K
+    lst_split, Landsat 8 split-window LST, see split_window_lst, K
+    :param image: LandsatImage object
+    :param products: iterable of THERMAL_PRODUCTS keys
+    :param block_size: block width and height in pixels, None for the whole image at once
+    :param water_vapor: total column water vapor of the scene for lst_split, g / cm2
+    :param prefetch: read this many blocks ahead on background threads, see prefetch.PrefetchReader
+    :return: dict of float32 arrays
+    """
+    products = list(products)
+    for product in products:
+        if product not in THERMAL_PRODUCTS:
+            raise ValueError('{} is not a valid thermal product, choose from {}'.format(
+                product, sorted(THERMAL_PRODUCTS)))
+        if image.satellite not in THERMAL_PRODUCTS[product]:
+            raise ValueError('{} cannot be computed for {}'.format(product, image.satellite))
+    coefficients = split_window_coefficients(water_vapor)
+
+    height, width = image.rasterio_geometry['height'], image.rasterio_geometry['width']
+    results = dict((product, np.empty((height, width), dtype=np.float32)) for product in products)
+
+    # a decimated image is read whole, it cannot be windowed
+    if not block_size or image._out_shape is not None:
+        blocks = [(Window(0, 0, width, height), image)]
+    elif prefetch:
+        from sat_image.prefetch import PrefetchReader
+        blocks = PrefetchReader(image, block_size, bands=thermal_bands(image, products), depth=prefetch)
+    else:
+        blocks = ((window, image.windowed(window)) for window in
+                  (Window(col, row, min(block_size, width - col), min(block_size, height - row))
+                   for row in range(0, height, block_size) for col in range(0, width, block_size)))
+
+    for window, view in blocks:
+        rows, cols = window.toslices()
+        with view.caching():
+            for product in products:
+                results[product][rows, cols] = _thermal_product(view, product, coefficients)
+
+    return results
+
+
+def thermal_bands(image, products):
+    """ Bands read by a set of thermal products.
+    :return: sorted list of band names, e.g. ['b10', 'b4', 'b5']
+    """
+    thermal = {'LT5': 'b6', 'LE7': 'b6_vcid_1', 'LC8': 'b10'}[image.satellite]
+    bands = set([thermal])
+    if 'bt11' in products or 'lst_split' in products:
+        bands.add('b11')
+    if set(products) & set(['emissivity', 'lst', 'lst_split']):
+        bands.update('b{}'.format(image.role_band(role)) for role in ['red', 'nir'])
+    return sorted(bands)
+
+
+def _thermal_product(view, product, coefficients):
+    if product == 'bt':
+        return view.brightness_temp(view.role_band('thermal'))
+    if product == 'bt11':
+        return view.brightness_temp(11)
+    if product == 'emissivity':
+        return view.emissivity()
+    if product == 'lst':
+        return view.land_surface_temp()
+    return split_window_lst(view.brightness_temp(10), view.brightness_temp(11), view.ndvi(),
+                            coefficients=coefficients)
+
+
+if __name__ == '__main__':
+    home = os.path.expanduser('~')
+
+# ========================= EOF ================================================================
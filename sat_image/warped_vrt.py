@@ -17,76 +17,160 @@
 from __future__ import division
 
 import os
+import json
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from datetime import datetime
+from stat import S_IMODE
+from time import time
+
+from tempfile import mkstemp
 
 from rasterio import open as rasopen
+from rasterio.crs import CRS
 from rasterio.enums import Resampling
 from rasterio.vrt import WarpedVRT
+from rasterio.windows import Window
 
 from sat_image.band_map import BandMap
-from sat_image.image import Landsat5, Landsat7, Landsat8, LandsatImage
+from sat_image.grid import grid_to_dict, grid_from_dict, scene_attributes, scene_profile
+
+BLOCK_SIZE = 256
+
+# GTiff predictor by dtype kind: horizontal differencing for integers, floating point for floats
+PREDICTORS = {'u': 2, 'i': 2, 'f': 3}
+
+MANIFEST = 'warp_manifest.json'
+
+
+class WarpManifest(object):
+    """ Per-file record of a warped archive, kept in <directory>/warp_manifest.json.
+
+    Stores the target grid and, for every file, its size and mtime after warping,
+    the hash of the grid it was warped to and its status ('warped' or 'skipped', the
+    latter when it was already on the grid). A file is current if none of these changed.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, MANIFEST)
+        self.grid = None
+        self.files = {}
+        if os.path.isfile(self.path):
+            with open(self.path, 'r') as f:
+                manifest = json.load(f)
+            self.grid = manifest['grid']
+            self.files = manifest['files']
+
+    @property
+    def exists(self):
+        return os.path.isfile(self.path)
+
+    def profile(self):
+        """ Target grid as a profile dict, or None if no grid is recorded. """
+        if self.grid is None:
+            return None
+        return grid_from_dict(self.grid)
+
+    def set_grid(self, profile, master):
+        self.grid = grid_to_dict(profile)
+        self.grid['master'] = os.path.relpath(master, self.directory)
+
+    def is_current(self, path):
+        entry = self.files.get(self._key(path))
+        if entry is None or entry['grid'] != self.grid['hash']:
+            return False
+        stat = os.stat(path)
+        return entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime
+
+    def record(self, path, status):
+        stat = os.stat(path)
+        self.files[self._key(path)] = {'size': stat.st_size, 'mtime': stat.st_mtime,
+                                       'grid': self.grid['hash'], 'status': status}
+
+    def save(self):
+        temp = '{}.tmp'.format(self.path)
+        with open(temp, 'w') as f:
+            json.dump({'grid': self.grid, 'files': self.files}, f, indent=1, sort_keys=True)
+        os.replace(temp, self.path)
+
+    def _key(self, path):
+        return os.path.relpath(path, self.directory)
 
 
 def warp_vrt(directory, delete_extra=False, use_band_map=False,
-             overwrite=False, remove_bqa=True, return_profile=False):
+             overwrite=False, remove_bqa=False, return_profile=False,
+             workers=1, executor='process', callback=None,
+             compress='deflate', num_threads=None, warp_mem_limit=0, registry=None):
     """ Read in image geometry, resample subsequent images to same grid.
 
     The purpose of this function is to snap many Landsat images to one geometry. Use Landsat578
     to download and unzip them, then run them through this to get identical geometries for analysis.
-    Files
+    Files are warped independently once the master grid is read from the first scene, so they
+    are scheduled across a pool of workers; scenes and files are processed in sorted order.
+    Each file is streamed window by window into a tiled, compressed temporary GeoTIFF that
+    replaces the original only once complete. Files already on the master grid are left as
+    they are. Progress is kept in a WarpManifest, so a rerun over an interrupted or extended
+    archive warps only new or changed files, onto the grid recorded in the manifest.
     :param use_band_map:
     :param delete_extra:
+    :param remove_bqa: delete the quality band (BQA) instead of warping it with the other bands
     :param directory: A directory containing sub-directories of Landsat images.
-    :return: None
+    :param workers: number of files warped concurrently
+    :param executor: 'process' or 'thread', the kind of pool used when workers > 1
+    :param callback: called as callback(path, seconds, n_done, n_total) as each file is warped
+    :param compress: GTiff compression of the output, e.g. 'deflate', 'lzw' or None
+    :param num_threads: GDAL warp threads per file, an int or 'ALL_CPUS'
+    :param warp_mem_limit: GDAL warp working memory per file in MB, 0 for the GDAL default
+    :param overwrite: ignore the manifest, choose the master grid again and warp every file
+    :param registry: GridRegistry; if given the master grid is the one registered for the first
+    scene's path/row (registering that scene's grid if there is none), rather than the first scene
+    :return: master grid profile if return_profile, else an OrderedDict of {path: seconds}
+    for the files processed in this run; a directory warped before the manifest was kept
+    (resample_meta.txt but no manifest) is left as it is, with no profile and no files
     """
 
-    if 'resample_meta.txt' in os.listdir(directory) and not overwrite:
-        print('{} has already had component images warped'.format(directory))
-        return None
+    manifest = WarpManifest(directory)
+    if 'resample_meta.txt' in os.listdir(directory) and not manifest.exists and not overwrite:
+        # warped before manifests were kept, nothing is known to warp
+        return None if return_profile else OrderedDict()
 
-    mapping = {'LC8': Landsat8, 'LE7': Landsat7, 'LT5': Landsat5}
+    if overwrite:
+        manifest.grid, manifest.files = None, {}
 
-    vrt_options = {}
-    list_dir = [x[0] for x in os.walk(directory) if os.path.basename(x[0])[:3] in mapping.keys()]
-    extras = [os.path.join(directory, x) for x in os.listdir(directory) if x.endswith('.tif')]
-    first = True
+    list_dir = sorted([x[0] for x in os.walk(directory) if os.path.basename(x[0])[:3] in ['LC8', 'LE7', 'LT5']])
+    paths = sorted([os.path.join(directory, x) for x in os.listdir(directory) if x.endswith('.tif')])
+    scene_paths = {}
+    dst = manifest.profile()
 
     for d in list_dir:
-        sat = LandsatImage(d).satellite
-        paths = extras
-        root = os.path.join(directory, d)
-        if os.path.isdir(root):
-            for x in os.listdir(root):
-
-                if remove_bqa and x.endswith('BQA.TIF'):
-                    try:
-                        os.remove(x)
-                    except FileNotFoundError:
-                        pass
-
-                elif use_band_map:
-                    bands = BandMap().selected
-                    for y in bands[sat]:
-                        if x.endswith('B{}.TIF'.format(y)):
-                            paths.append(os.path.join(directory, d, x))
-                else:
-                    if x.endswith('.TIF') or x.endswith('.tif'):
-                        paths.append(os.path.join(directory, d, x))
-
-                if x.endswith('MTL.txt'):
-                    mtl = os.path.join(directory, d, x)
-
-        if first:
-
-            landsat = mapping[sat](os.path.join(directory, d))
-            dst = landsat.rasterio_geometry
-
-            vrt_options = {'resampling': Resampling.nearest,
-                           'dst_crs': dst['crs'],
-                           'dst_transform': dst['transform'],
-                           'dst_height': dst['height'],
-                           'dst_width': dst['width']}
+        sat = scene_attributes(d)['landsat_scene_id'][:3]
+        scene_paths[d] = []
+        for x in sorted(os.listdir(d)):
+
+            if remove_bqa and x.endswith('BQA.TIF'):
+                try:
+                    os.remove(os.path.join(d, x))
+                except FileNotFoundError:
+                    pass
+
+            elif use_band_map:
+                bands = BandMap().selected
+                for y in bands[sat]:
+                    if x.endswith('B{}.TIF'.format(y)):
+                        scene_paths[d].append(os.path.join(d, x))
+            else:
+                if x.endswith('.TIF') or x.endswith('.tif'):
+                    scene_paths[d].append(os.path.join(d, x))
 
+        if dst is None:
+
+            if registry is not None:
+                dst = registry.grid_for(d)
+            else:
+                dst = scene_profile(d)
+            manifest.set_grid(dst, d)
+            manifest.save()
 
             message = """
             This directory has been resampled to same grid.
@@ -95,49 +179,149 @@ def warp_vrt(directory, delete_extra=False, use_band_map=False,
             """.format(d, datetime.now())
             with open(os.path.join(directory, 'resample_meta.txt'), 'w') as f:
                 f.write(message)
-            first = False
-
-        for tif_path in paths:
-            print('warping {}'.format(os.path.basename(tif_path)))
-            with rasopen(tif_path, 'r') as src:
-                with WarpedVRT(src, **vrt_options) as vrt:
-                    data = vrt.read()
-                    dst_dir, name = os.path.split(tif_path)
-                    outfile = os.path.join(dst_dir, name)
-                    meta = vrt.meta.copy()
-                    meta['driver'] = 'GTiff'
-                    with rasopen(outfile, 'w', **meta) as dst:
-                        dst.write(data)
-
-        if delete_extra:
-            for x in os.listdir(os.path.join(directory, d)):
-                x_file = os.path.join(directory, d, x)
-                if x_file not in paths:
+
+        paths.extend(scene_paths[d])
+
+    timings = OrderedDict()
+    if dst is not None:
+        vrt_options = _vrt_options(dst, num_threads, warp_mem_limit)
+        pending = [path for path in paths if not manifest.is_current(path)]
+        finished = []
+
+        def done(path, status, seconds):
+            manifest.record(path, status)
+            manifest.save()
+            finished.append(path)
+            if callback:
+                callback(path, seconds, len(finished), len(pending))
+
+        timings = _run_warps(pending, vrt_options, workers, executor, done, compress)
+
+    if delete_extra:
+        for d in list_dir:
+            for x in os.listdir(d):
+                x_file = os.path.join(d, x)
+                if x_file not in scene_paths[d]:
                     if x[-7:] not in ['ask.tif', 'MTL.txt']:
-                        print('removing {}'.format(x_file))
                         os.remove(x_file)
 
     if return_profile:
         return dst
 
-def warp_single_image(image_path, profile):
-
-    vrt_options = {'resampling': Resampling.nearest,
-                   'crs': profile['crs'],
-                   'transform': profile['transform'],
-                   'height': profile['height'],
-                   'width': profile['width']}
-
-    with rasopen(image_path, 'r') as src:
-        with WarpedVRT(src, **vrt_options) as vrt:
-            data = vrt.read()
-            dst_dir, name = os.path.split(image_path)
-            outfile = os.path.join(dst_dir, name)
-            meta = vrt.meta.copy()
-            meta['driver'] = 'GTiff'
-            with rasopen(outfile, 'w', **meta) as dst:
-                dst.write(data)
-            return data
+    return timings
+
+
+def warp_single_image(image_path, profile=None, compress='deflate', num_threads=None,
+                      warp_mem_limit=0, return_data=True, registry=None):
+    """ Warp one image onto the grid of profile, in place.
+    :param image_path: GeoTIFF to warp
+    :param profile: target grid, dict with crs, transform, height and width
+    :param return_data: read the warped image back and return it
+    :param registry: GridRegistry; with no profile, use the grid registered for the path/row of
+    the scene directory containing image_path
+    :return: warped array if return_data, else None
+    """
+    if profile is None:
+        if registry is None:
+            raise ValueError('warp_single_image needs a profile or a GridRegistry')
+        profile = registry.grid_for(os.path.dirname(os.path.abspath(image_path)))
+
+    _warp(image_path, _vrt_options(profile, num_threads, warp_mem_limit), compress)
+
+    if return_data:
+        with rasopen(image_path, 'r') as src:
+            return src.read()
+
+
+def _vrt_options(profile, num_threads=None, warp_mem_limit=0):
+    options = {'resampling': Resampling.nearest,
+               'crs': profile['crs'],
+               'transform': profile['transform'],
+               'height': profile['height'],
+               'width': profile['width'],
+               'warp_mem_limit': warp_mem_limit}
+    if num_threads:
+        options['warp_extras'] = {'NUM_THREADS': num_threads}
+    return options
+
+
+def _warp(tif_path, vrt_options, compress='deflate'):
+    """ Stream the warped image into a tiled, compressed temporary file, then rename it
+    over tif_path, so an interrupted warp never leaves a partial band in place.
+    :return: seconds taken
+    """
+    start = time()
+    dst_dir, name = os.path.split(os.path.abspath(tif_path))
+    # not named .tif, so a temporary left by a killed run is never taken for a band
+    fd, temp = mkstemp(suffix='.tif.part', prefix='.{}.'.format(name), dir=dst_dir)
+    os.close(fd)
+
+    try:
+        with rasopen(tif_path, 'r') as src:
+            with WarpedVRT(src, **vrt_options) as vrt:
+                meta = vrt.meta.copy()
+                meta.update({'driver': 'GTiff', 'tiled': True,
+                             'blockxsize': BLOCK_SIZE, 'blockysize': BLOCK_SIZE})
+                if compress:
+                    meta.update({'compress': compress,
+                                 'predictor': PREDICTORS.get(src.dtypes[0][0], 1)})
+
+                with rasopen(temp, 'w', **meta) as dst:
+                    for row in range(0, vrt.height, BLOCK_SIZE):
+                        window = Window(0, row, vrt.width, min(BLOCK_SIZE, vrt.height - row))
+                        dst.write(vrt.read(window=window), window=window)
+        # mkstemp creates the file owner-only, keep the mode of the band it replaces
+        os.chmod(temp, S_IMODE(os.stat(tif_path).st_mode))
+        os.replace(temp, tif_path)
+
+    except BaseException:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+
+    return time() - start
+
+
+def _warp_or_skip(tif_path, vrt_options, compress='deflate'):
+    """ Warp tif_path unless it is already on the target grid.
+    :return: status ('warped' or 'skipped'), seconds taken
+    """
+    start = time()
+    with rasopen(tif_path, 'r') as src:
+        on_grid = (src.crs == CRS(vrt_options['crs']) and
+                   src.width == vrt_options['width'] and src.height == vrt_options['height'] and
+                   src.transform.almost_equals(vrt_options['transform']))
+    if on_grid:
+        return 'skipped', time() - start
+    return 'warped', _warp(tif_path, vrt_options, compress)
+
+
+def _run_warps(paths, vrt_options, workers=1, executor='process', done=None, compress='deflate'):
+    """ Warp each path, with a pool of workers if workers > 1.
+    :param done: called as done(path, status, seconds) as each file finishes
+    :return: OrderedDict of {path: seconds} in the order of paths
+    """
+    seconds = {}
+
+    if workers and workers > 1:
+        pools = {'process': ProcessPoolExecutor, 'thread': ThreadPoolExecutor}
+        if executor not in pools:
+            raise ValueError('{} is not a valid executor, use process or thread'.format(executor))
+        with pools[executor](max_workers=workers) as pool:
+            futures = dict((pool.submit(_warp_or_skip, path, vrt_options, compress), path) for path in paths)
+            for future in as_completed(futures):
+                path = futures[future]
+                status, seconds[path] = future.result()
+                if done:
+                    done(path, status, seconds[path])
+    else:
+        for path in paths:
+            status, seconds[path] = _warp_or_skip(path, vrt_options, compress)
+            if done:
+                done(path, status, seconds[path])
+
+    return OrderedDict((path, seconds[path]) for path in paths)
+
 
 if __name__ == '__main__':
     home = os.path.expanduser('~')
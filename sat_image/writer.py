@@ -0,0 +1,290 @@
+# =============================================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================================
+
+from __future__ import division
+
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from tempfile import mkstemp
+
+import numpy as np
+from rasterio import open as rasopen
+from rasterio import shutil as rio_shutil
+from rasterio.enums import Resampling
+
+from sat_image.warped_vrt import BLOCK_SIZE, PREDICTORS
+
+# product: (stored dtype, scale, offset), value = stored * scale + offset;
+# all int16, so any set of products can share one multi-band file
+SCALING = {'ndvi': ('int16', 0.0001, 0.),
+           'ndsi': ('int16', 0.0001, 0.),
+           'ndwi': ('int16', 0.0001, 0.),
+           'nbr': ('int16', 0.0001, 0.),
+           'savi': ('int16', 0.0001, 0.),
+           'evi': ('int16', 0.0001, 0.),
+           'albedo': ('int16', 0.0001, 0.),
+           'emissivity': ('int16', 0.0001, 0.),
+           'lai': ('int16', 0.001, 0.),
+           'lst': ('int16', 0.01, 300.)}
+
+
+class AsyncWriter(object):
+    ''' Writes in the background, so encoding and disk writes overlap with computation.
+
+    submit() hands a call to a pool of workers and returns at once, unless max_pending
+    calls are already queued or running, in which case it waits for one to finish; this
+    bounds the memory held by arrays waiting to be written. The first error raised by a
+    write is raised again by the next submit(), flush() or close().
+    Arrays are written as they are when the write runs, do not modify them after handing
+    them over. Use executor='thread' to write blocks into a dataset open in this process.
+
+    e.g.
+    with AsyncWriter(max_pending=2) as writer:
+        for image in images:
+            image.save_array(image.ndvi(), path, writer=writer)
+    '''
+
+    def __init__(self, max_pending=4, workers=1, executor='thread'):
+        pools = {'process': ProcessPoolExecutor, 'thread': ThreadPoolExecutor}
+        if executor not in pools:
+            raise ValueError('{} is not a valid executor, use process or thread'.format(executor))
+        self.executor = executor
+        self._pool = pools[executor](max_workers=workers)
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._errors = []
+
+    def submit(self, func, *args, **kwargs):
+        """ Run func(*args, **kwargs) in the background.
+        :return: concurrent.futures.Future
+        """
+        self._raise()
+        self._slots.acquire()
+        try:
+            future = self._pool.submit(func, *args, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._done)
+        return future
+
+    def write(self, arr, output_filename, profile, **kwargs):
+        """ write_geotiff in the background, see write_geotiff.
+        :return: concurrent.futures.Future
+        """
+        return self.submit(write_geotiff, arr, output_filename, profile, **kwargs)
+
+    def flush(self):
+        """ Wait for every submitted write, raising the first error. """
+        while True:
+            with self._lock:
+                pending = list(self._pending)
+            if not pending:
+                break
+            for future in pending:
+                future.exception()
+        self._raise()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self._pool.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            # keep the original error, do not mask it with a write error
+            self._pool.shutdown(wait=True)
+
+    def _done(self, future):
+        with self._lock:
+            self._pending.discard(future)
+            if not future.cancelled() and future.exception() is not None:
+                self._errors.append(future.exception())
+        self._slots.release()
+
+    def _raise(self):
+        with self._lock:
+            if self._errors:
+                error = self._errors[0]
+                del self._errors[:]
+                raise error
+
+
+def write_geotiff(arr, output_filename, profile, dtype=None, scale=None, offset=None, nodata=None,
+                  compress='deflate', predictor=None, tiled=True, blocksize=BLOCK_SIZE,
+                  bigtiff='IF_SAFER', overviews=None, cog=False, descriptions=None):
+    """ Write an array to a tiled, compressed GeoTIFF on the grid of profile.
+
+    profile is only read; the output profile is built from its crs and transform.
+    Floats are stored as integers when dtype is an integer type: stored = (value - offset) / scale,
+    rounded and clipped to the dtype, with nan stored as nodata; scale and offset are written
+    to the file so readers recover the values.
+    :param arr: array of shape (rows, cols) or (bands, rows, cols)
+    :param output_filename: path of the GeoTIFF
+    :param profile: dict with crs and transform, e.g. LandsatImage.rasterio_geometry
+    :param dtype: stored dtype, default that of arr (uint8 for boolean arrays)
+    :param scale: value of one stored unit, for integer dtype
+    :param offset: value of stored zero, for integer dtype
+    :param nodata: nodata value, default the dtype minimum when downcasting floats, else
+    the nodata of profile
+    :param compress: GTiff compression, e.g. 'deflate', 'lzw', 'zstd' or None
+    :param predictor: GTiff predictor, default 2 for integers and 3 for floats
+    :param tiled: write square tiles of blocksize rather than strips
+    :param blocksize: tile width and height, a multiple of 16
+    :param bigtiff: GDAL BIGTIFF option, 'IF_SAFER' switches to BigTIFF past 4 GB
+    :param overviews: iterable of decimation factors of internal overviews, e.g. (2, 4, 8)
+    :param cog: lay the file out as a Cloud-Optimized GeoTIFF, tiles and overviews first
+    :param descriptions: band descriptions
+    :return: output_filename
+    """
+    if arr.ndim == 2:
+        arr = arr[np.newaxis]
+    if arr.dtype == bool:
+        arr = arr.astype(np.uint8)
+    dtype = np.dtype(dtype or arr.dtype)
+
+    if dtype.kind in 'iu' and arr.dtype.kind == 'f':
+        nodata = downcast_nodata(dtype, nodata)
+        arr = downcast(arr, dtype, scale, offset, nodata)
+    elif nodata is None:
+        nodata = profile.get('nodata')
+
+    meta = geotiff_meta(dict(profile, height=arr.shape[1], width=arr.shape[2]), arr.shape[0],
+                        dtype, nodata, compress, predictor, tiled or cog, blocksize, bigtiff)
+    scales = None if scale is None and offset is None else [scale or 1.] * arr.shape[0]
+    offsets = None if scales is None else [offset or 0.] * arr.shape[0]
+
+    with staged(output_filename, meta, cog) as path:
+        with rasopen(path, 'w', **meta) as dst:
+            dst.write(arr.astype(meta['dtype'], copy=False))
+            finish(dst, scales, offsets, descriptions,
+                   overviews or (cog_overviews(arr.shape, blocksize) if cog else None))
+
+    return output_filename
+
+
+def geotiff_meta(profile, count, dtype, nodata=None, compress='deflate', predictor=None,
+                 tiled=True, blocksize=BLOCK_SIZE, bigtiff='IF_SAFER'):
+    """ Creation profile of a GeoTIFF on the grid of profile, see write_geotiff.
+    :param profile: dict with crs, transform, height and width
+    :param count: number of bands
+    :return: dict for rasterio.open
+    """
+    dtype = np.dtype(dtype)
+    meta = {'driver': 'GTiff', 'dtype': dtype.name, 'count': count,
+            'height': profile['height'], 'width': profile['width'],
+            'crs': profile['crs'], 'transform': profile['transform'], 'nodata': nodata,
+            'BIGTIFF': bigtiff}
+    if tiled:
+        meta.update({'tiled': True, 'blockxsize': blocksize, 'blockysize': blocksize})
+    if compress:
+        meta.update({'compress': compress, 'predictor': predictor or PREDICTORS.get(dtype.kind, 1)})
+    return meta
+
+
+def finish(dst, scales=None, offsets=None, descriptions=None, overviews=None):
+    """ Set band scales, offsets and descriptions of an open dataset and build its overviews. """
+    if scales is not None:
+        dst.scales = scales
+        dst.offsets = offsets
+    if descriptions:
+        for i, description in enumerate(descriptions, start=1):
+            dst.set_band_description(i, description)
+    if overviews:
+        # class codes are sampled, measured or scaled values averaged
+        if np.dtype(dst.dtypes[0]).kind == 'f' or scales is not None:
+            resampling = Resampling.average
+        else:
+            resampling = Resampling.nearest
+        dst.build_overviews(list(overviews), resampling)
+        dst.update_tags(ns='rio_overview', resampling=resampling.name)
+
+
+@contextmanager
+def staged(output_filename, meta, cog=False):
+    """ Path to write a GeoTIFF to; with cog, a temporary file copied to output_filename
+    in Cloud-Optimized layout, tiles and overviews first, when the block exits.
+    """
+    if not cog:
+        yield output_filename
+        return
+
+    fd, temp = mkstemp(suffix='.tif', dir=os.path.dirname(os.path.abspath(output_filename)))
+    os.close(fd)
+    try:
+        yield temp
+        options = dict((k, v) for k, v in meta.items()
+                       if k not in ['driver', 'dtype', 'count', 'height', 'width', 'crs',
+                                    'transform', 'nodata'])
+        rio_shutil.copy(temp, output_filename, driver='GTiff', copy_src_overviews=True, **options)
+    finally:
+        os.remove(temp)
+
+
+def downcast_nodata(dtype, nodata=None):
+    """ Nodata of floats stored as integers of dtype, default the dtype minimum. """
+    return np.iinfo(dtype).min if nodata is None else nodata
+
+
+def downcast(arr, dtype, scale=None, offset=None, nodata=None):
+    """ Float array stored as integers of dtype, (value - offset) / scale, nan as nodata.
+    :return: integer array
+    """
+    info = np.iinfo(dtype)
+    nodata = downcast_nodata(dtype, nodata)
+    scale = 1. if scale is None else scale
+    offset = 0. if offset is None else offset
+
+    missing = np.isnan(arr)
+    with np.errstate(invalid='ignore'):
+        stored = np.round((arr - offset) / scale)
+    # keep the nodata value out of the range of valid data
+    low, high = info.min, info.max
+    if nodata == info.min:
+        low += 1
+    elif nodata == info.max:
+        high -= 1
+    stored = np.clip(np.where(missing, 0, stored), low, high).astype(dtype)
+    stored[missing] = nodata
+    return stored
+
+
+def cog_overviews(shape, blocksize=BLOCK_SIZE):
+    """ Overview factors of a COG, powers of two down to the first level that fits in one tile.
+    :param shape: (bands, rows, cols)
+    """
+    factors, factor = [], 2
+    while max(shape[1:]) / (factor // 2) > blocksize:
+        factors.append(factor)
+        factor *= 2
+    return factors
+
+
+if __name__ == '__main__':
+    home = os.path.expanduser('~')
+
+# ========================= EOF ================================================================
@@ -0,0 +1,207 @@
+# =============================================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================================
+
+from __future__ import division
+
+import os
+import json
+import hashlib
+
+import numpy as np
+from fiona import open as fiopen
+from rasterio.crs import CRS
+from rasterio.features import rasterize
+from rasterio.warp import transform_geom
+from rasterio.windows import Window
+
+from sat_image.grid import grid_hash
+from sat_image.pipeline import cloud_mask, get_product
+
+STATS = ['count', 'mean', 'std', 'min', 'max']
+
+
+class ZoneIndex(object):
+    ''' Polygons rasterized once onto a grid, as an int32 label per pixel.
+
+    Label 0 is outside every polygon, label i + 1 is the polygon ids[i]; where polygons
+    overlap the later one wins. With a cache_dir the labels are saved, keyed by the grid
+    and the polygon source, and loaded by every later index of the same polygons and grid.
+    '''
+
+    def __init__(self, polygons, target, id_field=None, crs=None, cache_dir=None):
+        '''
+        :param polygons: path of a vector file readable by fiona, or iterable of GeoJSON-like
+        features
+        :param target: LandsatImage or profile dict with crs, transform, height and width
+        :param id_field: feature property used as zone id, default the feature index
+        :param crs: CRS of features given as an iterable, default the target CRS
+        :param cache_dir: directory of saved zone indices
+        '''
+        profile = getattr(target, 'rasterio_geometry', target)
+        self.profile = dict((k, profile[k]) for k in ['crs', 'transform', 'height', 'width'])
+        self.grid = grid_hash(self.profile)
+        self.path = None
+
+        if isinstance(polygons, str):
+            stat = os.stat(polygons)
+            source = [os.path.abspath(polygons), stat.st_size, stat.st_mtime, id_field]
+        else:
+            polygons = list(polygons)
+            source = [polygons, id_field, None if crs is None else CRS(crs).to_wkt()]
+        key = hashlib.sha1(json.dumps(source, sort_keys=True).encode('utf-8')).hexdigest()
+
+        if cache_dir:
+            self.path = os.path.join(cache_dir, 'zones_{}_{}.npz'.format(self.grid[:16], key[:16]))
+            if os.path.isfile(self.path):
+                with np.load(self.path) as cached:
+                    self.labels, self.ids = cached['labels'], cached['ids'].tolist()
+                return
+
+        features, crs = _features(polygons, crs)
+        self.ids = [f['properties'][id_field] if id_field else i for i, f in enumerate(features)]
+        geometries = [f['geometry'] for f in features]
+        if crs is not None and CRS(crs) != CRS(self.profile['crs']):
+            geometries = [transform_geom(crs, self.profile['crs'], g) for g in geometries]
+
+        shape = (self.profile['height'], self.profile['width'])
+        if geometries:
+            self.labels = rasterize(zip(geometries, range(1, len(geometries) + 1)), out_shape=shape,
+                                    transform=self.profile['transform'], fill=0, dtype='int32')
+        else:
+            self.labels = np.zeros(shape, dtype=np.int32)
+
+        if self.path:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            temp = '{}.{}.tmp'.format(self.path, os.getpid())
+            with open(temp, 'wb') as f:
+                np.savez(f, labels=self.labels, ids=np.array(self.ids))
+            os.replace(temp, self.path)
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def zonal_stats(image, zones, product='ndvi', stats=('count', 'mean', 'std'), percentiles=(),
+                source=None, layers='cloud_and_shadow', block_size=None, **kwargs):
+    """ Statistics of a product within each zone, in one vectorized pass over the pixels.
+
+    Pixels outside the image footprint, nan values and, with a mask source, cloudy pixels
+    are left out. With block_size the product is computed one window at a time and the
+    per-zone sums combined, which bounds memory but cannot give percentiles.
+    :param image: LandsatImage object, aligned to the zones' grid if it is not on it
+    :param zones: ZoneIndex
+    :param product: pipeline.get_product name
+    :param stats: iterable of STATS
+    :param percentiles: iterable of percentiles, 0 to 100, returned as 'p<q>'
+    :param source: if given, exclude cloudy pixels, see pipeline.cloud_mask
+    :param layers: mask layers, see pipeline.cloud_mask
+    :param block_size: window width and height in pixels, default the whole image at once
+    :param kwargs: passed to pipeline.cloud_mask
+    :return: dict of 'zone' ids and an array per statistic, nan for zones without a pixel;
+    std is the population standard deviation
+    """
+    for stat in stats:
+        if stat not in STATS:
+            raise ValueError('{} is not a valid statistic, choose from {}'.format(stat, STATS))
+    if percentiles and block_size:
+        raise ValueError('Percentiles need the whole image, use block_size=None')
+
+    if grid_hash(image.rasterio_geometry) != zones.grid:
+        image = image.align(zones.profile)
+
+    clear = None
+    if source:
+        clear = ~cloud_mask(image, source=source, layers=layers, **kwargs)
+
+    n = len(zones) + 1
+    # per-zone count, mean and sum of squared deviations (M2), combined block by block with
+    # Chan et al.'s parallel formula; raw sums of squares lose the spread of large values
+    count, mean, m2 = np.zeros(n), np.zeros(n), np.zeros(n)
+    low, high = np.full(n, np.inf), np.full(n, -np.inf)
+
+    height, width = zones.labels.shape
+    size = block_size or max(height, width)
+    for row in range(0, height, size):
+        for col in range(0, width, size):
+            window = Window(col, row, min(size, width - col), min(size, height - row))
+            view = image if block_size is None else image.windowed(window)
+            rows, cols = slice(row, row + int(window.height)), slice(col, col + int(window.width))
+
+            with view.caching():
+                values = get_product(view, product)
+                valid = (view.mask() > 0) & ~np.isnan(values) & (zones.labels[rows, cols] > 0)
+            if clear is not None:
+                valid &= clear[rows, cols]
+
+            labels, values = zones.labels[rows, cols][valid], values[valid].astype(np.float64)
+            block_count = np.bincount(labels, minlength=n)
+            seen = block_count > 0
+            block_mean = np.bincount(labels, weights=values, minlength=n).astype(np.float64)
+            block_mean[seen] /= block_count[seen]
+            block_m2 = np.bincount(labels, weights=(values - block_mean[labels]) ** 2, minlength=n)
+            combined = count + block_count
+            delta = block_mean[seen] - mean[seen]
+            mean[seen] += delta * block_count[seen] / combined[seen]
+            m2[seen] += block_m2[seen] + delta ** 2 * count[seen] * block_count[seen] / combined[seen]
+            count = combined
+            if len(labels) and ('min' in stats or 'max' in stats or percentiles):
+                order = np.lexsort((values, labels))
+                labels, values = labels[order], values[order]
+                first = np.r_[True, labels[1:] != labels[:-1]]
+                last = np.r_[labels[1:] != labels[:-1], True]
+                low[labels[first]] = np.minimum(low[labels[first]], values[first])
+                high[labels[last]] = np.maximum(high[labels[last]], values[last])
+
+    result = {'zone': zones.ids}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        summary = {'count': count,
+                   'mean': np.where(count > 0, mean, np.nan),
+                   'std': np.sqrt(m2 / count),
+                   'min': np.where(count > 0, low, np.nan),
+                   'max': np.where(count > 0, high, np.nan)}
+    for stat in stats:
+        result[stat] = summary[stat][1:]
+
+    if percentiles:
+        # values are sorted by zone, then value, so each zone's values are a contiguous run
+        starts = np.r_[0, np.cumsum(count)[:-1]].astype(int)
+        for q in percentiles:
+            position = starts + (count - 1) * q / 100.
+            below, above = np.floor(position).astype(int), np.ceil(position).astype(int)
+            fraction = position - below
+            safe = np.clip(np.stack([below, above]), 0, max(len(values) - 1, 0))
+            if len(values):
+                value = values[safe[0]] * (1 - fraction) + values[safe[1]] * fraction
+            else:
+                value = np.zeros(n)
+            result['p{}'.format(q)] = np.where(count > 0, value, np.nan)[1:]
+
+    return result
+
+
+def _features(polygons, crs=None):
+    """ Features and CRS of a vector file path or of an iterable of features. """
+    if isinstance(polygons, str):
+        with fiopen(polygons, 'r') as src:
+            return [dict(f) for f in src], src.crs_wkt or src.crs
+    return list(polygons), crs
+
+
+if __name__ == '__main__':
+    home = os.path.expanduser('~')
+
+# ========================= EOF ================================================================
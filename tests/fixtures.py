@@ -0,0 +1,45 @@
+# ===============================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+import os
+
+from rasterio.transform import Affine
+
+from sat_image.image import Landsat5, Landsat7, Landsat8
+
+DATA = os.path.join(os.path.dirname(__file__), 'data', 'fmask_test')
+
+SCENES = {'LT5': (Landsat5, 'lt5_fmask'),
+          'LE7': (Landsat7, 'le7_fmask'),
+          'LC8': (Landsat8, 'lc8_fmask')}
+
+
+def fmask_scenes(*satellites):
+    """ Fmask test scenes, in the order of satellites ('LT5', 'LE7', 'LC8'). """
+    return [SCENES[sat][0](os.path.join(DATA, SCENES[sat][1])) for sat in satellites]
+
+
+def shifted_profile(image, cols=3, rows=2, height=200, width=300):
+    """ Grid of the image shifted by whole pixels, cols east and rows south, height by width. """
+    geo = image.rasterio_geometry
+    return {'crs': geo['crs'], 'transform': geo['transform'] * Affine.translation(cols, rows),
+            'height': height, 'width': width}
+
+
+if __name__ == '__main__':
+    home = os.path.expanduser('~')
+
+# ===============================================================================
@@ -0,0 +1,74 @@
+# ===============================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+import os
+import shutil
+import unittest
+import warnings
+from tempfile import mkdtemp
+
+import numpy as np
+
+from sat_image.accumulator import PixelAccumulator
+from sat_image.stack import SceneStack
+from tests.fixtures import fmask_scenes, shifted_profile
+
+
+class PixelAccumulatorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp = mkdtemp()
+        self.images = fmask_scenes('LC8', 'LT5', 'LE7')
+        self.profile = shifted_profile(self.images[0])
+
+    def tearDown(self):
+        shutil.rmtree(self.temp)
+
+    def test_incremental(self):
+        path = os.path.join(self.temp, 'ndvi_stats.npz')
+        acc = PixelAccumulator(self.profile, 'ndvi', phenology=True)
+        for image in self.images:
+            self.assertTrue(acc.update(image))
+            acc.save(path)
+            acc = PixelAccumulator.load(path)
+        self.assertFalse(acc.update(self.images[0]))
+        self.assertEqual(len(acc.scenes), 3)
+
+        stack = SceneStack(self.images, target=self.profile)
+        ndvi = np.stack([np.where(image.mask() > 0, image.ndvi(), np.nan) for image in stack.images]).astype(np.float64)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            np.testing.assert_allclose(acc.mean(), np.nanmean(ndvi, axis=0), rtol=1e-9)
+            np.testing.assert_allclose(acc.variance(), np.nanvar(ndvi, axis=0, ddof=1), rtol=1e-7)
+            np.testing.assert_allclose(acc.max(), np.nanmax(ndvi, axis=0), rtol=1e-6)
+
+        full = np.all(~np.isnan(ndvi), axis=0)
+        self.assertTrue(full.any())
+        years = np.array([(d - stack.dates[0]).days / 365.25 for d in stack.dates])
+        slope, intercept = np.polyfit(years, ndvi[:, full], 1)
+        self.assertEqual(acc.origin, self.images[0].date_acquired.toordinal())
+        acc_slope, acc_intercept = acc.trend()
+        t0 = (stack.dates[0].toordinal() - acc.origin) / 365.25
+        np.testing.assert_allclose(acc_slope[full], slope, rtol=1e-6, atol=1e-9)
+        np.testing.assert_allclose(acc_intercept[full], intercept - slope * t0, rtol=1e-6, atol=1e-9)
+
+        doys = np.array([d.timetuple().tm_yday for d in stack.dates])
+        np.testing.assert_array_equal(acc.peak_doy()[full], doys[np.argmax(ndvi[:, full], axis=0)])
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
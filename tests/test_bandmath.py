@@ -0,0 +1,101 @@
+# ===============================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+import os
+import unittest
+from unittest import mock
+
+import numpy as np
+from rasterio.windows import Window
+
+from sat_image import image as image_module
+from sat_image.bandmath import BandMath
+from sat_image.buffers import BufferPool
+from sat_image.image import Landsat5, Landsat8
+
+DATA = os.path.join(os.path.dirname(__file__), 'data', 'fmask_test')
+
+
+class BandMathTestCase(unittest.TestCase):
+    def setUp(self):
+        self.l5 = Landsat5(os.path.join(DATA, 'lt5_fmask'))
+        self.l8 = Landsat8(os.path.join(DATA, 'lc8_fmask'))
+
+    def test_compile(self):
+        math = BandMath({'ndvi': '(b5 - b4) / (b5 + b4)',
+                         'savi': '(1 + 0.5) * (nir - red) / (red + nir + 0.5)',
+                         'twice': '2 * 3 * ((b5 - b4) / (b4 + b5))'}, sensor='LC8')
+        ops = [op for op, args in math.program]
+        # one read per band, nir - red and nir + red shared, and 1 + 0.5 and 2 * 3 folded
+        self.assertEqual(math.bands, ['b4', 'b5'])
+        self.assertEqual(ops.count('subtract'), 1)
+        self.assertEqual(ops.count('add'), 2)
+        self.assertEqual(ops.count('divide'), 2)
+        self.assertIn(('const', (6.0,)), math.program)
+        self.assertEqual(math.outputs['ndvi'], math.program.index(('divide', (2, 3))))
+
+        for bad in ['b5 +', 'b5 < b4', 'nir2 * 2', 'sqrt(b4, b5)', '__import__("os")', 'b4[0]']:
+            self.assertRaises(ValueError, BandMath, bad)
+        self.assertRaises(ValueError, BandMath, 'b4', sensor='LC9')
+
+    def test_evaluate(self):
+        for image, nir, red in [(self.l5, 'b4', 'b3'), (self.l8, 'b5', 'b4')]:
+            ndvi = '({0} - {1}) / ({0} + {1})'.format(nir, red)
+            with mock.patch.object(image_module, 'rasopen', wraps=image_module.rasopen) as opened:
+                results = image.band_math({'ndvi': ndvi,
+                                           'lai': 'min(7.0 * ((nir - red) / (nir + red)) ** 3, 6)',
+                                           'evi': '2.5 * (nir - red) / (nir + 6 * red - 7.5 * blue + 1)',
+                                           'red': red}, block_size=320)
+            # 2 x 2 blocks of three bands
+            self.assertEqual(opened.call_count, 4 * 3)
+            np.testing.assert_array_equal(results['ndvi'], image.ndvi())
+            np.testing.assert_array_equal(results['red'], image.reflectance(int(red[1:])))
+            np.testing.assert_allclose(results['evi'], image.evi(), rtol=1e-5, atol=1e-6)
+            np.testing.assert_allclose(results['lai'], image.lai(), rtol=1e-5, atol=1e-6)
+
+        bt = self.l8.band_math('b10 - 273.15', block_size=None)
+        np.testing.assert_allclose(bt, self.l8.brightness_temp(10) - 273.15, rtol=1e-6)
+        self.assertRaises(ValueError, BandMath('b4', sensor='LT5').evaluate, self.l8)
+
+    def test_divide_zero(self):
+        zero = self.l8.band_math(['b4 / (b4 - b4)', '-b4 / (b4 - b4)', '1 / 0'], replace=0.)
+        valid = ~np.isnan(self.l8.reflectance(4)) & (self.l8.reflectance(4) > 0)
+        self.assertTrue((zero['b4 / (b4 - b4)'][valid] == 0).all())
+        # as in _divide_zero, only positive infinity is replaced
+        self.assertTrue(np.isneginf(zero['-b4 / (b4 - b4)'][valid]).all())
+        self.assertTrue((zero['1 / 0'] == 0).all())
+        self.assertTrue(np.isnan(self.l8.band_math('b4 / (b4 - b4)')[valid]).all())
+
+    def test_temporaries(self):
+        math = BandMath('sqrt(abs((b4 + 1) * 2 - 3)) + (b5 - 1) * (b5 + 1)', sensor='LC8')
+        image = self.l8.windowed(Window(0, 0, 100, 100))
+        pool = BufferPool()
+        result = math.evaluate(image, block_size=None, pool=pool)
+        # the chain on b4 runs in place in one buffer, b5 - 1 and b5 + 1 need two more, and
+        # _get_band one mask; the sum is written straight into the result
+        self.assertEqual(pool.allocations, 4)
+        math.evaluate(image, block_size=None, pool=pool)
+        self.assertEqual(pool.allocations, 4)
+
+        b4, b5 = image.reflectance(4), image.reflectance(5)
+        np.testing.assert_allclose(result[math.expressions.popitem()[0]],
+                                   np.sqrt(np.abs((b4 + 1) * 2 - 3)) + (b5 - 1) * (b5 + 1), rtol=1e-5)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
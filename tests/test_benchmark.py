@@ -0,0 +1,113 @@
+# ===============================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+import os
+import shutil
+import unittest
+from tempfile import mkdtemp
+
+import numpy as np
+from rasterio import open as rasopen
+
+from sat_image.benchmark import CASES, report, run_benchmarks, run_case
+from sat_image.image import open_image
+from sat_image.synthetic import QUALITY, synthetic_scene, synthetic_scenes
+
+SHAPE = (240, 260)
+
+
+class SyntheticSceneTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_scenes(self):
+        for satellite, dtype in [('LT5', 'uint8'), ('LE7', 'uint8'), ('LC8', 'uint16')]:
+            image = open_image(synthetic_scene(self.root, satellite, SHAPE))
+            self.assertEqual(image.satellite, satellite)
+            self.assertEqual(image.shape, (1,) + SHAPE)
+            for band in image.band_list:
+                with rasopen(image.tif_dict[band]) as src:
+                    self.assertEqual(src.dtypes[0], dtype)
+                    pan = band == 'b8'
+                    self.assertEqual(src.shape, (2 * SHAPE[0], 2 * SHAPE[1]) if pan else SHAPE)
+                    dn = src.read(1)
+                # the tilted swath leaves a fill border in every corner
+                fill = QUALITY['fill'] if band == 'bqa' else 0
+                self.assertEqual(dn[0, 0], fill)
+                self.assertEqual(dn[-1, -1], fill)
+                self.assertGreater(dn[dn.shape[0] // 2, dn.shape[1] // 2], 0)
+
+            ndvi = image.ndvi()
+            valid = ~np.isnan(ndvi)
+            self.assertTrue(0.2 < valid.mean() < 0.9)
+            # water, and dense vegetation
+            self.assertLess(np.nanmin(ndvi), 0.)
+            self.assertGreater(np.nanmax(ndvi), 0.6)
+            red = image.reflectance(image.role_band('red'))
+            self.assertTrue(0. < np.nanmedian(red) < 0.4)
+            bt = image.brightness_temp(image.role_band('thermal'))
+            self.assertTrue(255. < np.nanmin(bt) < np.nanmax(bt) < 325.)
+
+    def test_reuse(self):
+        scene = synthetic_scene(self.root, 'LT5', SHAPE)
+        mtl = [f for f in os.listdir(scene) if f.endswith('MTL.txt')][0]
+        written = os.path.getmtime(os.path.join(scene, mtl))
+        self.assertEqual(synthetic_scene(self.root, 'LT5', SHAPE), scene)
+        self.assertEqual(os.path.getmtime(os.path.join(scene, mtl)), written)
+        self.assertRaises(ValueError, synthetic_scene, self.root, 'LO9', SHAPE)
+
+    def test_repeat_pass(self):
+        scenes = synthetic_scenes(self.root, ['LC8'], SHAPE, count=2)['LC8']
+        first, second = [open_image(scene) for scene in scenes]
+        self.assertEqual((second.date_acquired - first.date_acquired).days, 16)
+        self.assertNotEqual(first.transform, second.transform)
+
+
+class BenchmarkTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_run_benchmarks(self):
+        results = run_benchmarks(self.root, shape=SHAPE)
+        self.assertEqual(len(results), 3 * len(CASES))
+        self.assertEqual([r['case'] for r in results[:len(CASES)]], list(CASES))
+        for r in results:
+            self.assertEqual((r['lines'], r['samples']), SHAPE)
+            self.assertGreater(r['seconds'], 0.)
+            self.assertGreaterEqual(r['peak_mb'], 0.)
+        # a float32 band is read
+        band = [r for r in results if r['case'] == 'get_band'][0]
+        self.assertGreaterEqual(band['peak_mb'], SHAPE[0] * SHAPE[1] * 4 / 1e6)
+        self.assertEqual(len(report(results).splitlines()), len(results) + 1)
+
+    def test_run_case(self):
+        scenes = synthetic_scenes(self.root, ['LT5'], SHAPE)['LT5']
+        seconds, peak = run_case('ndvi', scenes, repeat=2)
+        self.assertGreater(seconds, 0.)
+        self.assertGreater(peak, 0)
+        self.assertRaises(ValueError, run_case, 'ndwi', scenes)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
@@ -0,0 +1,123 @@
+# ===============================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+import os
+import unittest
+import tracemalloc
+
+import numpy as np
+
+from sat_image.buffers import BufferPool
+from sat_image.image import Landsat5, Landsat8
+
+DATA = os.path.join(os.path.dirname(__file__), 'data', 'fmask_test')
+
+
+def peak_allocation(func, *args, **kwargs):
+    tracemalloc.start()
+    try:
+        func(*args, **kwargs)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+class BufferPoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.l5 = Landsat5(os.path.join(DATA, 'lt5_fmask'))
+        self.l8 = Landsat8(os.path.join(DATA, 'lc8_fmask'))
+
+    def test_pool(self):
+        pool = BufferPool()
+        a = pool.take((10, 20))
+        self.assertEqual((a.shape, a.dtype, pool.allocations), ((10, 20), np.float32, 1))
+        pool.give(a)
+        self.assertIs(pool.take((10, 20), 'float32'), a)
+        self.assertEqual(pool.take((10, 20), bool).dtype, bool)
+        self.assertEqual(pool.allocations, 2)
+
+        cached = np.zeros((10, 20), dtype=np.float32)
+        cached.flags.writeable = False
+        pool.give(a, cached)
+        self.assertEqual((len(pool), pool.nbytes), (1, a.nbytes))
+        pool.clear()
+        self.assertEqual(len(pool), 0)
+
+    def test_out(self):
+        for image in [self.l5, self.l8]:
+            expected = image.ndvi()
+            out = np.empty_like(expected)
+            self.assertIs(image.ndvi(out=out), out)
+            np.testing.assert_array_equal(out, expected)
+            with image.caching():
+                out[:] = 0
+                self.assertIs(image.ndvi(out=out), out)
+                np.testing.assert_array_equal(out, expected)
+                # the cache keeps its own, read-only result
+                self.assertFalse(image.ndvi().flags.writeable)
+                np.testing.assert_array_equal(image.ndvi(), expected)
+
+            arr = np.ones(expected.shape)
+            masked = image.mask_by_image(arr.copy())
+            self.assertIs(image.mask_by_image(arr, out=arr), arr)
+            np.testing.assert_array_equal(arr, masked)
+            np.testing.assert_array_equal(np.isnan(arr), np.isnan(image._get_band('b1')))
+
+    def test_hot_path_allocations(self):
+        image = self.l8
+        band_bytes = image.shape[1] * image.shape[2] * 4
+        fresh = peak_allocation(image.ndvi)
+
+        pool = BufferPool()
+        with image.pooled(pool):
+            ndvi = image.ndvi()
+            image.ndvi(out=ndvi)
+            allocations = pool.allocations
+            peak = peak_allocation(image.ndvi, out=ndvi)
+            image.mask_by_image(ndvi, out=ndvi)
+            masked = peak_allocation(image.mask_by_image, ndvi, out=ndvi)
+
+        # warm, the pool serves every temporary and no full band is allocated
+        self.assertEqual(pool.allocations, allocations)
+        self.assertLess(peak, band_bytes / 16)
+        self.assertLess(masked, band_bytes / 16)
+        self.assertGreater(fresh, 3 * band_bytes)
+        np.testing.assert_array_equal(ndvi, image.mask_by_image(image.ndvi()))
+
+    def test_product_out(self):
+        image = self.l5
+        band_bytes = image.shape[1] * image.shape[2] * 4
+        products = [('savi', {}), ('evi', {}), ('lai', {}), ('emissivity', {}),
+                    ('emissivity', {'approach': 'sobrino'}), ('land_surface_temp', {})]
+        pool = BufferPool()
+        for name, kwargs in products:
+            method = getattr(image, name)
+            expected = method(**kwargs)
+            with image.pooled(pool):
+                out = method(out=np.empty_like(expected), **kwargs)
+                np.testing.assert_array_equal(out, expected)
+                allocations = pool.allocations
+                # warm, every temporary comes from the pool
+                peak = peak_allocation(method, out=out, **kwargs)
+                self.assertEqual(pool.allocations, allocations, name)
+                self.assertLess(peak, band_bytes / 16, name)
+            np.testing.assert_array_equal(out, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
@@ -0,0 +1,76 @@
+# ===============================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+import os
+import shutil
+import unittest
+import warnings
+from tempfile import mkdtemp
+
+import numpy as np
+from rasterio import open as rasopen
+
+from sat_image.composite import composite
+from sat_image.pipeline import cloud_mask
+from tests.fixtures import fmask_scenes, shifted_profile
+
+
+class CompositeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp = mkdtemp()
+        self.images = fmask_scenes('LT5', 'LE7', 'LC8')
+        self.profile = shifted_profile(self.images[0])
+
+        aligned = [image.align(self.profile) for image in self.images]
+        self.clear = np.stack([~cloud_mask(image) & image.mask().astype(bool) for image in aligned])
+        self.ndvi = np.stack([image.ndvi() for image in aligned])
+
+    def tearDown(self):
+        shutil.rmtree(self.temp)
+
+    def test_median(self):
+        outfile = os.path.join(self.temp, 'median.tif')
+        composite(self.images, outfile, products=('ndvi',), target=self.profile, tile_size=128)
+        with rasopen(outfile, 'r') as src:
+            self.assertEqual(src.descriptions, ('ndvi', 'clear_count'))
+            ndvi, count = src.read()
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            expected = np.nanmedian(np.where(self.clear, self.ndvi, np.nan), axis=0)
+        np.testing.assert_array_equal(count, self.clear.sum(axis=0))
+        np.testing.assert_allclose(ndvi, expected, rtol=1e-6)
+        self.assertTrue(0 < np.count_nonzero(count < 3) < count.size)
+
+    def test_max_ndvi_workers(self):
+        serial, parallel = [os.path.join(self.temp, '{}.tif'.format(x)) for x in ['serial', 'parallel']]
+        composite(self.images, serial, products=('ndvi', 'albedo'), method='max_ndvi',
+                  target=self.profile, tile_size=128)
+        composite(self.images, parallel, products=('ndvi', 'albedo'), method='max_ndvi',
+                  target=self.profile, tile_size=128, workers=2)
+        with rasopen(serial, 'r') as a, rasopen(parallel, 'r') as b:
+            serial, parallel = a.read(), b.read()
+        np.testing.assert_array_equal(serial, parallel)
+
+        expected = np.nanmax(np.where(self.clear, self.ndvi, -np.inf), axis=0)
+        expected[np.isinf(expected)] = np.nan
+        np.testing.assert_allclose(serial[0], expected, rtol=1e-6)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
@@ -0,0 +1,76 @@
+# ===============================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+import os
+import shutil
+import unittest
+from tempfile import mkdtemp
+
+import numpy as np
+from rasterio.windows import Window
+
+from sat_image.cube import TimeSeriesCube, build_cube
+from sat_image.fmask import Fmask
+from sat_image.stack import SceneStack
+from tests.fixtures import fmask_scenes, shifted_profile
+
+
+class TimeSeriesCubeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp = mkdtemp()
+        self.path = os.path.join(self.temp, 'cube')
+        self.l5, self.l7, self.l8 = fmask_scenes('LT5', 'LE7', 'LC8')
+        self.profile = shifted_profile(self.l5)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp)
+
+    def test_build_and_append(self):
+        # two scenes per time block, the third scene starts a new block
+        cube = build_cube(self.path, [self.l8, self.l5], products=('ndvi', 'fmask'),
+                          target=self.profile, chunks=(2, 64, 64))
+        self.assertEqual(len(cube), 2)
+
+        cube = build_cube(self.path, [self.l5, self.l7, self.l8], products=('ndvi', 'fmask'))
+        self.assertEqual([x['scene'][:3] for x in cube.scenes], ['LT5', 'LC8', 'LE7'])
+
+        cube = TimeSeriesCube(self.path)
+        self.assertEqual([d.year for d in cube.dates], [1997, 2007, 2015])
+
+        ndvi = SceneStack([self.l5, self.l7, self.l8], target=self.profile).read('ndvi')
+        np.testing.assert_array_equal(cube.read('ndvi'), ndvi.astype(np.float32))
+
+        window = Window(70, 100, 90, 50)
+        np.testing.assert_array_equal(cube.read('ndvi', window), ndvi[:, 100:150, 70:160].astype(np.float32))
+
+        dates, values = cube.series('ndvi', 150, 250)
+        self.assertEqual(dates, cube.dates)
+        np.testing.assert_array_equal(values, ndvi[:, 150, 250].astype(np.float32))
+
+        # time innermost, the series of a pixel is contiguous in each time block; the first
+        # block holds LT5 and LC8, in the order stored
+        mm = cube._memmap('ndvi')
+        self.assertEqual(mm.shape, (2, 4, 5, 64, 64, 2))
+        np.testing.assert_array_equal(mm[0, 2, 3, 150 % 64, 250 % 64], values[[0, 2]])
+
+        classes = Fmask(self.l7.align(self.profile)).classify()
+        np.testing.assert_array_equal(cube.read('fmask')[1], classes)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
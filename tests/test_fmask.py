@@ -16,10 +16,11 @@
 
 import os
 import unittest
-from numpy import count_nonzero
+from unittest import mock
+from numpy import array, count_nonzero, array_equal, uint16
 
 from sat_image.image import Landsat5, Landsat7, Landsat8
-from sat_image.fmask import Fmask
+from sat_image.fmask import Fmask, triage, triage_report
 
 DATA = os.path.join(os.path.dirname(__file__), 'data')
 
@@ -42,6 +43,12 @@ class FmaskTestCaseL5(unittest.TestCase):
         self.assertEqual(s_ct, 37570)
         self.assertEqual(w_ct, 9423)
 
+    def test_parallel_cloud_layer(self):
+        serial = Fmask(self.image).cloud_mask()
+        parallel = Fmask(self.image, workers=2).cloud_mask()
+        for s, p in zip(serial, parallel):
+            self.assertTrue(array_equal(s, p))
+
 
 class FmaskTestCaseL7(unittest.TestCase):
     def setUp(self):
@@ -89,6 +96,40 @@ class FmaskTestCaseL8(unittest.TestCase):
         self.assertEqual(w_ct, 87399)
         self.assertEqual(combo_ct, 200182)
 
+    def test_qa_cloud_mask(self):
+        cloud, shadow, water = self.image.qa_cloud_mask()
+        self.assertEqual(cloud.shape, Fmask(self.image).cloud_mask()[0].shape)
+        self.assertEqual(count_nonzero(cloud), 54533)
+        self.assertEqual(count_nonzero(shadow), 52773)
+        self.assertEqual(count_nonzero(water), 0)
+        combo = self.image.qa_cloud_mask(combined=True)
+        self.assertEqual(count_nonzero(combo), 107306)
+
+    def test_qa_confidence(self):
+        def code(cloud=0, cloud_conf=1, shadow_conf=0, cirrus_conf=0):
+            return cloud << 4 | cloud_conf << 5 | shadow_conf << 7 | cirrus_conf << 11
+
+        # fill, clear, medium and high cloud, medium shadow, low and high cirrus
+        qa = array([[1, code(), code(cloud_conf=2), code(cloud=1, cloud_conf=3), code(shadow_conf=2),
+                     code(cirrus_conf=1), code(cirrus_conf=3)]], dtype=uint16)
+        expected = {'low': ([0, 0, 1, 1, 0, 1, 1], [0, 0, 0, 0, 1, 0, 0]),
+                    'medium': ([0, 0, 1, 1, 0, 0, 1], [0, 0, 0, 0, 1, 0, 0]),
+                    'high': ([0, 0, 0, 1, 0, 0, 1], [0, 0, 0, 0, 0, 0, 0])}
+        with mock.patch.object(self.image, 'quality', return_value=qa):
+            for confidence, (cloud, shadow) in expected.items():
+                c, s, w = self.image.qa_cloud_mask(confidence=confidence)
+                self.assertEqual(c[0].astype(int).tolist(), cloud, confidence)
+                self.assertEqual(s[0].astype(int).tolist(), shadow, confidence)
+                self.assertFalse(w.any())
+
+    def test_triage(self):
+        quick = triage(self.image, factor=4)
+        self.assertEqual(quick['mask'].shape, (156, 156))
+        report = triage_report(self.image, factor=4)
+        for layer in ['cloud', 'shadow', 'water', 'combined']:
+            self.assertAlmostEqual(report[layer]['full'], report[layer]['triage'], delta=0.02)
+            self.assertGreater(report[layer]['agreement'], 0.9)
+
 
 if __name__ == '__main__':
     unittest.main()
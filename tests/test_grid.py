@@ -0,0 +1,70 @@
+# ===============================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+import os
+import shutil
+import unittest
+from tempfile import mkdtemp
+
+from rasterio import open as rasopen
+
+from sat_image import warped_vrt
+from sat_image.grid import GridRegistry, scene_profile
+from sat_image.image import Landsat8
+
+DATA = os.path.join(os.path.dirname(__file__), 'data', 'vrt_test')
+
+
+class GridRegistryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp = mkdtemp()
+        self.directory = os.path.join(self.temp, 'vrt_test')
+        shutil.copytree(DATA, self.directory)
+        self.registry = GridRegistry(os.path.join(self.temp, 'grids', 'grids.json'))
+        self.second = os.path.join(self.directory, 'LC80390272015237LGN01')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp)
+
+    def test_register(self):
+        grid = self.registry.grid_for(self.second)
+        self.assertEqual((grid['height'], grid['width']), (435, 464))
+        self.assertEqual(list(GridRegistry(self.registry.path).grids), ['039_027'])
+
+        # the first registered grid for a path/row is kept
+        first = os.path.join(self.directory, 'LC80390272015221LGN02')
+        self.assertEqual(self.registry.grid_for(first)['transform'], grid['transform'])
+
+    def test_warp_to_registered_grid(self):
+        grid = self.registry.register(39, 27, scene_profile(self.second))
+        warped_vrt.warp_vrt(self.directory, registry=self.registry)
+        for d in sorted(os.listdir(self.directory)):
+            if d.startswith('LC8'):
+                tif = [x for x in os.listdir(os.path.join(self.directory, d)) if x.endswith('.TIF')][0]
+                with rasopen(os.path.join(self.directory, d, tif), 'r') as src:
+                    self.assertEqual(src.shape, (435, 464))
+                    self.assertTrue(src.transform.almost_equals(grid['transform']))
+
+    def test_align_to_registered_grid(self):
+        self.registry.register(39, 27, scene_profile(self.second))
+        image = Landsat8(os.path.join(self.directory, 'LC80390272015221LGN02'))
+        self.assertEqual(image.align(registry=self.registry).shape, (1, 435, 464))
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
@@ -95,6 +95,34 @@ class Landsat5TestCase(unittest.TestCase):
         bright = self.l5.brightness_temp(6)
         self.assertAlmostEqual(bright[self.cell], 298.55, delta=0.01)
 
+    def test_decimate(self):
+        coarse = self.l5.decimate(4)
+        self.assertEqual(coarse.shape, (1, 182, 182))
+        self.assertEqual(coarse.reflectance(1).shape, (182, 182))
+        self.assertAlmostEqual(coarse.transform.a, 30.0 * 727 / 182, delta=1e-6)
+        self.assertEqual(self.l5.reflectance(1).shape, (727, 727))
+
+    def test_sample_points(self):
+        rows, cols = np.array([5, 40, 41, 600, 700, 726]), np.array([700, 3, 300, 299, 10, 726])
+        xs, ys = self.l5.transform * (cols + 0.5, rows + 0.5)
+        points = list(zip(xs, ys)) + [(0., 0.)]
+        records = self.l5.sample_points(points, products=('ndvi', 'albedo'), block_size=256)
+        self.assertEqual(len(records), 12)
+
+        ndvi, albedo = self.l5.ndvi(), self.l5.albedo()
+        for record in records:
+            expected = ndvi if record['product'] == 'ndvi' else albedo
+            i = record['point']
+            self.assertEqual((record['row'], record['col']), (rows[i], cols[i]))
+            np.testing.assert_equal(record['value'], expected[rows[i], cols[i]])
+
+    def test_sample_points_outside(self):
+        x, y = self.l5.transform * (0.5, 0.5)
+        outside = [(0., 0.), (x - 1e5, y), (x, y + 1e5)]
+        self.assertEqual(self.l5.sample_points(outside), [])
+        records = self.l5.sample_points(outside + [(x, y)], ids=['a', 'b', 'c', 'd'])
+        self.assertEqual([(r['point'], r['row'], r['col']) for r in records], [('d', 0, 0)])
+
     def test_albedo(self):
         albedo = self.l5.albedo()[self.cell]
         # inputs for self.cell toa reflect b 1, 3, 4, 5, 7
@@ -258,6 +286,18 @@ class Landsat8TestCase(unittest.TestCase):
         ndsi_exp = (b3 - b6) / (b3 + b6)
         self.assertEqual(ndsi, ndsi_exp)
 
+    def test_emissivity_sobrino(self):
+        l8 = Landsat8(self.dirname_cloud)
+        ndvi = l8.ndvi()
+        emissivity = l8.emissivity(approach='sobrino')
+        # below ndvi 0.2 the emissivity is the red reflectance, OLI band 4
+        low = ndvi < 0.2
+        self.assertTrue(np.any(low))
+        np.testing.assert_array_equal(emissivity[low], l8.reflectance(4)[low])
+        mid = (ndvi >= 0.2) & (ndvi <= 0.5)
+        pv = ((ndvi[mid] - 0.2) / (0.5 - 0.2)) ** 2
+        np.testing.assert_allclose(emissivity[mid], 0.004 * pv + 0.986, rtol=1e-6)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,77 @@
+# ===============================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+import os
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from sat_image import image as image_module
+from sat_image.image import Landsat5, Landsat7, Landsat8
+from sat_image.indices import INDICES, index_bands, spectral_indices
+
+DATA = os.path.join(os.path.dirname(__file__), 'data', 'fmask_test')
+
+
+class SpectralIndicesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.images = [Landsat5(os.path.join(DATA, 'lt5_fmask')),
+                       Landsat7(os.path.join(DATA, 'le7_fmask')),
+                       Landsat8(os.path.join(DATA, 'lc8_fmask'))]
+
+    def test_roles(self):
+        l5, l7, l8 = self.images
+        self.assertEqual([l5.role_band('red'), l7.role_band('red'), l8.role_band('red')], [3, 3, 4])
+        self.assertEqual(l8.role_band('thermal'), 10)
+        self.assertEqual(index_bands(l8, ['ndvi', 'nbr']), ['b4', 'b5', 'b7'])
+        self.assertRaises(ValueError, l5.role_band, 'red_edge')
+
+    def test_formulas(self):
+        for image in self.images:
+            blue, green, red, nir, swir2 = [image.reflectance(image.role_band(r)).astype(np.float64)
+                                            for r in ['blue', 'green', 'red', 'nir', 'swir2']]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                expected = {'ndwi': (green - nir) / (green + nir),
+                            'nbr': (nir - swir2) / (nir + swir2),
+                            'savi': 1.5 * (nir - red) / (nir + red + 0.5),
+                            'evi': 2.5 * (nir - red) / (nir + 6 * red - 7.5 * blue + 1)}
+            for index, values in expected.items():
+                np.testing.assert_allclose(getattr(image, index)(), values, rtol=1e-4, atol=1e-5)
+
+    def test_spectral_indices(self):
+        indices = sorted(INDICES)
+        for image in self.images:
+            with mock.patch.object(image_module, 'rasopen', wraps=image_module.rasopen) as opened:
+                results = image.spectral_indices(indices, block_size=320)
+            # 2 x 2 blocks, each of the six reflective bands read once
+            self.assertEqual(opened.call_count, 4 * 6)
+
+            for index in indices:
+                self.assertEqual(results[index].dtype, np.float32)
+                np.testing.assert_array_equal(results[index], getattr(image, index)())
+
+        prefetched = spectral_indices(image, ['ndvi', 'lai'], block_size=200, prefetch=2)
+        np.testing.assert_array_equal(prefetched['lai'], results['lai'])
+        decimated = spectral_indices(image.decimate(4), ['ndvi'])
+        np.testing.assert_array_equal(decimated['ndvi'], image.decimate(4).ndvi())
+        self.assertRaises(ValueError, spectral_indices, image, ['ndvi', 'gndvi'])
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
@@ -0,0 +1,106 @@
+# ===============================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+import os
+import json
+import shutil
+import unittest
+from tempfile import mkdtemp
+
+import numpy as np
+from rasterio import open as rasopen
+from rasterio.enums import Resampling
+from rasterio.transform import Affine
+from rasterio.vrt import WarpedVRT
+
+from sat_image.composite import write_clear_mask
+from sat_image.image import Landsat5, Landsat7, Landsat8
+from sat_image.mosaic import mosaic
+
+DATA = os.path.join(os.path.dirname(__file__), 'data', 'fmask_test')
+
+
+class MosaicTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp = mkdtemp()
+        self.images = [Landsat8(os.path.join(DATA, 'lc8_fmask')),
+                       Landsat5(os.path.join(DATA, 'lt5_fmask')),
+                       Landsat7(os.path.join(DATA, 'le7_fmask'))]
+        # regional grid reaching 256 columns west and 128 rows north of the scenes
+        self.profile = {'crs': self.images[0].rasterio_geometry['crs'],
+                        'transform': Affine(30.0, 0.0, 713835.0 - 256 * 30, 0.0, -30.0, 5292525.0 + 128 * 30),
+                        'height': 800, 'width': 900}
+        self.aligned = [image.align(self.profile) for image in self.images]
+
+    def tearDown(self):
+        shutil.rmtree(self.temp)
+
+    def test_recent(self):
+        outfile = os.path.join(self.temp, 'recent.tif')
+        mosaic(self.images, outfile, self.profile, rule='recent', tile_size=128)
+        with rasopen(outfile, 'r') as src:
+            ndvi, scene = src.read()
+            scenes = json.loads(src.tags()['scenes'])
+        self.assertEqual([x[:3] for x in scenes], ['LC8', 'LT5', 'LE7'])
+
+        expected = np.full(ndvi.shape, np.nan, dtype=np.float32)
+        expected_scene = np.zeros(ndvi.shape)
+        for i in [1, 2, 0]:
+            valid = self.aligned[i].mask() > 0
+            expected[valid] = self.aligned[i].ndvi()[valid]
+            expected_scene[valid] = i + 1
+        np.testing.assert_array_equal(ndvi, expected)
+        np.testing.assert_array_equal(scene, expected_scene)
+        self.assertTrue(np.all(scene[:128, :] == 0))
+
+    def test_max_ndvi_clouds(self):
+        outfile = os.path.join(self.temp, 'max_ndvi.tif')
+        mosaic(self.images, outfile, self.profile, rule='max_ndvi', source='fmask', tile_size=256)
+        with rasopen(outfile, 'r') as src:
+            ndvi, scene = src.read()
+
+        stacked = np.stack([image.ndvi() for image in self.aligned])
+        chosen = scene > 0
+        picked = stacked[scene[chosen].astype(int) - 1, np.nonzero(chosen)[0], np.nonzero(chosen)[1]]
+        np.testing.assert_array_equal(ndvi[chosen], picked)
+
+        # the pick is the highest NDVI among the scenes clear at the pixel
+        clear = np.stack([self._clear(image, aligned) for image, aligned in zip(self.images, self.aligned)])
+        np.testing.assert_array_equal(chosen, clear.any(axis=0))
+        score = np.where(clear & ~np.isnan(stacked), stacked, -np.inf)
+        np.testing.assert_array_equal(ndvi[chosen], score[:, chosen].max(axis=0))
+
+        outfile = os.path.join(self.temp, 'least_cloudy.tif')
+        mosaic(self.images, outfile, self.profile, rule='least_cloudy', tile_size=256)
+        with rasopen(outfile, 'r') as src:
+            least_cloudy = src.read(2)
+        valid = np.stack([image.mask() > 0 for image in self.aligned])
+        np.testing.assert_array_equal(least_cloudy > 0, valid.any(axis=0))
+        self.assertEqual(len(np.unique(least_cloudy[valid.all(axis=0)])), 1)
+        self.assertTrue(np.count_nonzero(chosen) < np.count_nonzero(valid.any(axis=0)))
+
+    def _clear(self, image, aligned):
+        path = write_clear_mask(image, self.temp, 'fmask', 'cloud_and_shadow', 1)
+        grid = dict((k, self.profile[k]) for k in ['crs', 'transform', 'height', 'width'])
+        with rasopen(path, 'r') as src:
+            with WarpedVRT(src, resampling=Resampling.nearest, **grid) as vrt:
+                return vrt.read(1).astype(bool) & (aligned.mask() > 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
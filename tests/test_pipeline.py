@@ -0,0 +1,99 @@
+# ===============================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+import os
+import shutil
+import unittest
+from tempfile import mkdtemp
+from unittest import mock
+
+import numpy as np
+from rasterio import open as rasopen
+
+from sat_image import image as image_module
+from sat_image.image import Landsat5
+from sat_image.fmask import Fmask
+from sat_image.pipeline import cloud_mask, export_products, masked_products
+
+DATA = os.path.join(os.path.dirname(__file__), 'data')
+
+
+class PipelineTestCase(unittest.TestCase):
+    def setUp(self):
+        self.image = Landsat5(os.path.join(DATA, 'fmask_test', 'lt5_fmask'))
+
+    def test_masked_products(self):
+        mask = Fmask(self.image).cloud_mask(cloud_and_shadow=True)
+        ndvi = np.where(mask, np.nan, self.image.ndvi())
+        lst = np.where(mask, np.nan, self.image.land_surface_temp())
+
+        with mock.patch.object(image_module, 'rasopen', wraps=image_module.rasopen) as opened:
+            products = masked_products(self.image, products=('ndvi', 'lst'))
+
+        # each of the seven LT5 bands is read once
+        self.assertEqual(opened.call_count, 7)
+        np.testing.assert_array_equal(products['ndvi'], ndvi)
+        np.testing.assert_array_equal(products['lst'], lst)
+        self.assertIsNone(self.image._cache)
+
+    def test_qa_source(self):
+        # only Landsat 8 has a quality band
+        self.assertRaises(ValueError, cloud_mask, self.image, source='qa')
+        self.assertRaises(ValueError, masked_products, self.image, source='qa')
+        self.assertRaises(ValueError, cloud_mask, self.image, source='bqa')
+
+    def test_export_products(self):
+        temp = mkdtemp()
+        products = ('ndvi', 'albedo', 'lst')
+        try:
+            outfile = os.path.join(temp, 'products.tif')
+            with mock.patch.object(image_module, 'rasopen', wraps=image_module.rasopen) as opened:
+                self.image.export_products(outfile, products, block_size=256)
+            # 3 x 3 blocks, each reading the six reflective and thermal bands once
+            self.assertEqual(opened.call_count, 9 * 6)
+
+            prefetched = os.path.join(temp, 'prefetched.tif')
+            with mock.patch.object(image_module, 'rasopen', wraps=image_module.rasopen) as opened:
+                self.image.export_products(prefetched, products, block_size=256, prefetch=2)
+            # only the small pilot window that finds the bands; blocks come from the read-ahead
+            self.assertEqual(opened.call_count, 6)
+            with rasopen(outfile, 'r') as src, rasopen(prefetched, 'r') as prefetched_src:
+                np.testing.assert_array_equal(src.read(), prefetched_src.read())
+
+            scaled = os.path.join(temp, 'scaled.tif')
+            export_products(self.image, scaled, products, scaled=True, cog=True)
+
+            with rasopen(outfile, 'r') as src, rasopen(scaled, 'r') as scaled_src:
+                self.assertEqual(src.descriptions, products)
+                self.assertEqual(scaled_src.dtypes[0], 'int16')
+                self.assertEqual(scaled_src.overviews(1), [2, 4])
+                for band, product in enumerate(products, start=1):
+                    expected = getattr(self.image, {'lst': 'land_surface_temp'}.get(product, product))()
+                    np.testing.assert_array_equal(src.read(band), expected.astype(np.float32))
+                    stored = scaled_src.read(band)
+                    values = stored * scaled_src.scales[band - 1] + scaled_src.offsets[band - 1]
+                    valid = stored != scaled_src.nodata
+                    np.testing.assert_array_equal(valid, ~np.isnan(expected))
+                    np.testing.assert_allclose(values[valid], expected[valid],
+                                               atol=scaled_src.scales[band - 1] / 2 + 1e-6)
+        finally:
+            shutil.rmtree(temp)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
@@ -0,0 +1,69 @@
+# ===============================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+import os
+import unittest
+from unittest import mock
+
+import numpy as np
+from rasterio.windows import Window
+
+from sat_image import image as image_module
+from sat_image.image import Landsat5, Landsat8
+from sat_image.prefetch import band_reads
+
+DATA = os.path.join(os.path.dirname(__file__), 'data', 'fmask_test')
+
+
+class PrefetchReaderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.l5 = Landsat5(os.path.join(DATA, 'lt5_fmask'))
+        self.l8 = Landsat8(os.path.join(DATA, 'lc8_fmask'))
+
+    def test_band_reads(self):
+        self.assertEqual(band_reads(self.l5, ['ndvi']), ['b3', 'b4'])
+        self.assertEqual(band_reads(self.l8, ['ndvi', 'ndsi']), ['b3', 'b4', 'b5', 'b6'])
+
+    def test_prefetch(self):
+        ndvi, lst = self.l5.ndvi(), self.l5.land_surface_temp()
+        reader = self.l5.prefetch(block_size=200, products=('ndvi', 'lst'), depth=2)
+        self.assertEqual(len(reader), 16)
+
+        seen = np.zeros(ndvi.shape, dtype=bool)
+        with mock.patch.object(image_module, 'rasopen', wraps=image_module.rasopen) as opened:
+            for window, view in reader:
+                rows, cols = window.toslices()
+                np.testing.assert_array_equal(view.ndvi(), ndvi[rows, cols])
+                np.testing.assert_array_equal(view.land_surface_temp(), lst[rows, cols])
+                seen[rows, cols] = True
+        # every band came from the read-ahead buffers
+        self.assertEqual(opened.call_count, 0)
+        self.assertTrue(seen.all())
+
+    def test_windowed_and_early_stop(self):
+        base = self.l8.windowed(Window(100, 50, 300, 250))
+        ndvi = base.ndvi()
+        for i, (window, view) in enumerate(base.prefetch(block_size=128, products=('ndvi',), depth=1)):
+            rows, cols = window.toslices()
+            np.testing.assert_array_equal(view.ndvi(), ndvi[rows, cols])
+            if i == 2:
+                break
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
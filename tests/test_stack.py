@@ -0,0 +1,55 @@
+# ===============================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+import unittest
+
+import numpy as np
+from rasterio.windows import Window
+
+from sat_image.stack import SceneStack
+from tests.fixtures import fmask_scenes, shifted_profile
+
+
+class SceneStackTestCase(unittest.TestCase):
+    def setUp(self):
+        self.l5, self.l7, self.l8 = fmask_scenes('LT5', 'LE7', 'LC8')
+        # grid shifted by whole pixels, 3 columns east and 2 rows south
+        self.profile = shifted_profile(self.l5)
+
+    def test_align(self):
+        aligned = self.l5.align(self.profile)
+        self.assertEqual(aligned.shape, (1, 200, 300))
+        np.testing.assert_array_equal(aligned.ndvi(), self.l5.ndvi()[2:202, 3:303])
+
+        window = Window(50, 20, 64, 32)
+        np.testing.assert_array_equal(aligned.windowed(window).ndvi(),
+                                      self.l5.ndvi()[22:54, 53:117])
+
+    def test_stack(self):
+        stack = SceneStack([self.l8, self.l5, self.l7], target=self.profile)
+        self.assertEqual([d.year for d in stack.dates], [1997, 2007, 2015])
+        ndvi = stack.read('ndvi')
+        self.assertEqual(ndvi.shape, (3, 200, 300))
+        window = list(stack.windows(128))[4]
+        np.testing.assert_array_equal(stack.read('ndvi', window),
+                                      ndvi[:, window.row_off:window.row_off + window.height,
+                                           window.col_off:window.col_off + window.width])
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
@@ -0,0 +1,112 @@
+# ===============================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+import os
+import unittest
+import tracemalloc
+
+import numpy as np
+
+from sat_image.image import Landsat5, Landsat7, Landsat8
+from sat_image.tasumi import (TASUMI_COEFFICIENTS, TASUMI_ROLES, TASUMI_WEIGHTS,
+                              surface_coefficients, tasumi_albedo)
+
+DATA = os.path.join(os.path.dirname(__file__), 'data', 'fmask_test')
+
+
+def peak_allocation(func, *args, **kwargs):
+    tracemalloc.start()
+    try:
+        func(*args, **kwargs)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+class TasumiTestCase(unittest.TestCase):
+    def setUp(self):
+        self.images = [Landsat5(os.path.join(DATA, 'lt5_fmask')),
+                       Landsat7(os.path.join(DATA, 'le7_fmask')),
+                       Landsat8(os.path.join(DATA, 'lc8_fmask'))]
+
+    def test_surface_coefficients(self):
+        cos_z, z, ea = 0.8, 1000., 1.2
+        pressure = 101.3 * ((293. - 0.0065 * z) / 293.) ** 5.26
+        water = 0.14 * ea * pressure + 2.1
+        for role in TASUMI_ROLES:
+            c1, c2, c3, c4, c5, cb = TASUMI_COEFFICIENTS[role]
+            tau_in = c1 * np.exp(c2 * pressure / cos_z - (c3 * water + c4) / cos_z) + c5
+            tau_out = c1 * np.exp(c2 * pressure - (c3 * water + c4)) + c5
+            scale, offset = surface_coefficients(role, cos_z, z, ea)
+            toa = 0.3
+            self.assertAlmostEqual(scale * toa + offset, (toa - cb * (1 - tau_in)) / (tau_in * tau_out))
+            self.assertTrue(0.5 < tau_in < 1.)
+
+        scale, offset = surface_coefficients('red', cos_z, np.array([0., 1000., 3000.]), ea)
+        self.assertEqual(scale.shape, (3,))
+        self.assertAlmostEqual(scale[1], surface_coefficients('red', cos_z, 1000., ea)[0])
+
+    def test_albedo(self):
+        for image in self.images:
+            albedo = image.albedo(model='tasumi', elevation=800., vapor_pressure=0.8)
+            expected = sum(TASUMI_WEIGHTS[role] *
+                           image.surface_reflectance(image.role_band(role), 800., 0.8).astype(np.float64)
+                           for role in TASUMI_ROLES)
+            self.assertEqual(albedo.dtype, np.float32)
+            np.testing.assert_allclose(albedo, expected, rtol=1e-5, atol=1e-6)
+            valid = ~np.isnan(albedo)
+            self.assertTrue(0.05 < albedo[valid].mean() < 0.5)
+        self.assertRaises(ValueError, image.albedo, model='liang')
+        self.assertRaises(ValueError, image.surface_reflectance, 10)
+
+    def test_elevation(self):
+        image = self.images[2]
+        height, width = image.shape[1:]
+        elevation = np.linspace(0., 3000., height * width).reshape(height, width)
+        albedo = tasumi_albedo(image, elevation, block_size=256)
+        np.testing.assert_allclose(albedo, image.albedo(model='tasumi', elevation=elevation), rtol=1e-6)
+        # less atmosphere above high ground, a smaller correction
+        low, high = image.albedo(model='tasumi'), image.albedo(model='tasumi', elevation=3000.)
+        valid = ~np.isnan(low)
+        self.assertGreater(np.abs(low - high)[valid].mean(), 0.)
+        with image.caching():
+            np.testing.assert_array_equal(image.albedo(model='tasumi', elevation=elevation),
+                                          image.albedo(model='tasumi', elevation=elevation))
+        self.assertRaises(ValueError, tasumi_albedo, image, elevation[1:])
+
+    def test_smith_out(self):
+        image = self.images[0]
+        band_bytes = image.shape[1] * image.shape[2] * 4
+        expected = image.albedo()
+        out = np.empty_like(expected)
+        with image.pooled():
+            image.albedo(out=out)
+            # warm, the bands and the term are pooled and out is the accumulator
+            self.assertLess(peak_allocation(image.albedo, out=out), band_bytes / 16)
+        np.testing.assert_allclose(out, expected, rtol=1e-6)
+
+    def test_temporaries(self):
+        image = self.images[2]
+        band_bytes = image.shape[1] * image.shape[2] * 4
+        # both accumulate into the result through one pooled term
+        self.assertLessEqual(peak_allocation(image.albedo, model='tasumi'),
+                             peak_allocation(image.albedo, model='smith') + band_bytes / 16)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
@@ -0,0 +1,77 @@
+# ===============================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+import os
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from sat_image import image as image_module
+from sat_image.image import Landsat5, Landsat8
+from sat_image.thermal import SPLIT_WINDOW, thermal_bands, thermal_products, tirs_emissivity
+
+DATA = os.path.join(os.path.dirname(__file__), 'data', 'fmask_test')
+
+
+class ThermalTestCase(unittest.TestCase):
+    def setUp(self):
+        self.l5 = Landsat5(os.path.join(DATA, 'lt5_fmask'))
+        self.l8 = Landsat8(os.path.join(DATA, 'lc8_fmask'))
+
+    def test_tirs_emissivity(self):
+        e10, e11 = tirs_emissivity(np.array([-0.1, 0.1, 0.35, 0.8], dtype=np.float32))
+        np.testing.assert_allclose(e10, [0.991, 0.971, 0.971 + 0.016 * 0.25, 0.987], rtol=1e-6)
+        np.testing.assert_allclose(e11, [0.986, 0.977, 0.977 + 0.012 * 0.25, 0.989], rtol=1e-6)
+
+    def test_split_window(self):
+        lst = self.l8.split_window_lst(water_vapor=1.5)
+        bt10, bt11 = [self.l8.brightness_temp(b).astype(np.float64) for b in [10, 11]]
+        e10, e11 = tirs_emissivity(self.l8.ndvi().astype(np.float64))
+        c0, c1, c2, c3, c4, c5, c6 = SPLIT_WINDOW
+        w = 1.5
+        expected = (bt10 + c1 * (bt10 - bt11) + c2 * (bt10 - bt11) ** 2 + c0 +
+                    (c3 + c4 * w) * (1 - (e10 + e11) / 2) + (c5 + c6 * w) * (e10 - e11))
+        self.assertEqual(lst.dtype, np.float32)
+        np.testing.assert_allclose(lst, expected, rtol=1e-5)
+        valid = ~np.isnan(lst)
+        self.assertLess(np.abs(lst[valid] - self.l8.land_surface_temp()[valid]).mean(), 5.)
+
+    def test_thermal_products(self):
+        products = ['bt', 'bt11', 'emissivity', 'lst', 'lst_split']
+        self.assertEqual(thermal_bands(self.l8, products), ['b10', 'b11', 'b4', 'b5'])
+        with mock.patch.object(image_module, 'rasopen', wraps=image_module.rasopen) as opened:
+            results = self.l8.thermal_products(products, block_size=320)
+        # 2 x 2 blocks, each of the four bands read once
+        self.assertEqual(opened.call_count, 4 * 4)
+
+        np.testing.assert_array_equal(results['bt'], self.l8.brightness_temp(10))
+        np.testing.assert_array_equal(results['bt11'], self.l8.brightness_temp(11))
+        np.testing.assert_array_equal(results['emissivity'], self.l8.emissivity())
+        np.testing.assert_array_equal(results['lst'], self.l8.land_surface_temp())
+        np.testing.assert_array_equal(results['lst_split'], self.l8.split_window_lst())
+
+        l5 = thermal_products(self.l5, ['bt', 'lst'], block_size=200, prefetch=2)
+        np.testing.assert_array_equal(l5['bt'], self.l5.brightness_temp(6))
+        np.testing.assert_array_equal(l5['lst'], self.l5.land_surface_temp())
+        self.assertRaises(ValueError, thermal_products, self.l5, ['lst_split'])
+        self.assertRaises(ValueError, thermal_products, self.l8, ['lst10'])
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
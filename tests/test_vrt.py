@@ -16,11 +16,17 @@
 import os
 import unittest
 import shutil
+from collections import OrderedDict
+from io import StringIO
+from tempfile import mkdtemp
+from unittest import mock
 
 from rasterio import open as rasopen
 
 from sat_image import warped_vrt
 
+DATA = os.path.join(os.path.dirname(__file__), 'data')
+
 
 class MyTestCase(unittest.TestCase):
     def setUp(self):
@@ -44,6 +50,88 @@ class MyTestCase(unittest.TestCase):
         self.assertEqual(shapes[0], shapes[1])
 
 
+class ParallelWarpTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = os.path.join(mkdtemp(), 'vrt_test')
+        shutil.copytree(os.path.join(DATA, 'vrt_test'), self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(os.path.dirname(self.directory))
+
+    def test_parallel_warp(self):
+        progress = []
+        timings = warped_vrt.warp_vrt(self.directory, workers=2, executor='thread',
+                                      callback=lambda *args: progress.append(args))
+        self.assertEqual(len(timings), 2)
+        self.assertEqual(list(timings), sorted(timings))
+        self.assertEqual(sorted(p[0] for p in progress), list(timings))
+        self.assertEqual(sorted(p[2] for p in progress), [1, 2])
+
+        shapes = []
+        for tif in timings:
+            with rasopen(tif, 'r') as src:
+                shapes.append(src.shape)
+        self.assertEqual(shapes, [(377, 397), (377, 397)])
+
+    def test_streamed_output(self):
+        scene = os.path.join(self.directory, 'LC80390272015237LGN01')
+        tif = os.path.join(scene, 'LC08_L1TP_039027_20150825_20170225_01_T1_B3.TIF')
+        before = sorted(os.listdir(scene))
+        with rasopen(tif, 'r') as src:
+            original = src.read()
+
+        with mock.patch.object(warped_vrt.WarpedVRT, 'read', side_effect=IOError('interrupted')):
+            self.assertRaises(IOError, warped_vrt.warp_vrt, self.directory)
+        with rasopen(tif, 'r') as src:
+            self.assertTrue((src.read() == original).all())
+        self.assertEqual(sorted(os.listdir(scene)), before)
+
+        warped_vrt.warp_vrt(self.directory, overwrite=True, compress='lzw', num_threads=2)
+        with rasopen(tif, 'r') as src:
+            self.assertEqual(src.shape, (377, 397))
+            self.assertTrue(src.profile['tiled'])
+            self.assertEqual(src.compression.value, 'LZW')
+        self.assertEqual(sorted(os.listdir(scene)), before)
+
+    def test_warped_file_mode(self):
+        scene = os.path.join(self.directory, 'LC80390272015237LGN01')
+        tif = os.path.join(scene, 'LC08_L1TP_039027_20150825_20170225_01_T1_B3.TIF')
+        os.chmod(tif, 0o644)
+        # the temporary of a killed warp is not a band of the scene
+        leftover = os.path.join(scene, '.{}.x1y2z3.tif.part'.format(os.path.basename(tif)))
+        with open(leftover, 'w') as f:
+            f.write('partial')
+
+        timings = warped_vrt.warp_vrt(self.directory)
+        self.assertIn(tif, timings)
+        self.assertNotIn(leftover, timings)
+        self.assertEqual(os.stat(tif).st_mode & 0o777, 0o644)
+
+    def test_warped_without_manifest(self):
+        with open(os.path.join(self.directory, 'resample_meta.txt'), 'w') as f:
+            f.write('warped')
+        with mock.patch('sys.stdout', new_callable=StringIO) as stdout:
+            self.assertEqual(warped_vrt.warp_vrt(self.directory), OrderedDict())
+            self.assertIsNone(warped_vrt.warp_vrt(self.directory, return_profile=True))
+        self.assertEqual(stdout.getvalue(), '')
+
+    def test_resume_from_manifest(self):
+        first = warped_vrt.warp_vrt(self.directory)
+        manifest = warped_vrt.WarpManifest(self.directory)
+        statuses = [manifest.files[os.path.relpath(p, self.directory)]['status'] for p in first]
+        self.assertEqual(statuses, ['skipped', 'warped'])
+
+        self.assertEqual(len(warped_vrt.warp_vrt(self.directory)), 0)
+
+        # a new scene added to the archive is the only file warped on the next run
+        new_scene = os.path.join(self.directory, 'LC80390272015253LGN01')
+        shutil.copytree(os.path.join(DATA, 'vrt_test', 'LC80390272015237LGN01'), new_scene)
+        second = warped_vrt.warp_vrt(self.directory)
+        self.assertEqual([os.path.dirname(p) for p in second], [new_scene])
+        with rasopen(list(second)[0], 'r') as src:
+            self.assertEqual(src.shape, (377, 397))
+
+
 if __name__ == '__main__':
     unittest.main()
 
@@ -0,0 +1,117 @@
+# ===============================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+import os
+import shutil
+import threading
+import unittest
+from tempfile import mkdtemp
+
+import numpy as np
+from rasterio import open as rasopen
+
+from sat_image.image import Landsat5
+from sat_image.pipeline import export_products
+from sat_image.writer import SCALING, AsyncWriter
+
+DATA = os.path.join(os.path.dirname(__file__), 'data', 'fmask_test')
+
+
+class WriterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp = mkdtemp()
+        self.l5 = Landsat5(os.path.join(DATA, 'lt5_fmask'))
+        self.ndvi = self.l5.ndvi()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp)
+
+    def test_save_array(self):
+        geometry = self.l5.rasterio_geometry.copy()
+        plain = os.path.join(self.temp, 'ndvi.tif')
+        self.l5.save_array(self.ndvi, plain)
+        self.assertEqual(self.l5.rasterio_geometry, geometry)
+
+        with rasopen(plain, 'r') as src:
+            self.assertEqual(src.profile['tiled'], True)
+            self.assertEqual(src.compression.value, 'DEFLATE')
+            np.testing.assert_array_equal(src.read(1), self.ndvi)
+
+    def test_scaled_cog(self):
+        dtype, scale, offset = SCALING['ndvi']
+        scaled = os.path.join(self.temp, 'ndvi_int16.tif')
+        self.l5.save_array(self.ndvi, scaled, dtype=dtype, scale=scale, offset=offset, cog=True)
+        self.assertEqual(self.l5.rasterio_geometry['dtype'], 'uint8')
+
+        with rasopen(scaled, 'r') as src:
+            self.assertEqual(src.dtypes[0], 'int16')
+            self.assertEqual(src.overviews(1), [2, 4])
+            self.assertEqual(src.block_shapes[0], (256, 256))
+            stored = src.read(1)
+            values = stored * src.scales[0] + src.offsets[0]
+            nodata = stored == src.nodata
+
+        np.testing.assert_array_equal(nodata, np.isnan(self.ndvi))
+        np.testing.assert_allclose(values[~nodata], self.ndvi[~nodata], atol=scale / 2 + 1e-7)
+        self.assertLess(os.path.getsize(scaled), self.ndvi.nbytes / 2)
+
+    def test_async_writer(self):
+        paths = [os.path.join(self.temp, '{}.tif'.format(i)) for i in range(4)]
+        with AsyncWriter(max_pending=2) as writer:
+            for i, path in enumerate(paths):
+                self.l5.save_array(self.ndvi + i, path, writer=writer)
+        for i, path in enumerate(paths):
+            with rasopen(path, 'r') as src:
+                np.testing.assert_array_equal(src.read(1), self.ndvi + i)
+
+        # at most max_pending calls are queued or running
+        release, running, peak = threading.Event(), [], []
+
+        def work():
+            running.append(1)
+            peak.append(len(running))
+            release.wait()
+            running.pop()
+
+        writer = AsyncWriter(max_pending=2, workers=4)
+        submitter = threading.Thread(target=lambda: [writer.submit(work) for _ in range(5)])
+        submitter.start()
+        submitter.join(0.5)
+        self.assertTrue(submitter.is_alive())
+        release.set()
+        submitter.join()
+        writer.close()
+        self.assertEqual(max(peak), 2)
+
+        # a failed write is raised by the next call
+        writer = AsyncWriter()
+        self.l5.save_array(self.ndvi, os.path.join(self.temp, 'missing', 'ndvi.tif'), writer=writer)
+        with self.assertRaises(Exception):
+            writer.flush()
+        writer.close()
+
+    def test_background_export(self):
+        serial, background = [os.path.join(self.temp, '{}.tif'.format(x)) for x in ['serial', 'background']]
+        export_products(self.l5, serial, ('ndvi', 'lst'), block_size=256)
+        export_products(self.l5, background, ('ndvi', 'lst'), block_size=256, background=True)
+        with rasopen(serial, 'r') as a, rasopen(background, 'r') as b:
+            np.testing.assert_array_equal(a.read(), b.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
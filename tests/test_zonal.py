@@ -0,0 +1,98 @@
+# ===============================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+import os
+import shutil
+import unittest
+from tempfile import mkdtemp
+from unittest import mock
+
+import numpy as np
+from shapely.geometry import box, mapping
+
+from sat_image.image import Landsat5, Landsat8
+from sat_image.zonal import ZoneIndex, zonal_stats
+
+DATA = os.path.join(os.path.dirname(__file__), 'data', 'fmask_test')
+
+
+class ZonalStatsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp = mkdtemp()
+        self.l5 = Landsat5(os.path.join(DATA, 'lt5_fmask'))
+        self.l8 = Landsat8(os.path.join(DATA, 'lc8_fmask'))
+        x, y = 713835.0, 5292525.0
+        # pixel boxes (row slice, col slice) of each field, the last outside the scene
+        self.cells = [(slice(10, 60), slice(20, 90)), (slice(300, 420), slice(200, 260)),
+                      (slice(500, 624), slice(550, 623))]
+        self.features = [{'type': 'Feature', 'properties': {'name': 'field_{}'.format(i)},
+                          'geometry': mapping(box(x + c.start * 30, y - r.stop * 30,
+                                                  x + c.stop * 30, y - r.start * 30))}
+                         for i, (r, c) in enumerate(self.cells)]
+        self.features.append({'type': 'Feature', 'properties': {'name': 'outside'},
+                              'geometry': mapping(box(0, 0, 30, 30))})
+
+    def tearDown(self):
+        shutil.rmtree(self.temp)
+
+    def test_zonal_stats(self):
+        zones = ZoneIndex(self.features, self.l5, id_field='name', cache_dir=self.temp)
+        self.assertEqual(len(os.listdir(self.temp)), 1)
+        cached = ZoneIndex(self.features, self.l5, id_field='name', cache_dir=self.temp)
+        np.testing.assert_array_equal(cached.labels, zones.labels)
+        self.assertEqual(cached.ids, zones.ids)
+
+        for image in [self.l5, self.l8]:
+            result = image.zonal_stats(zones, 'ndvi', stats=('count', 'mean', 'std', 'min', 'max'),
+                                       percentiles=(10, 50))
+            blocked = zonal_stats(image, zones, 'ndvi', stats=('count', 'mean', 'min', 'max'),
+                                  block_size=128)
+            self.assertEqual(result['zone'], ['field_0', 'field_1', 'field_2', 'outside'])
+
+            ndvi, valid = image.ndvi(), image.mask() > 0
+            for i, (r, c) in enumerate(self.cells):
+                values = ndvi[r, c][valid[r, c] & ~np.isnan(ndvi[r, c])].astype(np.float64)
+                self.assertEqual(result['count'][i], values.size)
+                self.assertAlmostEqual(result['mean'][i], values.mean(), places=9)
+                self.assertAlmostEqual(result['std'][i], values.std(), places=6)
+                self.assertEqual(result['min'][i], values.min())
+                self.assertEqual(result['max'][i], values.max())
+                self.assertAlmostEqual(result['p10'][i], np.percentile(values, 10), places=9)
+                self.assertAlmostEqual(result['p50'][i], np.median(values), places=9)
+                self.assertEqual(blocked['count'][i], values.size)
+                self.assertAlmostEqual(blocked['mean'][i], values.mean(), places=9)
+                self.assertEqual(blocked['max'][i], values.max())
+            self.assertEqual(result['count'][3], 0)
+            self.assertTrue(np.isnan(result['mean'][3]))
+
+    def test_std_large_values(self):
+        # values far from zero relative to their spread, as temperatures in K
+        zones = ZoneIndex(self.features, self.l5, id_field='name')
+        offset = lambda view, product: view.ndvi().astype(np.float64) + 1e7
+        ndvi, valid = self.l5.ndvi(), self.l5.mask() > 0
+        with mock.patch('sat_image.zonal.get_product', side_effect=offset):
+            for block_size in [None, 128]:
+                result = zonal_stats(self.l5, zones, 'ndvi', stats=('mean', 'std'), block_size=block_size)
+                for i, (r, c) in enumerate(self.cells):
+                    values = ndvi[r, c][valid[r, c] & ~np.isnan(ndvi[r, c])].astype(np.float64)
+                    self.assertAlmostEqual(result['mean'][i], values.mean() + 1e7, places=6)
+                    self.assertAlmostEqual(result['std'][i], values.std(), places=7)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================